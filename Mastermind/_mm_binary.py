@@ -0,0 +1,192 @@
+import struct
+
+# Compact binary encoding for Mastermind payloads, used instead of JSON once both ends
+# have agreed on MM_PROTOCOL_VERSION 2 or later.
+#
+# Every payload starts with a fixed header: the encoding version and the message kind.
+# Commands ({'ident', 'command', 'args'} dicts) get a fixed layout of two strings and a
+# value, bare strings (jsonpickled localmaps) are a single length prefixed string and
+# everything else is a typed value. Strings are written as raw utf-8 so large jsonpickle
+# payloads no longer get escaped a second time by json.dumps.
+
+BINARY_VERSION = 1
+
+KIND_VALUE = 0
+KIND_COMMAND = 1
+KIND_STRING = 2
+
+TAG_NONE = 0
+TAG_FALSE = 1
+TAG_TRUE = 2
+TAG_INT = 3
+TAG_FLOAT = 4
+TAG_STR = 5
+TAG_LIST = 6
+TAG_DICT = 7
+TAG_BYTES = 8
+TAG_BIGINT = 9
+
+_HEADER = struct.Struct("!BB")
+_TAG = struct.Struct("!B")
+_LENGTH = struct.Struct("!I")
+_INT = struct.Struct("!q")
+_FLOAT = struct.Struct("!d")
+
+_COMMAND_KEYS = frozenset(("ident", "command", "args"))
+
+_TAG_NONE = _TAG.pack(TAG_NONE)
+_TAG_FALSE = _TAG.pack(TAG_FALSE)
+_TAG_TRUE = _TAG.pack(TAG_TRUE)
+_TAG_INT = _TAG.pack(TAG_INT)
+_TAG_FLOAT = _TAG.pack(TAG_FLOAT)
+_TAG_STR = _TAG.pack(TAG_STR)
+_TAG_LIST = _TAG.pack(TAG_LIST)
+_TAG_DICT = _TAG.pack(TAG_DICT)
+_TAG_BYTES = _TAG.pack(TAG_BYTES)
+_TAG_BIGINT = _TAG.pack(TAG_BIGINT)
+
+
+class MastermindBinaryError(ValueError):
+    pass
+
+
+def _encode_str(parts, value):
+    data = value.encode("utf-8")
+    parts.append(_LENGTH.pack(len(data)))
+    parts.append(data)
+
+
+def _encode_value(parts, value):
+    # bool before int, bool is a subclass of int.
+    if value is None:
+        parts.append(_TAG_NONE)
+    elif value is True:
+        parts.append(_TAG_TRUE)
+    elif value is False:
+        parts.append(_TAG_FALSE)
+    elif isinstance(value, str):
+        parts.append(_TAG_STR)
+        _encode_str(parts, value)
+    elif isinstance(value, int):
+        if -(2 ** 63) <= value < 2 ** 63:
+            parts.append(_TAG_INT)
+            parts.append(_INT.pack(value))
+        else:
+            parts.append(_TAG_BIGINT)
+            _encode_str(parts, str(value))
+    elif isinstance(value, float):
+        parts.append(_TAG_FLOAT)
+        parts.append(_FLOAT.pack(value))
+    elif isinstance(value, (list, tuple)):
+        parts.append(_TAG_LIST)
+        parts.append(_LENGTH.pack(len(value)))
+        for item in value:
+            _encode_value(parts, item)
+    elif isinstance(value, dict):
+        parts.append(_TAG_DICT)
+        parts.append(_LENGTH.pack(len(value)))
+        for key, item in value.items():
+            _encode_value(parts, key)
+            _encode_value(parts, item)
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        parts.append(_TAG_BYTES)
+        parts.append(_LENGTH.pack(len(value)))
+        parts.append(bytes(value))
+    else:
+        raise MastermindBinaryError(
+            "Can't binary encode a value of type {}.".format(type(value).__name__)
+        )
+
+
+def encode(data):
+    parts = []
+    if isinstance(data, str):
+        parts.append(_HEADER.pack(BINARY_VERSION, KIND_STRING))
+        _encode_str(parts, data)
+    elif (
+        isinstance(data, dict)
+        and len(data) == 3
+        and _COMMAND_KEYS.issuperset(data.keys())
+        and isinstance(data["ident"], str)
+        and isinstance(data["command"], str)
+    ):
+        parts.append(_HEADER.pack(BINARY_VERSION, KIND_COMMAND))
+        _encode_str(parts, data["ident"])
+        _encode_str(parts, data["command"])
+        _encode_value(parts, data["args"])
+    else:
+        parts.append(_HEADER.pack(BINARY_VERSION, KIND_VALUE))
+        _encode_value(parts, data)
+    return b"".join(parts)
+
+
+def _decode_str(view, offset):
+    length = _LENGTH.unpack_from(view, offset)[0]
+    offset += _LENGTH.size
+    end = offset + length
+    if end > len(view):
+        raise MastermindBinaryError("String runs past the end of the payload.")
+    return str(view[offset:end], "utf-8"), end
+
+
+def _decode_value(view, offset):
+    tag = view[offset]
+    offset += 1
+    if tag == TAG_STR:
+        return _decode_str(view, offset)
+    if tag == TAG_INT:
+        return _INT.unpack_from(view, offset)[0], offset + _INT.size
+    if tag == TAG_NONE:
+        return None, offset
+    if tag == TAG_TRUE:
+        return True, offset
+    if tag == TAG_FALSE:
+        return False, offset
+    if tag == TAG_FLOAT:
+        return _FLOAT.unpack_from(view, offset)[0], offset + _FLOAT.size
+    if tag == TAG_LIST:
+        count = _LENGTH.unpack_from(view, offset)[0]
+        offset += _LENGTH.size
+        ret = []
+        for _ in range(count):
+            item, offset = _decode_value(view, offset)
+            ret.append(item)
+        return ret, offset
+    if tag == TAG_DICT:
+        count = _LENGTH.unpack_from(view, offset)[0]
+        offset += _LENGTH.size
+        ret = {}
+        for _ in range(count):
+            key, offset = _decode_value(view, offset)
+            ret[key], offset = _decode_value(view, offset)
+        return ret, offset
+    if tag == TAG_BYTES:
+        length = _LENGTH.unpack_from(view, offset)[0]
+        offset += _LENGTH.size
+        return bytes(view[offset : offset + length]), offset + length
+    if tag == TAG_BIGINT:
+        value, offset = _decode_str(view, offset)
+        return int(value), offset
+    raise MastermindBinaryError("Unknown type tag {}.".format(tag))
+
+
+def decode(payload):
+    view = memoryview(payload)
+    version, kind = _HEADER.unpack_from(view)
+    if version != BINARY_VERSION:
+        raise MastermindBinaryError("Unsupported binary encoding version {}.".format(version))
+    offset = _HEADER.size
+    if kind == KIND_STRING:
+        data, offset = _decode_str(view, offset)
+    elif kind == KIND_COMMAND:
+        ident, offset = _decode_str(view, offset)
+        command, offset = _decode_str(view, offset)
+        args, offset = _decode_value(view, offset)
+        data = {"ident": ident, "command": command, "args": args}
+    elif kind == KIND_VALUE:
+        data, offset = _decode_value(view, offset)
+    else:
+        raise MastermindBinaryError("Unknown message kind {}.".format(kind))
+    if offset != len(view):
+        raise MastermindBinaryError("Trailing bytes after the payload.")
+    return data
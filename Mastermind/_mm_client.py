@@ -1,8 +1,18 @@
 import socket
 import select
+import time
+from collections import deque
 
 import Mastermind._mm_netutil as netutil
-from Mastermind._mm_constants import MM_TCP, MM_UDP, MM_UNKNOWN
+from Mastermind._mm_constants import (
+    MM_TCP,
+    MM_UDP,
+    MM_UNKNOWN,
+    MM_PROTOCOL_LEGACY,
+    MM_MAX_MESSAGE_SIZE,
+    MM_UDP_RELIABLE,
+    MM_UDP_RESEND_TIME,
+)
 from Mastermind._mm_errors import (
     MastermindErrorClient,
     MastermindWarningClient,
@@ -20,6 +30,9 @@ class MastermindClientBase(object):
         self._mm_timeout_connect = timeout_connect
         self._mm_timeout_receive = timeout_receive
         self._mm_connected = False
+        self._mm_pending = deque()  # messages completed by an earlier read but not yet returned.
+        # we speak the original JSON protocol until the server answers our MM_HELLO.
+        self._mm_protocol_version = MM_PROTOCOL_LEGACY
 
     def __del__(self):
         if self._mm_connected:
@@ -38,12 +51,16 @@ class MastermindClientBase(object):
         self._mm_ip = ip
         self._mm_port = port
         self._mm_connected = True
+        self._mm_protocol_version = MM_PROTOCOL_LEGACY
+        # servers that predate the handshake ignore it and we stay on the legacy protocol.
+        self.send(netutil.hello())
 
     def disconnect(self):
         if not self._mm_connected:
             MastermindWarningClient("Client is already disconnected!")
             return
         self._mm_socket.close()
+        self._mm_pending.clear()
         self._mm_ip = MM_UNKNOWN
         self._mm_port = MM_UNKNOWN
         self._mm_connected = False
@@ -54,7 +71,12 @@ class MastermindClientBase(object):
                 "Client must be connected with .connect() to send data!"
             )
         if not netutil.packet_send(
-            self._mm_socket, (self._mm_connection_type, None), data, compression
+            self._mm_socket,
+            (self._mm_connection_type, None),
+            data,
+            compression,
+            netutil.protocol_encoding(self._mm_protocol_version),
+            netutil.protocol_fragments(self._mm_protocol_version),
         ):
             raise MastermindErrorClient(
                 "Client sending has failed!  Call .disconnect() and then .connect() to try to reestablish the connection."
@@ -66,46 +88,66 @@ class MastermindClientBase(object):
                 "Client must be connected with .connect() to receive data!"
             )
 
+        if len(self._mm_pending) > 0:
+            return self._mm_pending.popleft()
+
         if blocking:
-            if self._mm_timeout_receive == None:
-                input_ready, output_ready, except_ready = select.select(
-                    [self._mm_socket], [], []
-                )
-            else:
-                input_ready, output_ready, except_ready = select.select(
-                    [self._mm_socket], [], [], self._mm_timeout_receive
-                )
-                if len(input_ready) == 0:
+            # keep reading until at least one whole message has arrived.
+            while len(self._mm_pending) == 0:
+                if not self._mm_wait(self._mm_timeout_receive):
                     raise MastermindErrorClient(
                         "Client receiving has timed out!  Call .disconnect() and then .connect() to try to reestablish the connection."
                     )
-            data, status = self._mm_receive_func()
+                self._mm_receive()
         else:
-            input_ready, output_ready, except_ready = select.select(
-                [self._mm_socket], [], [], 0.001
-            )
-            if len(input_ready) > 0:
-                data, status = self._mm_receive_func()
-            else:
+            if self._mm_wait(0.001):
+                self._mm_receive()
+            if len(self._mm_pending) == 0:
                 return None
 
+        return self._mm_pending.popleft()
+
+    def _mm_wait(self, timeout):
+        # True once there is something to read, False if timeout (None is forever) ran out first.
+        input_ready, output_ready, except_ready = select.select(
+            [self._mm_socket], [], [], timeout
+        )
+        return len(input_ready) > 0
+
+    def _mm_receive(self):
+        messages, status = self._mm_receive_func()
         if status == False:
             raise MastermindErrorClient(
                 "Client receiving has failed!  Call .disconnect() and then .connect() to try to reestablish the connection."
             )
-        else:
-            return data
+        for data in messages:
+            if netutil.is_hello(data):
+                self._mm_hello(data)
+                continue
+            self._mm_pending.append(data)
+
+    def _mm_hello(self, data):
+        self._mm_protocol_version = netutil.negotiate(data)
 
 
 class MastermindClientTCP(MastermindClientBase):
-    def __init__(self, timeout_connect=None, timeout_receive=None):
+    def __init__(
+        self,
+        timeout_connect=None,
+        timeout_receive=None,
+        max_message_size=MM_MAX_MESSAGE_SIZE,
+    ):
         MastermindClientBase.__init__(self, MM_TCP, timeout_connect, timeout_receive)
+        self._mm_max_message_size = max_message_size
 
     def _mm_make_connection(self, ip, port):
         self._mm_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self._mm_socket.settimeout(self._mm_timeout_connect)
         try:
             self._mm_socket.connect((ip, port))
+            self._mm_receive_buffer = netutil.PacketReceiveBuffer(
+                max_message_size=self._mm_max_message_size
+            )
         except:
             self._mm_socket.close()
             raise MastermindErrorSocket(
@@ -117,6 +159,106 @@ class MastermindClientTCP(MastermindClientBase):
             )
 
     def _mm_receive_func(self):
-        data, status = netutil.packet_recv_tcp(self._mm_socket)
-        return data, status
+        messages, status = netutil.packet_recv_tcp(
+            self._mm_socket, self._mm_receive_buffer
+        )
+        return messages, status
 
+
+
+class MastermindClientUDP(MastermindClientBase):
+    def __init__(self, timeout_connect=None, timeout_receive=None):
+        MastermindClientBase.__init__(self, MM_UDP, timeout_connect, timeout_receive)
+
+    def _mm_make_connection(self, ip, port):
+        self._mm_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            # only so send() and recv() know where to go, nothing goes over the wire yet.
+            self._mm_socket.connect((ip, port))
+            self._mm_socket.setblocking(False)
+            self._mm_session = netutil.PacketUDPSession()
+        except:
+            self._mm_socket.close()
+            raise MastermindErrorSocket(
+                'A UDP socket for "'
+                + ip
+                + '" on port '
+                + str(port)
+                + " could not be created."
+            )
+
+    def disconnect(self):
+        if self._mm_connected:
+            try:
+                self._mm_socket.send(self._mm_session.disconnect_datagram())
+            except OSError:
+                pass
+        MastermindClientBase.disconnect(self)
+
+    def send(self, data, compression=None, channel=MM_UDP_RELIABLE):
+        if not self._mm_connected:
+            raise MastermindErrorClient(
+                "Client must be connected with .connect() to send data!"
+            )
+        datagram = netutil.packet_encode_udp(
+            self._mm_session,
+            data,
+            compression,
+            netutil.protocol_encoding(self._mm_protocol_version),
+            channel,
+            time.time(),
+        )
+        self._mm_resend()
+        try:
+            self._mm_socket.send(datagram)
+        except OSError:
+            # reliable datagrams get resent, anything else was only ever best effort.
+            pass
+
+    def _mm_resend(self):
+        for datagram in self._mm_session.resend(time.time()):
+            try:
+                self._mm_socket.send(datagram)
+            except OSError:
+                pass
+        if self._mm_session.failed:
+            raise MastermindErrorClient(
+                "Client sending has failed!  The server stopped acknowledging.  Call .disconnect() and then .connect() to try to reestablish the connection."
+            )
+
+    def _mm_wait(self, timeout):
+        # wake up every MM_UDP_RESEND_TIME while waiting so lost datagrams get resent.
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            self._mm_resend()
+            wait = MM_UDP_RESEND_TIME
+            if deadline is not None:
+                wait = min(wait, max(deadline - time.time(), 0.0))
+            if MastermindClientBase._mm_wait(self, wait):
+                return True
+            if deadline is not None and time.time() >= deadline:
+                return False
+
+    def _mm_receive_func(self):
+        messages = []
+        while True:
+            try:
+                datagram = self._mm_socket.recv(65535)
+            except (BlockingIOError, InterruptedError):
+                return messages, True
+            except OSError:
+                return None, False  # e.g. nothing listening on the server's port.
+            try:
+                received, replies, disconnected = netutil.packet_recv_udp(
+                    self._mm_session, datagram
+                )
+            except ValueError:
+                return None, False
+            if disconnected:
+                return None, False
+            for reply in replies:
+                try:
+                    self._mm_socket.send(reply)
+                except OSError:
+                    pass
+            messages.extend(received)
@@ -0,0 +1,175 @@
+import collections
+import re
+import time
+import zlib
+
+from Mastermind._mm_constants import (
+    MM_MIN_PAYLOAD_COMPRESSION_SIZE,
+    MM_FLAG_STREAM,
+    MM_FLAG_STREAM_RESET,
+    MM_STREAM_LEVEL_MIN_FRAMES,
+    MM_DICTIONARY_SIZE,
+    MM_COMPRESSION_SAMPLE_RATE,
+)
+
+# zlib ends every Z_SYNC_FLUSH with an empty stored block. Both ends know that so it isn't sent.
+_SYNC_FLUSH_TRAILER = b"\x00\x00\xff\xff"
+
+# thread_time is only in python 3.7+, process_time is close enough for a single busy thread.
+_cpu_time = getattr(time, "thread_time", time.process_time)
+
+
+def choose_compression_level(size, load):
+    """Picks a zlib level for a payload of size bytes while the server is at load (0.0 - 1.0)."""
+    if size < MM_MIN_PAYLOAD_COMPRESSION_SIZE:
+        return 0
+    if load >= 0.75 or size < 1024:
+        return 1
+    if load < 0.25 and size >= 16384:
+        return 9
+    return 6
+
+
+class StreamCompressor(object):
+    """One zlib stream per connection, flushed with Z_SYNC_FLUSH after every payload.
+
+    Later payloads can back-reference earlier ones, which is where near identical
+    localmaps get most of their savings. Changing level means starting a new stream,
+    so the level is only reconsidered every MM_STREAM_LEVEL_MIN_FRAMES payloads.
+    """
+
+    def __init__(self, dictionary=None):
+        self.dictionary = dictionary
+        self.level = 0
+        self._compressobj = None
+        self._frames_since_reset = 0
+
+    def _reset(self, level):
+        if self.dictionary:
+            self._compressobj = zlib.compressobj(
+                level, zlib.DEFLATED, zlib.MAX_WBITS, zdict=self.dictionary
+            )
+        else:
+            self._compressobj = zlib.compressobj(level)
+        self.level = level
+        self._frames_since_reset = 0
+
+    def compress(self, payload, level):
+        """Returns the header flags and the compressed bytes for payload."""
+        flags = MM_FLAG_STREAM
+        if self._compressobj is None or (
+            level != self.level
+            and self._frames_since_reset >= MM_STREAM_LEVEL_MIN_FRAMES
+        ):
+            self._reset(level)
+            flags |= MM_FLAG_STREAM_RESET
+        self._frames_since_reset += 1
+        data = self._compressobj.compress(payload) + self._compressobj.flush(
+            zlib.Z_SYNC_FLUSH
+        )
+        if data.endswith(_SYNC_FLUSH_TRAILER):
+            data = data[: -len(_SYNC_FLUSH_TRAILER)]
+        return flags | self.level, data
+
+
+class StreamDecompressor(object):
+    def __init__(self, dictionary=None):
+        self.dictionary = dictionary
+        self._decompressobj = None
+
+    def decompress(self, data, reset):
+        if reset or self._decompressobj is None:
+            if self.dictionary:
+                self._decompressobj = zlib.decompressobj(
+                    zlib.MAX_WBITS, zdict=self.dictionary
+                )
+            else:
+                self._decompressobj = zlib.decompressobj()
+        return self._decompressobj.decompress(bytes(data) + _SYNC_FLUSH_TRAILER)
+
+
+class CompressionStats(object):
+    """Bytes and CPU spent compressing one connection's traffic.
+
+    Every MM_COMPRESSION_SAMPLE_RATE-th payload is also compressed the old way,
+    from scratch at level 9, so we can estimate what we're saving against it.
+    """
+
+    def __init__(self):
+        self.frames = 0
+        self.raw_bytes = 0
+        self.wire_bytes = 0
+        self.cpu_seconds = 0.0
+        self.sampled_raw_bytes = 0
+        self.sampled_wire_bytes = 0
+        self.sampled_baseline_bytes = 0
+        self.sampled_cpu_seconds = 0.0
+        self.sampled_baseline_cpu_seconds = 0.0
+
+    def record(self, payload, wire_bytes, cpu_seconds):
+        self.frames += 1
+        self.raw_bytes += len(payload)
+        self.wire_bytes += wire_bytes
+        self.cpu_seconds += cpu_seconds
+        if self.frames % MM_COMPRESSION_SAMPLE_RATE == 0:
+            start = _cpu_time()
+            baseline = zlib.compress(payload, 9)
+            self.sampled_baseline_cpu_seconds += _cpu_time() - start
+            self.sampled_raw_bytes += len(payload)
+            self.sampled_wire_bytes += wire_bytes
+            self.sampled_baseline_bytes += len(baseline)
+            self.sampled_cpu_seconds += cpu_seconds
+
+    def estimated_baseline(self):
+        """(bytes, cpu seconds) that level 9 from scratch would have cost for the same traffic."""
+        if self.sampled_raw_bytes == 0:
+            return self.wire_bytes, self.cpu_seconds
+        scale = self.raw_bytes / self.sampled_raw_bytes
+        return (
+            int(self.sampled_baseline_bytes * scale),
+            self.sampled_baseline_cpu_seconds * scale,
+        )
+
+    def report(self):
+        baseline_bytes, baseline_cpu = self.estimated_baseline()
+        return (
+            "{} frames, {} bytes sent as {} ({} fewer than level 9 per packet), "
+            "{:.3f}s compressing ({:.3f}s less than level 9 per packet)".format(
+                self.frames,
+                self.raw_bytes,
+                self.wire_bytes,
+                baseline_bytes - self.wire_bytes,
+                self.cpu_seconds,
+                baseline_cpu - self.cpu_seconds,
+            )
+        )
+
+
+_TOKEN = re.compile(rb"[^,{}\[\]]+[,{}\[\]]?")
+
+
+def train_dictionary(samples, size=MM_DICTIONARY_SIZE):
+    """Builds a zlib preset dictionary from typical payloads.
+
+    Payloads are split on JSON punctuation and the fragments seen most often are
+    packed into the dictionary, most valuable last since zlib prefers the nearest match.
+    """
+    counts = collections.Counter()
+    for sample in samples:
+        if isinstance(sample, str):
+            sample = sample.encode("utf-8")
+        # count each fragment once per sample so one huge payload can't dominate.
+        counts.update(set(token for token in _TOKEN.findall(sample) if len(token) > 3))
+
+    common = [token for token, count in counts.items() if count > 1]
+    common.sort(key=lambda token: counts[token] * len(token), reverse=True)
+
+    dictionary = []
+    used = 0
+    for token in common:
+        if used + len(token) > size:
+            continue
+        dictionary.append(token)
+        used += len(token)
+    dictionary.reverse()
+    return b"".join(dictionary)
@@ -10,3 +10,74 @@ MM_MAX_PAYLOAD_SIZE = 65535
 
 # Minimum payload size to consider compression. Otherwise the payload may result in a net loss.
 MM_MIN_PAYLOAD_COMPRESSION_SIZE = 128
+
+# Bytes allowed to wait in a connection's outbound queue before the send policy kicks in.
+MM_SEND_QUEUE_MAX_SIZE = 1048576
+
+# Queued frames are coalesced into writes of up to this many bytes.
+MM_SEND_COALESCE_SIZE = 65536
+
+# What to do with a client that falls further behind than MM_SEND_QUEUE_MAX_SIZE.
+MM_SEND_DROP = 1  # drop the oldest unsent frames.
+MM_SEND_DISCONNECT = 2  # disconnect the client.
+
+# Seconds a terminated connection keeps writing what is still queued before the socket closes.
+MM_SEND_LINGER_TIME = 2.0
+
+# Wire protocol versions. 1 is the original JSON-only protocol, 2 adds binary payloads,
+# 3 adds streamed compression, 4 adds fragmented messages. Peers start at 1 and move up
+# once the MM_HELLO handshake agrees on a higher version.
+MM_PROTOCOL_LEGACY = 1
+MM_PROTOCOL_VERSION = 4
+MM_HELLO = "mm_hello"
+MM_HELLO_DICTIONARY = "mm_zdict"  # optional base64 preset dictionary in the server's reply.
+
+# Payload encodings.
+MM_ENCODING_JSON = 0
+MM_ENCODING_BINARY = 1
+
+# The byte after the length prefix holds the compression level (0-9) in its low bits
+# and these flags in its high bits. Legacy peers only ever see plain levels.
+MM_FLAG_COMPRESSION_MASK = 0x0F
+MM_FLAG_BINARY = 0x10
+MM_FLAG_STREAM = 0x20  # payload continues the connection's zlib stream.
+MM_FLAG_STREAM_RESET = 0x40  # start a new zlib stream with this payload.
+MM_FLAG_FRAGMENT = 0x80  # one piece of a message too big for a single frame.
+
+# Messages bigger than this are split into fragments of at most this many bytes.
+# Has to leave room for the fragment header under MM_MAX_PAYLOAD_SIZE.
+MM_FRAGMENT_SIZE = 32768
+
+# Largest message we're willing to reassemble from fragments. This is the real DOS
+# protection once fragments are in play, MM_MAX_PAYLOAD_SIZE only bounds one frame.
+MM_MAX_MESSAGE_SIZE = 16777216
+
+# A streaming compressor keeps its level for at least this many payloads, changing level restarts the stream.
+MM_STREAM_LEVEL_MIN_FRAMES = 64
+
+# zlib preset dictionaries can't use more than the 32k window.
+MM_DICTIONARY_SIZE = 32768
+
+# One in this many payloads is also compressed the old way to estimate the savings.
+MM_COMPRESSION_SAMPLE_RATE = 16
+
+# UDP datagrams start with a kind, a channel and a sequence number. Channel MM_UDP_RELIABLE
+# is acknowledged, resent and delivered in order. Every other channel is unreliable and
+# only ever delivers something newer than what it delivered last, for state where only
+# the latest value matters (positions, tile deltas).
+MM_UDP_RELIABLE = 0
+MM_UDP_DATA = 1
+MM_UDP_ACK = 2
+MM_UDP_DISCONNECT = 3
+
+# Unacknowledged reliable datagrams are resent this often, and the peer is given up on
+# after this many resends of the same one.
+MM_UDP_RESEND_TIME = 0.2
+MM_UDP_MAX_RESENDS = 25
+
+# Reliable datagrams that arrive this far ahead of the next one we're waiting for are
+# dropped instead of buffered, the sender will resend them.
+MM_UDP_WINDOW = 1024
+
+# Largest payload that fits in a single IPv4 UDP datagram after our header.
+MM_UDP_MAX_PAYLOAD_SIZE = 65500
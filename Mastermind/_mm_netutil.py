@@ -1,33 +1,194 @@
+import base64
+import itertools
 import json
 import zlib
 import struct
+import threading
+from collections import deque, OrderedDict
 
-from Mastermind._mm_constants import MM_MAX, MM_TCP, MM_MAX_PAYLOAD_SIZE, MM_MIN_PAYLOAD_COMPRESSION_SIZE
+from Mastermind._mm_constants import (
+    MM_MAX,
+    MM_TCP,
+    MM_MAX_PAYLOAD_SIZE,
+    MM_MIN_PAYLOAD_COMPRESSION_SIZE,
+    MM_SEND_QUEUE_MAX_SIZE,
+    MM_SEND_COALESCE_SIZE,
+    MM_SEND_DROP,
+    MM_PROTOCOL_LEGACY,
+    MM_PROTOCOL_VERSION,
+    MM_HELLO,
+    MM_HELLO_DICTIONARY,
+    MM_ENCODING_JSON,
+    MM_ENCODING_BINARY,
+    MM_FLAG_COMPRESSION_MASK,
+    MM_FLAG_BINARY,
+    MM_FLAG_STREAM,
+    MM_FLAG_STREAM_RESET,
+    MM_FLAG_FRAGMENT,
+    MM_FRAGMENT_SIZE,
+    MM_MAX_MESSAGE_SIZE,
+    MM_UDP_RELIABLE,
+    MM_UDP_DATA,
+    MM_UDP_ACK,
+    MM_UDP_DISCONNECT,
+    MM_UDP_RESEND_TIME,
+    MM_UDP_MAX_RESENDS,
+    MM_UDP_WINDOW,
+    MM_UDP_MAX_PAYLOAD_SIZE,
+)
+import Mastermind._mm_binary as binary
+from Mastermind._mm_compression import (
+    choose_compression_level,
+    StreamCompressor,
+    StreamDecompressor,
+    CompressionStats,
+    _cpu_time,
+)
 
-def packet_send(sock, protocol_and_udpaddress, data, compression): #E.g.: =(MM_TCP,None)
-    if   compression ==  False: compression = 0
-    elif compression ==   None: compression = 0
-    elif compression ==   True: compression = 9
-    elif compression == MM_MAX: compression = 9
-    elif compression >       9: compression = 9
+# Frames are a network byte order length prefix followed by a compression byte and the payload.
+_LENGTH_PREFIX = struct.Struct('!I')
+
+# The receive buffer starts small and only grows up to a single full frame.
+_RECEIVE_BUFFER_INITIAL_SIZE = 16384
+
+# Fragment payloads start with the message id, the message's total size and this fragment's offset.
+_FRAGMENT_HEADER = struct.Struct('!BIII')
+
+# Coalesced frames are handed to sendmsg as separate buffers instead of being joined, up to this many.
+# Windows sockets have no sendmsg so they still get joined there.
+_SENDMSG_MAX_BUFFERS = 64
+
+# UDP datagrams start with their kind, channel and sequence number.
+_UDP_HEADER = struct.Struct('!BBI')
+
+# Message ids only need to tell consecutive messages apart, so one counter does for every connection.
+_message_ids = itertools.count(1)
 
-    # Convert to JSON and get length
-    data_str = json.dumps(data)
-    length = len(data_str)
 
+def compression_level(compression, size, load=0.0):
+    # True lets us pick a level for the payload size and server load, MM_MAX forces the best.
+    if   compression ==  False: return 0
+    elif compression ==   None: return 0
+    elif compression ==   True: return choose_compression_level(size, load)
+    elif compression == MM_MAX: return 9
+    elif compression >       9: return 9
+    return compression
+
+
+def packet_payload(data, encoding=MM_ENCODING_JSON):
+    # Convert to JSON (or the binary encoding the peer agreed to), returns the header flags and payload
+    if encoding == MM_ENCODING_BINARY:
+        return MM_FLAG_BINARY, binary.encode(data)
+    return 0, json.dumps(data).encode()
+
+
+def packet_body(flags, payload, compression, stats=None):
     # Enable compression as required and satisfies criteria
-    if compression > 0 and length >= MM_MIN_PAYLOAD_COMPRESSION_SIZE:
-        data_str = struct.pack( '!b', compression ) + zlib.compress(data_str.encode())
+    if compression > 0 and len(payload) >= MM_MIN_PAYLOAD_COMPRESSION_SIZE:
+        start = _cpu_time()
+        data_str = struct.pack( '!B', flags | compression ) + zlib.compress(payload, compression)
+        if stats is not None:
+            stats.record(payload, len(data_str), _cpu_time() - start)
     else:
-        data_str = struct.pack( '!b', 0 ) + data_str.encode()
+        data_str = struct.pack( '!B', flags ) + payload
+    return data_str
+
+
+def packet_frame(flags, payload, compression, stats=None, fragment=False):
+    data_str = packet_body(flags, payload, compression, stats)
+
+    if fragment:
+        return packet_fragments(data_str)
 
     # Binary encode the length prefix in network byte order - allowing for universal length decode
     length = len(data_str)
-    data_to_send = struct.pack('!I', length) + data_str
+    return _LENGTH_PREFIX.pack(length) + data_str
+
+
+def packet_fragments(data_str, fragment_size=MM_FRAGMENT_SIZE):
+    """Frames data_str, splitting it into MM_FLAG_FRAGMENT frames if it is bigger than fragment_size.
+
+    The fragments come back as one bytes object so they are always queued and written
+    back to back, the receiver rejects a message whose fragments are interleaved.
+    """
+    if len(data_str) <= fragment_size:
+        return _LENGTH_PREFIX.pack(len(data_str)) + data_str
+
+    # compression already happened on the whole message, the fragments just slice it up.
+    message_id = next(_message_ids) & 0xFFFFFFFF
+    data_view = memoryview(data_str)
+    frames = []
+    for offset in range(0, len(data_str), fragment_size):
+        chunk = data_view[offset : offset + fragment_size]
+        frames.append(_LENGTH_PREFIX.pack(_FRAGMENT_HEADER.size + len(chunk)))
+        frames.append(
+            _FRAGMENT_HEADER.pack(MM_FLAG_FRAGMENT, message_id, len(data_str), offset)
+        )
+        frames.append(chunk)
+    return b"".join(frames)
+
+
+def packet_encode(data, compression, encoding=MM_ENCODING_JSON, load=0.0, fragment=False):
+    flags, payload = packet_payload(data, encoding)
+    return packet_frame(
+        flags,
+        payload,
+        compression_level(compression, len(payload), load),
+        fragment=fragment,
+    )
+
+
+def hello(protocol_version=MM_PROTOCOL_VERSION, dictionary=None):
+    # The handshake is always plain JSON so peers that predate it can still read it.
+    data = {MM_HELLO: protocol_version}
+    if dictionary:
+        data[MM_HELLO_DICTIONARY] = base64.b64encode(dictionary).decode("ascii")
+    return data
+
+
+def is_hello(data):
+    return (
+        isinstance(data, dict)
+        and MM_HELLO in data
+        and set(data.keys()) <= set((MM_HELLO, MM_HELLO_DICTIONARY))
+    )
+
+
+def hello_dictionary(data):
+    if MM_HELLO_DICTIONARY not in data:
+        return None
+    return base64.b64decode(data[MM_HELLO_DICTIONARY])
+
+
+def negotiate(data):
+    try:
+        return max(MM_PROTOCOL_LEGACY, min(int(data[MM_HELLO]), MM_PROTOCOL_VERSION))
+    except (TypeError, ValueError):
+        return MM_PROTOCOL_LEGACY
+
+
+def protocol_encoding(protocol_version):
+    if protocol_version >= 2:
+        return MM_ENCODING_BINARY
+    return MM_ENCODING_JSON
+
+
+def protocol_streams_compression(protocol_version):
+    return protocol_version >= 3
+
+
+def protocol_fragments(protocol_version):
+    return protocol_version >= 4
+
+
+def packet_send(sock, protocol_and_udpaddress, data, compression, encoding=MM_ENCODING_JSON, fragment=False): #E.g.: =(MM_TCP,None)
+    data_to_send = packet_encode(
+        data, compression, encoding, fragment=fragment and protocol_and_udpaddress[0] == MM_TCP
+    )
 
     try:
         if protocol_and_udpaddress[0] == MM_TCP:
-            sock.send(data_to_send)
+            sock.sendall(data_to_send)
         else:
             if protocol_and_udpaddress[1] == None:
                 sock.send(data_to_send)
@@ -39,44 +200,416 @@ def packet_send(sock, protocol_and_udpaddress, data, compression): #E.g.: =(MM_T
         return False
 
 
-def packet_recv_tcp(sock):
-    #TODO: In all this, if recv returns 0, then shutdown *nicely*
-    info = b""
-    length_prefix_size = struct.calcsize('!I')
-    try:
-        while( len(info) ) < length_prefix_size:
-            got = sock.recv( length_prefix_size )
-            if got == b"": return (None,False)
-            info += got
+def _queued_size(frame):
+    # payloads waiting to be compressed count at their uncompressed size.
+    if isinstance(frame, bytes):
+        return len(frame)
+    return len(frame[1])
 
-    except:
-        return (None,False)
 
-    if info == "": return (None,False)
-    length = int(struct.unpack('!I', info[:length_prefix_size])[0])
+class PacketSendQueue(object):
+    """Bounded per-connection queue of encoded frames waiting to be written.
+
+    Frames are put() by whichever thread produced them and written by the
+    connection's I/O thread with flush(), so a slow client never blocks the
+    caller. flush() coalesces queued frames into one sendmsg() and keeps track of
+    partial sends. When more than max_size bytes are waiting the policy
+    decides what happens: MM_SEND_DROP throws away the oldest frames that
+    haven't started sending yet, MM_SEND_DISCONNECT refuses the frame so the
+    caller can drop the client.
+
+    Payloads queued with put_streamed() are only compressed when flush() gets
+    to them. Once one has been compressed the peer can't decompress anything
+    after it without it, so it and every frame in front of it are kept until
+    they're sent. Only frames behind the last compressed one are dropped, which
+    can leave the queue over max_size for a while.
+    """
+
+    def __init__(self, max_size=MM_SEND_QUEUE_MAX_SIZE, policy=MM_SEND_DROP):
+        self.max_size = max_size
+        self.policy = policy
+        self.dropped_frames = 0
+        self.dropped_bytes = 0
+        self._frames = deque()
+        self._size = 0  # bytes queued, including the unsent part of a partially sent frame.
+        self._offset = 0  # how much of the first frame has already been written.
+        self._kept = 0  # frames at the front that can't be dropped, see put().
+        self._lock = threading.Lock()
+        self.compressor = StreamCompressor()
+        self.stats = CompressionStats()
+        self.fragment = False  # split messages bigger than MM_FRAGMENT_SIZE, once the peer understands fragments.
+
+    def pending(self):
+        return self._size
+
+    def put_streamed(self, flags, payload, compression):
+        return self.put((flags, payload, compression))
+
+    def _materialize(self, index):
+        # compress a queued payload with the connection's stream now that it's about to be written.
+        frame = self._frames[index]
+        if isinstance(frame, bytes):
+            return frame
+        flags, payload, compression = frame
+        start = _cpu_time()
+        stream_flags, data = self.compressor.compress(payload, compression)
+        data_str = struct.pack('!B', flags | stream_flags) + data
+        self.stats.record(payload, len(data_str), _cpu_time() - start)
+        if self.fragment:
+            frame = packet_fragments(data_str)
+        else:
+            frame = _LENGTH_PREFIX.pack(len(data_str)) + data_str
+        self._frames[index] = frame
+        self._size += len(frame) - len(payload)
+        self._kept = max(self._kept, index + 1)
+        return frame
+
+    def put(self, frame):
+        with self._lock:
+            if self._size > 0 and self._size + _queued_size(frame) > self.max_size:
+                if self.policy != MM_SEND_DROP:
+                    return False
+                # never drop the head frame once it is partially written, or a frame that's already
+                # been compressed into the zlib stream, either would corrupt the stream.
+                keep = max(self._kept, 1 if self._offset > 0 else 0)
+                while len(self._frames) > keep and self._size + _queued_size(frame) > self.max_size:
+                    dropped = _queued_size(self._frames[keep])
+                    del self._frames[keep]
+                    self._size -= dropped
+                    self.dropped_frames += 1
+                    self.dropped_bytes += dropped
+            self._frames.append(frame)
+            self._size += _queued_size(frame)
+            return True
+
+    def flush(self, sock):
+        """Writes as much as the socket will take without blocking. Raises on socket errors."""
+        with self._lock:
+            while self._frames:
+                # coalesce small frames into a single write.
+                chunks = [memoryview(self._materialize(0))[self._offset :]]
+                size = len(chunks[0])
+                for index in range(1, len(self._frames)):
+                    if size + _queued_size(self._frames[index]) > MM_SEND_COALESCE_SIZE:
+                        break
+                    if len(chunks) >= _SENDMSG_MAX_BUFFERS:
+                        break
+                    frame = self._materialize(index)
+                    chunks.append(frame)
+                    size += len(frame)
+                try:
+                    if len(chunks) == 1:
+                        sent = sock.send(chunks[0])
+                    elif hasattr(sock, "sendmsg"):
+                        sent = sock.sendmsg(chunks)
+                    else:
+                        sent = sock.send(b"".join(chunks))
+                except (BlockingIOError, InterruptedError):
+                    return
+                self._size -= sent
+                written = self._offset + sent
+                while self._frames and written >= len(self._frames[0]):
+                    written -= len(self._frames.popleft())
+                    self._kept = max(self._kept - 1, 0)
+                self._offset = written
+                if sent < size:
+                    return  # the socket buffer is full, wait until it is writable again.
 
-    # Make sure we don't have a massive payload size provided to defend
-    # against potential DOS attempt. This may result in stream desync
-    # but it should never happen without a bug or malicous payload
-    if length > MM_MAX_PAYLOAD_SIZE:
-        return (None, False)
 
-    data_str = b""
+class PacketReceiveBuffer(object):
+    """Per-connection receive buffer for the TCP stream.
+
+    Bytes are read straight into a preallocated bytearray with recv_into and
+    frames are sliced out of it as memoryviews, so a payload is never
+    rebuilt by concatenation. Every complete frame in the buffer is returned
+    after each read, not just the first one.
+
+    Fragmented messages are reassembled into a buffer allocated up front for
+    the whole message, as long as it is no bigger than max_message_size.
+    """
+
+    def __init__(self, max_payload_size=MM_MAX_PAYLOAD_SIZE, max_message_size=MM_MAX_MESSAGE_SIZE):
+        self.max_payload_size = max_payload_size
+        self.max_message_size = max_message_size
+        self._message = None  # the fragmented message being reassembled.
+        self._message_id = None
+        self._message_received = 0
+        self._buffer = bytearray(_RECEIVE_BUFFER_INITIAL_SIZE)
+        self._view = memoryview(self._buffer)
+        self._head = 0  # first byte not yet parsed into a frame.
+        self._tail = 0  # one past the last byte received.
+        self.stream = StreamDecompressor()  # for payloads compressed with the sender's zlib stream.
+
+    def pending(self):
+        return self._tail - self._head
+
+    def _make_room(self, needed):
+        # Move the unparsed bytes to the front, growing the buffer if a single frame won't fit.
+        pending = self._tail - self._head
+        if pending == 0:
+            self._head = self._tail = 0
+        if len(self._buffer) - self._tail >= needed:
+            return
+        if pending + needed > len(self._buffer):
+            size = len(self._buffer)
+            while size < pending + needed:
+                size = size * 2
+            new_buffer = bytearray(size)
+            new_buffer[:pending] = self._view[self._head:self._tail]
+            self._buffer = new_buffer
+            self._view = memoryview(self._buffer)
+        else:
+            self._buffer[:pending] = self._buffer[self._head:self._tail]
+        self._head = 0
+        self._tail = pending
+
+    def fill(self, sock):
+        """Reads whatever is available from sock. Returns False if the peer closed the stream."""
+        needed = _LENGTH_PREFIX.size
+        if self.pending() >= _LENGTH_PREFIX.size:
+            # we already know how big the next frame is so make room for all of it in one go.
+            needed = (
+                _LENGTH_PREFIX.size
+                + min(
+                    _LENGTH_PREFIX.unpack_from(self._buffer, self._head)[0],
+                    self.max_payload_size,
+                )
+                - self.pending()
+            )
+        self._make_room(max(needed, _RECEIVE_BUFFER_INITIAL_SIZE // 4))
+        got = sock.recv_into(self._view[self._tail:])
+        if got == 0:
+            return False
+        self._tail += got
+        return True
+
+    def frames(self):
+        """Yields a memoryview over each complete frame. Views are only valid until the next fill()."""
+        while self._tail - self._head >= _LENGTH_PREFIX.size:
+            length = _LENGTH_PREFIX.unpack_from(self._buffer, self._head)[0]
+
+            # Make sure we don't have a massive payload size provided to defend
+            # against potential DOS attempt. This may result in stream desync
+            # but it should never happen without a bug or malicous payload
+            if length > self.max_payload_size:
+                raise ValueError("Frame of {} bytes exceeds the maximum payload size.".format(length))
+
+            start = self._head + _LENGTH_PREFIX.size
+            if self._tail - start < length:
+                return
+            self._head = start + length
+            yield self._view[start:self._head]
+
+    def reassemble(self, fragment):
+        """Adds a MM_FLAG_FRAGMENT frame to the message being rebuilt.
+
+        Returns the whole message once its last fragment arrives, otherwise None.
+        Raises ValueError for fragments that are out of order or over max_message_size.
+        """
+        if len(fragment) < _FRAGMENT_HEADER.size:
+            raise ValueError("Fragment is too short for its header.")
+        flags, message_id, total_size, offset = _FRAGMENT_HEADER.unpack_from(fragment)
+        chunk = fragment[_FRAGMENT_HEADER.size:]
+
+        if self._message is None:
+            if offset != 0:
+                raise ValueError("Fragment of message {} arrived without its start.".format(message_id))
+            if total_size > self.max_message_size:
+                raise ValueError(
+                    "Message of {} bytes exceeds the maximum message size.".format(total_size)
+                )
+            self._message = bytearray(total_size)
+            self._message_id = message_id
+            self._message_received = 0
+        elif message_id != self._message_id or offset != self._message_received:
+            raise ValueError("Fragments of message {} were interleaved.".format(self._message_id))
+
+        if offset + len(chunk) > len(self._message):
+            raise ValueError("Fragment runs past the end of message {}.".format(message_id))
+        self._message[offset:offset + len(chunk)] = chunk
+        self._message_received += len(chunk)
+        if self._message_received < len(self._message):
+            return None
+
+        message = memoryview(self._message)
+        self._message = None
+        self._message_id = None
+        return message
+
+    def reassembling(self):
+        return self._message is not None
+
+
+def _sequence_newer(a, b):
+    # sequence numbers wrap around, a is newer than b if it's less than half the range ahead.
+    return a != b and ((a - b) & 0xFFFFFFFF) < 0x80000000
+
+
+class PacketUDPSession(object):
+    """Sequencing and reliability for one UDP peer.
+
+    Datagrams on MM_UDP_RELIABLE are kept until the peer acknowledges them,
+    resent every resend_time and handed over on the other end in the order
+    they were sent. Datagrams on any other channel are sent once and the
+    receiver drops anything older than what that channel last delivered,
+    so a lost or late position update never holds up a newer one.
+
+    The session only deals in bytes, the caller owns the socket.
+    """
+
+    def __init__(self, resend_time=MM_UDP_RESEND_TIME, max_resends=MM_UDP_MAX_RESENDS, window=MM_UDP_WINDOW):
+        self.resend_time = resend_time
+        self.max_resends = max_resends
+        self.window = window
+        self.failed = False  # set once a datagram went unacknowledged max_resends times.
+        self.resent = 0
+        self.duplicates = 0
+        self.stale = 0  # unreliable datagrams dropped because something newer was already delivered.
+        self._next_sequence = {}  # channel -> the sequence number the next datagram gets.
+        self._unacked = OrderedDict()  # sequence -> [datagram, time last sent, times resent]
+        self._expected = 0  # the next reliable sequence number to deliver.
+        self._early = {}  # reliable payloads that arrived ahead of _expected, by sequence.
+        self._latest = {}  # channel -> the newest sequence number delivered on it.
+        self._lock = threading.Lock()
+
+    def datagram(self, body, channel=MM_UDP_RELIABLE, now=0.0):
+        """Wraps a packet_body() in a datagram for channel."""
+        if len(body) > MM_UDP_MAX_PAYLOAD_SIZE:
+            raise ValueError("Payload of {} bytes doesn't fit in a UDP datagram.".format(len(body)))
+        with self._lock:
+            sequence = self._next_sequence.get(channel, 0)
+            self._next_sequence[channel] = (sequence + 1) & 0xFFFFFFFF
+            datagram = _UDP_HEADER.pack(MM_UDP_DATA, channel, sequence) + body
+            if channel == MM_UDP_RELIABLE:
+                self._unacked[sequence] = [datagram, now, 0]
+        return datagram
+
+    def disconnect_datagram(self):
+        return _UDP_HEADER.pack(MM_UDP_DISCONNECT, 0, 0)
+
+    def pending(self):
+        return len(self._unacked)
+
+    def resend(self, now):
+        """Returns the reliable datagrams that are due to be sent again."""
+        datagrams = []
+        with self._lock:
+            for entry in self._unacked.values():
+                if now - entry[1] < self.resend_time:
+                    continue
+                if entry[2] >= self.max_resends:
+                    self.failed = True
+                    break
+                entry[1] = now
+                entry[2] += 1
+                self.resent += 1
+                datagrams.append(entry[0])
+        return datagrams
+
+    def receive(self, datagram):
+        """Takes a datagram from the peer.
+
+        Returns (payloads, replies, disconnected): the packet bodies now ready to be
+        decoded, in order, the datagrams to send back (acknowledgements) and whether
+        the peer said it is going away. Raises ValueError for malformed datagrams.
+        """
+        if len(datagram) < _UDP_HEADER.size:
+            raise ValueError("Datagram is too short for its header.")
+        kind, channel, sequence = _UDP_HEADER.unpack_from(datagram)
+        body = memoryview(datagram)[_UDP_HEADER.size:]
+
+        if kind == MM_UDP_DISCONNECT:
+            return [], [], True
+        if kind == MM_UDP_ACK:
+            with self._lock:
+                self._unacked.pop(sequence, None)
+            return [], [], False
+        if kind != MM_UDP_DATA:
+            raise ValueError("Unknown datagram kind {}.".format(kind))
+
+        if channel != MM_UDP_RELIABLE:
+            latest = self._latest.get(channel)
+            if latest is not None and not _sequence_newer(sequence, latest):
+                self.stale += 1
+                return [], [], False
+            self._latest[channel] = sequence
+            return [body], [], False
+
+        # always acknowledge, the peer may not have seen our last ack for a duplicate.
+        replies = [_UDP_HEADER.pack(MM_UDP_ACK, channel, sequence)]
+        if sequence == self._expected:
+            payloads = [body]
+            self._expected = (self._expected + 1) & 0xFFFFFFFF
+            while self._expected in self._early:
+                payloads.append(self._early.pop(self._expected))
+                self._expected = (self._expected + 1) & 0xFFFFFFFF
+            return payloads, replies, False
+        if _sequence_newer(sequence, self._expected):
+            if ((sequence - self._expected) & 0xFFFFFFFF) >= self.window:
+                return [], [], False  # too far ahead to buffer, don't ack it so it gets resent.
+            if sequence in self._early:
+                self.duplicates += 1
+            else:
+                self._early[sequence] = bytes(body)
+            return [], replies, False
+        self.duplicates += 1
+        return [], replies, False
+
+
+def packet_encode_udp(session, data, compression, encoding=MM_ENCODING_JSON, channel=MM_UDP_RELIABLE, now=0.0):
+    flags, payload = packet_payload(data, encoding)
+    body = packet_body(flags, payload, compression_level(compression, len(payload)))
+    return session.datagram(body, channel, now)
+
+
+def packet_recv_udp(session, datagram):
+    # Returns (messages, replies, disconnected) or raises ValueError for a datagram that can't be read.
+    payloads, replies, disconnected = session.receive(datagram)
     try:
-        while len(data_str) < length:
-            got = sock.recv(length - len(data_str))
-            if got == b"": return (None,False)
-            data_str += got
-    except:
-        return (None,False)
+        messages = [decode_payload(payload) for payload in payloads]
+    except Exception as error:
+        raise ValueError("Couldn't decode datagram: {}".format(error))
+    return messages, replies, disconnected
 
-    # Get our compression level and skip past it to the first data byte
-    compression = int(struct.unpack( '!b', data_str[:1] )[0])
-    data_str = data_str[1:]
 
-    if compression != 0:
+def decode_payload(payload, stream=None):
+    # Get our compression level and flags and skip past them to the first data byte
+    flags = payload[0]
+    data_str = payload[1:]
+    if flags & MM_FLAG_STREAM:
+        data_str = stream.decompress(data_str, flags & MM_FLAG_STREAM_RESET)
+    elif flags & MM_FLAG_COMPRESSION_MASK != 0:
         data_str = zlib.decompress(data_str)
+    if flags & MM_FLAG_BINARY:
+        return binary.decode(data_str)
+    return json.loads(str(data_str, 'utf-8'))
 
-    data = json.loads(data_str)
 
-    return (data, True)
+def packet_recv_tcp(sock, receive_buffer):
+    # Returns every message completed by this read. An empty list means only part of a frame has arrived so far.
+    try:
+        if not receive_buffer.fill(sock):
+            return (None, False)
+    except (BlockingIOError, InterruptedError):
+        return ([], True)
+    except:
+        return (None, False)
+
+    messages = []
+    try:
+        for payload in receive_buffer.frames():
+            if payload[0] & MM_FLAG_FRAGMENT:
+                payload = receive_buffer.reassemble(payload)
+                if payload is None:
+                    continue
+            elif receive_buffer.reassembling():
+                raise ValueError("Frame arrived in the middle of a fragmented message.")
+            data = decode_payload(payload, receive_buffer.stream)
+            if is_hello(data):
+                # frames right behind the handshake can already be primed with the dictionary it carries.
+                receive_buffer.stream = StreamDecompressor(hello_dictionary(data))
+            messages.append(data)
+    except:
+        return (None, False)
+
+    return (messages, True)
@@ -1,10 +1,26 @@
 import select
 import socket
+from socket import socketpair
 import time
 import threading
+import traceback
 
 import Mastermind._mm_netutil as netutil
-from Mastermind._mm_constants import MM_TCP, MM_UDP, MM_UNKNOWN
+from Mastermind._mm_constants import (
+    MM_TCP,
+    MM_UDP,
+    MM_UNKNOWN,
+    MM_SEND_QUEUE_MAX_SIZE,
+    MM_SEND_DROP,
+    MM_SEND_LINGER_TIME,
+    MM_PROTOCOL_LEGACY,
+    MM_MIN_PAYLOAD_COMPRESSION_SIZE,
+    MM_MAX_MESSAGE_SIZE,
+    MM_ENCODING_JSON,
+    MM_UDP_RELIABLE,
+    MM_UDP_RESEND_TIME,
+)
+from Mastermind._mm_compression import StreamCompressor
 from Mastermind._mm_errors import (
     MastermindErrorServer,
     MastermindWarningServer,
@@ -68,7 +84,9 @@ class MastermindServerCallbacksDebug(object):
             connection_object, data
         )
 
-    def callback_client_send(self, connection_object, data, compression=None):
+    def callback_client_send(
+        self, connection_object, data, compression=None, channel=MM_UDP_RELIABLE
+    ):
         print(
             'Server: About to send data "'
             + str(data)
@@ -79,7 +97,7 @@ class MastermindServerCallbacksDebug(object):
             + '"!'
         )
         return super(MastermindServerCallbacksDebug, self).callback_client_send(
-            connection_object, data, compression
+            connection_object, data, compression, channel
         )
 
 
@@ -115,6 +133,10 @@ class MastermindServerBase(object):
         self._mm_should_run = False
         self._mm_connected = False
 
+        self._mm_load = 0.0  # 0.0 idle to 1.0 saturated, lets compression back off when we're busy.
+        self._mm_compression_dictionary = None
+        self._mm_max_message_size = MM_MAX_MESSAGE_SIZE
+
     def __del__(self):
         if self._mm_accepting_new_connections:
             MastermindWarningServer(
@@ -178,9 +200,17 @@ class MastermindServerBase(object):
         for connection in self._mm_connections.values():
             connection.terminate()
         for connection in self._mm_connections.values():
-            connection.thread.join()
+            if connection.thread is not None:
+                connection.thread.join()
         self._mm_connections = {}
 
+    def set_load(self, load):
+        self._mm_load = min(max(load, 0.0), 1.0)
+
+    def set_compression_dictionary(self, dictionary):
+        # only clients that connect after this get the dictionary.
+        self._mm_compression_dictionary = dictionary
+
     def callback_connect(self):
         pass  # Called when the server connects                           CAN OVERRIDE
 
@@ -200,14 +230,33 @@ class MastermindServerBase(object):
         pass  # Called to handle a client's received data                 SHOULD OVERRIDE
 
     def callback_client_send(
-        self, connection_object, data, compression=None
+        self, connection_object, data, compression=None, channel=MM_UDP_RELIABLE
     ):  # Called to send data to a client                           CAN OVERRIDE      IF super() CALLED
-        result = netutil.packet_send(
-            connection_object.socket,
-            (self._mm_connection_type, connection_object.address),
-            data,
-            compression,
-        )
+        # channel only matters over UDP, anything but MM_UDP_RELIABLE is sent once and the newest wins.
+        if self._mm_connection_type == MM_TCP:
+            # queued for the connection's own thread to write so a slow client can't stall the caller.
+            flags, payload = netutil.packet_payload(
+                data, netutil.protocol_encoding(connection_object.protocol_version)
+            )
+            level = netutil.compression_level(compression, len(payload), self._mm_load)
+            if (
+                level > 0
+                and len(payload) >= MM_MIN_PAYLOAD_COMPRESSION_SIZE
+                and netutil.protocol_streams_compression(connection_object.protocol_version)
+            ):
+                result = connection_object.send_streamed(flags, payload, level)
+            else:
+                result = connection_object.send(
+                    netutil.packet_frame(
+                        flags,
+                        payload,
+                        level,
+                        connection_object.outbound.stats,
+                        netutil.protocol_fragments(connection_object.protocol_version),
+                    )
+                )
+        else:
+            result = connection_object.send(data, compression, channel)
         if not result:
             connection_object.terminate()
         return result
@@ -234,6 +283,9 @@ class MastermindServerTCP(MastermindServerBase):
         time_server_refresh=0.5,
         time_connection_refresh=0.5,
         time_connection_timeout=5.0,
+        send_queue_size=MM_SEND_QUEUE_MAX_SIZE,
+        send_queue_policy=MM_SEND_DROP,
+        max_message_size=MM_MAX_MESSAGE_SIZE,
     ):
         MastermindServerBase.__init__(
             self,
@@ -242,6 +294,9 @@ class MastermindServerTCP(MastermindServerBase):
             time_connection_refresh,
             time_connection_timeout,
         )
+        self._mm_send_queue_size = send_queue_size
+        self._mm_send_queue_policy = send_queue_policy
+        self._mm_max_message_size = max_message_size
 
     def _mm_make_connection(self, ip, port):
         self._mm_unconnected_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -273,7 +328,9 @@ class MastermindServerTCP(MastermindServerBase):
         self._mm_unconnected_socket.close()
 
     def callback_client_receive(self, connection_object):
-        return netutil.packet_recv_tcp(connection_object.socket)
+        return netutil.packet_recv_tcp(
+            connection_object.socket, connection_object.receive_buffer
+        )
 
     def accepting_allow_wait_forever(self):
         self._mm_should_run = True
@@ -285,6 +342,7 @@ class MastermindServerTCP(MastermindServerBase):
                 continue
 
             connected_socket, address = self._mm_unconnected_socket.accept()
+            connected_socket.setblocking(False)
             connection = MastermindConnectionThreadTCP(self, connected_socket, address)
             connection.thread = threading.Thread(
                 target=connection.run_forever, name="TCPClientThread-{}".format(address)
@@ -302,6 +360,11 @@ class MastermindConnectionThread(object):
         self.address = address
         self.amount_waiting = 0.0
         self.handling = False
+        self.receive_buffer = netutil.PacketReceiveBuffer(
+            max_message_size=server._mm_max_message_size
+        )
+        # clients that never send MM_HELLO only understand the original JSON protocol.
+        self.protocol_version = MM_PROTOCOL_LEGACY
 
     def terminate(self):
         self.handling = False
@@ -310,6 +373,64 @@ class MastermindConnectionThread(object):
 class MastermindConnectionThreadTCP(MastermindConnectionThread):
     def __init__(self, server, socket, address):
         MastermindConnectionThread.__init__(self, server, socket, address)
+        self.outbound = netutil.PacketSendQueue(
+            server._mm_send_queue_size, server._mm_send_queue_policy
+        )
+        # written to by other threads to wake run_forever() when there is something to send.
+        self._wakeup_receive, self._wakeup_send = socketpair()
+        self._wakeup_receive.setblocking(False)
+        self._wakeup_send.setblocking(False)
+
+    def send(self, frame):
+        if not self.outbound.put(frame):
+            return False
+        self.wakeup()
+        return True
+
+    def send_streamed(self, flags, payload, compression):
+        if not self.outbound.put_streamed(flags, payload, compression):
+            return False
+        self.wakeup()
+        return True
+
+    def negotiate(self, data):
+        self.protocol_version = netutil.negotiate(data)
+        dictionary = None
+        if netutil.protocol_streams_compression(self.protocol_version):
+            dictionary = self.server._mm_compression_dictionary
+            self.outbound.compressor = StreamCompressor(dictionary)
+        self.outbound.fragment = netutil.protocol_fragments(self.protocol_version)
+        self.send(
+            netutil.packet_encode(netutil.hello(self.protocol_version, dictionary), False)
+        )
+
+    def wakeup(self):
+        try:
+            self._wakeup_send.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass  # a wakeup is already pending or we're shutting down.
+
+    def terminate(self):
+        MastermindConnectionThread.terminate(self)
+        self.wakeup()
+
+    def linger(self, timeout=MM_SEND_LINGER_TIME):
+        # write out what was queued before terminate(), e.g. a "disconnect" reply, but don't
+        # wait on a client that has stopped reading.
+        deadline = time.time() + timeout
+        while self.outbound.pending() > 0:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            input_ready, output_ready, except_ready = select.select(
+                [], [self.socket], [], remaining
+            )
+            if output_ready == []:
+                break
+            try:
+                self.outbound.flush(self.socket)
+            except OSError:
+                break
 
     def run_forever(self):
         self.server.callback_connect_client(self)
@@ -317,20 +438,245 @@ class MastermindConnectionThreadTCP(MastermindConnectionThread):
         self.handling = True
         while self.handling:
             input_ready, output_ready, except_ready = select.select(
-                [self.socket], [], [], self.server._mm_time_connection_refresh
+                [self.socket, self._wakeup_receive],
+                [self.socket] if self.outbound.pending() > 0 else [],
+                [],
+                self.server._mm_time_connection_refresh,
             )
-            if input_ready == []:
+            if input_ready == [] and output_ready == []:
                 self.amount_waiting += self.server._mm_time_connection_refresh
                 if self.amount_waiting > self.server._mm_time_connection_timeout:
                     break
                 continue
 
-            data, status = self.server.callback_client_receive(self)
+            if self._wakeup_receive in input_ready:
+                try:
+                    self._wakeup_receive.recv(4096)
+                except (BlockingIOError, InterruptedError):
+                    pass
+
+            if self.socket in output_ready or (
+                self._wakeup_receive in input_ready and self.outbound.pending() > 0
+            ):
+                try:
+                    self.outbound.flush(self.socket)
+                except OSError:
+                    break
+
+            if self.socket not in input_ready:
+                continue
+
+            messages, status = self.server.callback_client_receive(self)
             if status == False:
                 break
 
-            self.server.callback_client_handle(self, data)
+            # a single read can complete any number of frames.
+            for data in messages:
+                if netutil.is_hello(data):
+                    self.negotiate(data)
+                    continue
+                self.server.callback_client_handle(self, data)
 
             self.amount_waiting = 0.0
+        if not self.handling:
+            self.linger()
+        if self.outbound.dropped_frames > 0:
+            MastermindWarningServer(
+                "Dropped {} frames ({} bytes) for slow client {}.".format(
+                    self.outbound.dropped_frames,
+                    self.outbound.dropped_bytes,
+                    self.address,
+                )
+            )
+        self._wakeup_receive.close()
+        self._wakeup_send.close()
         self.server.callback_disconnect_client(self)
 
+
+class MastermindServerUDP(MastermindServerBase):
+    """One UDP socket shared by every client.
+
+    A single thread, started by connect(), reads every datagram and runs
+    each client's resends and timeouts. accepting_allow() only controls
+    whether datagrams from new addresses create a connection.
+    """
+
+    def __init__(
+        self,
+        time_server_refresh=0.5,
+        time_connection_refresh=0.5,
+        time_connection_timeout=5.0,
+    ):
+        MastermindServerBase.__init__(
+            self,
+            MM_UDP,
+            time_server_refresh,
+            time_connection_refresh,
+            time_connection_timeout,
+        )
+        self._mm_connections_lock = threading.Lock()
+
+    def _mm_make_connection(self, ip, port):
+        self._mm_unconnected_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._mm_unconnected_socket.setsockopt(
+            socket.SOL_SOCKET, socket.SO_REUSEADDR, 1
+        )
+        try:
+            self._mm_unconnected_socket.bind((ip, port))
+        except:
+            self._mm_unconnected_socket.close()
+            raise MastermindErrorSocket(
+                "Server could not connect on port "
+                + str(port)
+                + "!  Perhaps another instance is already running?"
+            )
+        self._mm_unconnected_socket.setblocking(False)
+        self._mm_should_run = True
+        self._mm_server_thread = threading.Thread(
+            target=self.run_forever, name="UDPServerThread-{}".format(port)
+        )
+        self._mm_server_thread.start()
+
+    def _mm_close_connection(self):
+        self._mm_should_run = False
+        self._mm_server_thread.join()
+        self._mm_unconnected_socket.close()
+
+    def accepting_allow(self):
+        self._mm_accepting_new_connections = True
+
+    def accepting_disallow(self):
+        self._mm_accepting_new_connections = False
+
+    def disconnect_clients(self):
+        for connection in list(self._mm_connections.values()):
+            self._mm_drop_connection(connection)
+
+    def _mm_drop_connection(self, connection):
+        with self._mm_connections_lock:
+            if self._mm_connections.pop(connection.address, None) is None:
+                return
+        connection.handling = False
+        connection.sendto(connection.session.disconnect_datagram())
+        self.callback_disconnect_client(connection)
+
+    def _mm_receive_datagram(self):
+        # returns False once there's nothing left to read.
+        try:
+            datagram, address = self._mm_unconnected_socket.recvfrom(65535)
+        except (BlockingIOError, InterruptedError):
+            return False
+        except OSError:
+            return True  # e.g. ICMP port unreachable from a client that went away.
+
+        connection = self._mm_connections.get(address)
+        if connection is None:
+            if not self._mm_accepting_new_connections:
+                return True
+            connection = MastermindConnectionUDP(self, self._mm_unconnected_socket, address)
+            with self._mm_connections_lock:
+                self._mm_connections[address] = connection
+            self.callback_connect_client(connection)
+
+        try:
+            messages, replies, disconnected = netutil.packet_recv_udp(
+                connection.session, datagram
+            )
+        except ValueError:
+            self._mm_drop_connection(connection)
+            return True
+        for reply in replies:
+            connection.sendto(reply)
+        connection.amount_waiting = 0.0
+        if disconnected:
+            with self._mm_connections_lock:
+                self._mm_connections.pop(address, None)
+            connection.handling = False
+            self.callback_disconnect_client(connection)
+            return True
+
+        for data in messages:
+            if netutil.is_hello(data):
+                connection.negotiate(data)
+                continue
+            try:
+                self.callback_client_handle(connection, data)
+            except Exception:
+                # the rest of the datagram has been acknowledged already, so keep going.
+                self._mm_print_error(connection)
+        return True
+
+    def _mm_print_error(self, connection):
+        # every client shares this thread, one that makes a handler raise mustn't stop the others.
+        print('Server: Error handling data from client "' + str(connection.address) + '":')
+        traceback.print_exc()
+
+    def run_forever(self):
+        last_time = time.time()
+        while self._mm_should_run:
+            input_ready, output_ready, except_ready = select.select(
+                [self._mm_unconnected_socket],
+                [],
+                [],
+                min(self._mm_time_connection_refresh, MM_UDP_RESEND_TIME),
+            )
+            if input_ready != []:
+                while True:
+                    try:
+                        if not self._mm_receive_datagram():
+                            break
+                    except Exception:
+                        print("Server: Error receiving a datagram:")
+                        traceback.print_exc()
+
+            now = time.time()
+            for connection in list(self._mm_connections.values()):
+                connection.amount_waiting += now - last_time
+                for datagram in connection.session.resend(now):
+                    connection.sendto(datagram)
+                if (
+                    not connection.handling
+                    or connection.session.failed
+                    or connection.amount_waiting > self._mm_time_connection_timeout
+                ):
+                    self._mm_drop_connection(connection)
+            last_time = now
+
+
+class MastermindConnectionUDP(MastermindConnectionThread):
+    # a client of MastermindServerUDP. it has no thread of its own, the server's thread reads for it.
+    def __init__(self, server, socket, address):
+        MastermindConnectionThread.__init__(self, server, socket, address)
+        self.thread = None
+        self.handling = True
+        self.session = netutil.PacketUDPSession()
+
+    def sendto(self, datagram):
+        try:
+            self.socket.sendto(datagram, self.address)
+            return True
+        except OSError:
+            return False
+
+    def send(self, data, compression=None, channel=MM_UDP_RELIABLE):
+        if not self.handling:
+            return False
+        return self._send(
+            data, compression, netutil.protocol_encoding(self.protocol_version), channel
+        )
+
+    def _send(self, data, compression, encoding, channel):
+        # a reliable datagram that doesn't make it out now is resent by the server's thread.
+        try:
+            datagram = netutil.packet_encode_udp(
+                self.session, data, compression, encoding, channel, time.time()
+            )
+        except ValueError:
+            return False  # bigger than MM_UDP_MAX_PAYLOAD_SIZE, there are no fragments over UDP.
+        return self.sendto(datagram) or channel == MM_UDP_RELIABLE
+
+    def negotiate(self, data):
+        # no streamed compression or fragments over UDP, every datagram has to stand on its own.
+        self.protocol_version = netutil.negotiate(data)
+        # the hello is always JSON, like the one the client sent.
+        self._send(netutil.hello(self.protocol_version), False, MM_ENCODING_JSON, MM_UDP_RELIABLE)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# Compares a search per chaser per turn with one flow field from src/flowfield.py shared by all
+# of them, on a generated city with the target walking around.
+# run from the repository root: python -m benchmarks.flowfield [--chasers N] [--turns N]
+
+import argparse
+import random
+import time
+
+from benchmarks.pathfinding import CityWorldmap, open_positions
+from src.flowfield import FlowField
+from src.furniture import FurnitureManager
+from src.pathfinding import Pathfinder
+from src.position import Position
+from src.tilemanager import TileManager
+
+
+def walk(pathfinder, position, turns):
+    # where the target is each turn.
+    _positions = []
+    for _ in range(turns):
+        _next = [node for node, _ in pathfinder.neighbours_of((position.x, position.y), 0)]
+        if _next:
+            _node = random.choice(_next)
+            position = Position(_node[0], _node[1], 0)
+        _positions.append(position)
+    return _positions
+
+
+def time_turns(name, turn, targets):
+    start = time.perf_counter()
+    for target in targets:
+        turn(target)
+    _ms = (time.perf_counter() - start) / len(targets) * 1000
+    print("{:>24}: {:8.3f}ms a turn".format(name, _ms))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="flow field benchmark")
+    parser.add_argument("--chasers", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=20)
+    args = parser.parse_args()
+
+    worldmap = CityWorldmap()
+    pathfinder = Pathfinder(
+        worldmap, TileManager().TILE_TYPES, FurnitureManager().FURNITURE_TYPES
+    )
+    positions = open_positions(worldmap, pathfinder)
+    start = random.choice(positions)
+    targets = walk(pathfinder, start, args.turns)
+    chasers = [
+        position
+        for position in positions
+        if 0 < abs(position.x - start.x) <= 20 and 0 < abs(position.y - start.y) <= 20
+    ]
+    chasers = random.sample(chasers, min(args.chasers, len(chasers)))
+
+    time_turns(
+        "A* per chaser",
+        lambda target: [pathfinder.find_path(chaser, target) for chaser in chasers],
+        targets,
+    )
+    field = FlowField(pathfinder, start)
+
+    def rebuilt(target):
+        field.build(target)
+        return [field.next_step(chaser) for chaser in chasers]
+
+    def updated(target):
+        field.move_target(target)
+        return [field.next_step(chaser) for chaser in chasers]
+
+    time_turns("flow field, rebuilt", rebuilt, targets)
+    field.build(start)
+    time_turns("flow field, updated", updated, targets)
+    print(
+        "{} chasers, field built {} times and updated {} times".format(
+            len(chasers), field.builds, field.updates
+        )
+    )
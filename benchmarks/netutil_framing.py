@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# Benchmarks the Mastermind TCP framing against the old concatenating reader.
+# run from the repository root: python -m benchmarks.netutil_framing [--messages N] [--size BYTES]
+
+import argparse
+import json
+import socket
+import struct
+import threading
+import time
+
+import Mastermind._mm_netutil as netutil
+from Mastermind._mm_constants import MM_TCP, MM_MAX_PAYLOAD_SIZE
+
+
+def make_localmap_payload(size):
+    # roughly what a jsonpickled localmap looks like on the wire.
+    tile = (
+        '{"py/object": "src.position.Position", "x": 12, "y": 40, "z": 0}, '
+        '"terrain": {"py/object": "src.terrain.Terrain", "ident": "t_floor", "impassable": false}, '
+        '"creature": null, "items": [], "furniture": null, "lumens": 1'
+    )
+    payload = ""
+    while len(payload) < size:
+        payload = payload + tile
+    # the frame is the json quoted payload plus the compression byte.
+    while len(json.dumps(payload)) + 1 > size:
+        payload = payload[: -(len(json.dumps(payload)) + 1 - size)]
+    return payload
+
+
+def legacy_packet_recv_tcp(sock):
+    info = b""
+    length_prefix_size = struct.calcsize("!I")
+    while len(info) < length_prefix_size:
+        got = sock.recv(length_prefix_size)
+        if got == b"":
+            return (None, False)
+        info += got
+    length = int(struct.unpack("!I", info[:length_prefix_size])[0])
+    data_str = b""
+    while len(data_str) < length:
+        got = sock.recv(length - len(data_str))
+        if got == b"":
+            return (None, False)
+        data_str += got
+    compression = int(struct.unpack("!b", data_str[:1])[0])
+    data_str = data_str[1:]
+    return (json.loads(data_str), True)
+
+
+def sender(sock, payload, messages):
+    for _ in range(messages):
+        netutil.packet_send(sock, (MM_TCP, None), payload, False)
+    sock.shutdown(socket.SHUT_WR)
+
+
+def run(reader, payload, messages):
+    left, right = socket.socketpair()
+    thread = threading.Thread(target=sender, args=(left, payload, messages))
+    start = time.perf_counter()
+    thread.start()
+    received = reader(right, messages)
+    duration = time.perf_counter() - start
+    thread.join()
+    left.close()
+    right.close()
+    assert received == messages, "lost messages: {} of {}".format(received, messages)
+    return duration
+
+
+def read_legacy(sock, messages):
+    received = 0
+    while received < messages:
+        data, status = legacy_packet_recv_tcp(sock)
+        if not status:
+            break
+        received = received + 1
+    return received
+
+
+def read_buffered(sock, messages):
+    received = 0
+    receive_buffer = netutil.PacketReceiveBuffer()
+    while received < messages:
+        data, status = netutil.packet_recv_tcp(sock, receive_buffer)
+        if not status:
+            break
+        received = received + len(data)
+    return received
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mastermind framing benchmark")
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--size", type=int, default=MM_MAX_PAYLOAD_SIZE)
+    args = parser.parse_args()
+
+    payload = make_localmap_payload(args.size)
+    megabytes = len(payload) * args.messages / (1024 * 1024)
+    for name, reader in [("legacy", read_legacy), ("buffered", read_buffered)]:
+        duration = run(reader, payload, args.messages)
+        print(
+            "{:>8}: {} frames of {} bytes in {:.3f}s ({:.0f} msg/s, {:.1f} MB/s)".format(
+                name,
+                args.messages,
+                len(payload),
+                duration,
+                args.messages / duration,
+                megabytes / duration,
+            )
+        )
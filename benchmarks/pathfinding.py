@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# Compares A* and HPA* in src/pathfinding.py with the random choice search calculate_route used
+# to do, on a generated city. run from the repository root: python -m benchmarks.pathfinding [--routes N]
+
+import argparse
+import logging
+import os
+import random
+import time
+from collections import defaultdict
+
+from src.furniture import FurnitureManager
+from src.pathfinding import HierarchicalPathfinder, Pathfinder
+from src.position import Position
+from src.tilemanager import TileManager
+from src.worldmap import Chunk, Worldmap
+
+
+class CityWorldmap(Worldmap):
+    # a worldmap that's only in memory so the benchmark doesn't touch ./worlds.
+    def __init__(self, city_size=1, seed=1):
+        self._log = logging.getLogger("worldmap")
+        self.WORLD_SIZE = city_size * 12
+        self.chunk_size = 13
+        self.FurnitureManager = FurnitureManager()
+        self.TileManager = TileManager()
+        self.connector_chunks = defaultdict(set)
+        self.WORLDMAP = defaultdict(dict)
+        for i in range(self.WORLD_SIZE):
+            for j in range(self.WORLD_SIZE):
+                self.WORLDMAP[i][j] = {0: Chunk(i, j, 0, self.chunk_size)}
+        random.seed(seed)
+        _layout = self.generate_city(city_size)
+        _mapgen = "./data/json/mapgen/"
+        _kinds = {"r": "residential/", "c": "commercial/", "i": "industrial/"}
+        for i in range(self.WORLD_SIZE):
+            for j in range(self.WORLD_SIZE):
+                # the real thing rotates roads to fit, four way crossings are close enough here.
+                if _layout[i][j] == "R":
+                    _file = _mapgen + "road/city_road_4_way.json"
+                elif _layout[i][j] in _kinds:
+                    _path = _mapgen + _kinds[_layout[i][j]]
+                    _file = _path + random.choice(sorted(os.listdir(_path)))
+                else:
+                    continue
+                self.build_json_building_at_position(
+                    _file, Position(i * self.chunk_size + 1, j * self.chunk_size + 1, 0)
+                )
+
+    def get_tile_by_position(self, position):
+        # buildings spill over the edge and into other z levels, make those chunks as we go
+        # without writing them to disk.
+        _chunks = self.WORLDMAP[position.x // self.chunk_size].setdefault(
+            position.y // self.chunk_size, dict()
+        )
+        if position.z not in _chunks:
+            _chunks[position.z] = Chunk(
+                position.x // self.chunk_size,
+                position.y // self.chunk_size,
+                position.z,
+                self.chunk_size,
+            )
+        _chunk = _chunks[position.z]
+        return _chunk.tiles[_chunk.get_tile_index(position)]
+
+
+def random_choice_route(worldmap, pos0, pos1):
+    # calculate_route before A*, kept to compare against.
+    reachable = [pos0]
+    explored = []
+    while len(reachable) > 0:
+        position = random.choice(reachable)
+        if position == pos1:
+            path = []
+            while position != pos0:
+                path.append(position)
+                position = position.previous
+            path.reverse()
+            return path
+        reachable.remove(position)
+        explored.append(position)
+        for adjacent in worldmap.get_adjacent_positions_non_impassable(position):
+            if abs(adjacent.x - pos0.x) > 10 or abs(adjacent.y - pos0.y) > 10:
+                continue
+            if adjacent not in reachable and adjacent not in explored:
+                adjacent.previous = position
+                reachable.append(adjacent)
+    return None
+
+
+def open_positions(worldmap, pathfinder):
+    _positions = []
+    for x in range(1, worldmap.WORLD_SIZE * worldmap.chunk_size - 1):
+        for y in range(1, worldmap.WORLD_SIZE * worldmap.chunk_size - 1):
+            if pathfinder.cost_at(x, y, 0) is not None:
+                _positions.append(Position(x, y, 0))
+    return _positions
+
+
+def pick_routes(positions, count, near=None):
+    # pairs of open positions, no more than near apart in x and y if near is given.
+    _routes = []
+    while len(_routes) < count:
+        _start = random.choice(positions)
+        _goal = random.choice(positions)
+        if near is not None and (
+            abs(_start.x - _goal.x) > near or abs(_start.y - _goal.y) > near
+        ):
+            continue
+        _routes.append((_start, _goal))
+    return _routes
+
+
+def run(name, find, routes):
+    _found = 0
+    _steps = 0
+    start = time.perf_counter()
+    for pos0, pos1 in routes:
+        _path = find(pos0, pos1)
+        if _path is not None:
+            _found = _found + 1
+            _steps = _steps + len(_path)
+    _ms = (time.perf_counter() - start) / len(routes) * 1000
+    print(
+        "{:>22}: {:8.3f}ms a route, {:>4}/{} found, {:>6} steps".format(
+            name, _ms, _found, len(routes), _steps
+        )
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="pathfinding benchmark")
+    parser.add_argument("--routes", type=int, default=50)
+    parser.add_argument("--city-size", type=int, default=1)
+    args = parser.parse_args()
+
+    worldmap = CityWorldmap(args.city_size)
+    pathfinder = Pathfinder(
+        worldmap, TileManager().TILE_TYPES, FurnitureManager().FURNITURE_TYPES
+    )
+    positions = open_positions(worldmap, pathfinder)
+    short_routes = pick_routes(positions, args.routes, near=10)
+    long_routes = pick_routes(positions, args.routes)
+
+    run(
+        "random choice, short",
+        lambda pos0, pos1: random_choice_route(worldmap, pos0, pos1),
+        short_routes,
+    )
+    run("A*, short", pathfinder.find_path, short_routes)
+    run(
+        "A*, long",
+        lambda pos0, pos1: pathfinder.find_path(pos0, pos1, max_nodes=1000000),
+        long_routes,
+    )
+    hierarchical_pathfinder = HierarchicalPathfinder(pathfinder)
+    # the first routes build what it knows about each chunk they need, after that it's cached.
+    run("HPA*, long, cold", hierarchical_pathfinder.find_path, long_routes)
+    run("HPA*, long", hierarchical_pathfinder.find_path, long_routes)
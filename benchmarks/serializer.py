@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# Compares the schema encoder in src/serializer.py with jsonpickle on localmap sized chunks.
+# run from the repository root: python -m benchmarks.serializer [--iterations N]
+
+import argparse
+import random
+import time
+
+import jsonpickle
+
+from src.character import Character
+from src.furniture import Furniture
+from src.item import Container, Item, ItemManager
+from src.position import Position
+from src.serializer import encode_packet, decode_packet
+from src.terrain import Terrain
+from src.worldmap import Chunk
+
+
+def make_localmap(item_manager, chunk_size=13):
+    # nine chunks with the kind of mess a town leaves in them.
+    random.seed(1)
+    _idents = sorted(item_manager.ITEM_TYPES.keys())
+    _chunks = []
+    for x in range(3):
+        for y in range(3):
+            _chunk = Chunk(x, y, 0, chunk_size)
+            for tile in _chunk.tiles:
+                if random.random() < 0.3:
+                    tile["terrain"] = Terrain("t_wall", True)
+                if random.random() < 0.1:
+                    tile["furniture"] = Furniture("f_chair")
+                if random.random() < 0.1:
+                    _ident = random.choice(_idents)
+                    _reference = item_manager.ITEM_TYPES[_ident]
+                    if "volume" in _reference and "weight" in _reference:
+                        _container = Container(_ident, _reference)
+                        _container.contained_items.append(Item(_ident, _reference))
+                        tile["items"].append(_container)
+                    else:
+                        tile["items"].append(Item(_ident, _reference))
+            _chunks.append(_chunk)
+    _character = Character("Benchmark")
+    _character.position = Position(20, 20, 0)
+    _chunks[4].tiles[0]["creature"] = _character
+    return _chunks
+
+
+def time_it(function, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="localmap serializer benchmark")
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    localmap = make_localmap(ItemManager())
+    for name, encode, decode in [
+        ("jsonpickle", jsonpickle.encode, jsonpickle.decode),
+        ("schema", encode_packet, decode_packet),
+    ]:
+        encoded = encode(localmap)
+        encode_ms = time_it(lambda: encode(localmap), args.iterations)
+        decode_ms = time_it(lambda: decode(encoded), args.iterations)
+        print(
+            "{:>10}: {:>7} bytes, encode {:7.2f}ms, decode {:7.2f}ms".format(
+                name, len(encoded), encode_ms, decode_ms
+            )
+        )
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# Compares the JSON and binary Mastermind payload encodings.
+# run from the repository root: python -m benchmarks.wire_encoding [--iterations N]
+
+import argparse
+import time
+
+import Mastermind._mm_netutil as netutil
+from Mastermind._mm_constants import MM_ENCODING_JSON, MM_ENCODING_BINARY
+from benchmarks.netutil_framing import make_localmap_payload
+
+
+MESSAGES = {
+    "command": {"ident": "q", "command": "calculated_move", "args": [120, 54, 0]},
+    "localmap": make_localmap_payload(60000),
+    "character list": [make_localmap_payload(2000) for _ in range(5)],
+}
+
+
+def time_it(function, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - start) / iterations * 1000000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mastermind payload encoding benchmark")
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    for name, message in MESSAGES.items():
+        for encoding_name, encoding in [("json", MM_ENCODING_JSON), ("binary", MM_ENCODING_BINARY)]:
+            frame = netutil.packet_encode(message, False, encoding)
+            payload = memoryview(frame)[4:]
+            encode_us = time_it(lambda: netutil.packet_encode(message, False, encoding), args.iterations)
+            decode_us = time_it(lambda: netutil.decode_payload(payload), args.iterations)
+            print(
+                "{:>14} {:>6}: {:>6} bytes, encode {:8.1f}us, decode {:8.1f}us".format(
+                    name, encoding_name, len(frame), encode_us, decode_us
+                )
+            )
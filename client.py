@@ -6,8 +6,11 @@ import json
 import math
 import os
 import sys
+import threading
 import time
-from collections import defaultdict
+import traceback
+import zlib
+from queue import Queue, Empty
 
 import pyglet
 import glooey
@@ -15,6 +18,7 @@ from pyglet import clock
 from src.passhash import hashPassword
 
 from Mastermind._mm_client import MastermindClientTCP
+from Mastermind._mm_errors import MastermindError
 
 from src.action import Action
 from src.blueprint import Blueprint
@@ -152,7 +156,11 @@ class CharacterSelectWindow(glooey.containers.VBox):
         self.vbox_for_characterlist.add(self.create_button)
         # add the character buttons
         for character in list_of_characters:
-            _decoded = decode_packet(character, keys=True)
+            if isinstance(character, dict):
+                _decoded = character  # name, profession and position is all we get now.
+            else:
+                # older servers send the whole character jsonpickled.
+                _decoded = decode_packet(character, keys=True)
             _button = CharacterListButton(_decoded["name"])
             _button.push_handlers(on_click=self.select_character)
             self.vbox_for_characterlist.add(_button)
@@ -252,7 +260,8 @@ class MapTile(glooey.containers.Stack):
         # dict from localmap
         self.tile = tile
         #print(self.tile)
-        if self.tile is not None:
+        # tiles our character can't see come from the server without terrain, leave them blank.
+        if self.tile is not None and self.tile["terrain"] is not None:
 
             self.terrain = glooey.Image(
                 pyglet.resource.image(str(self.tile["terrain"].ident) + ".png")
@@ -330,74 +339,6 @@ class MainWindow(glooey.containers.Stack):
                 tiles.insert(len(tiles), tile)
         return tiles
 
-    def lerp(self, start, end, t):
-        return start + t * (end - start)
-
-    def lerp_point(self, p0, p1, t):
-        return (int(self.lerp(p0[0], p1[0], t)), int(self.lerp(p0[1], p1[1], t)))
-
-    def diagonal_distance(self, p0, p1):
-        dx = p1[0] - p0[0]
-        dy = p1[1] - p0[1]
-        return max(abs(dx), abs(dy))
-
-    def line(self, p0, p1):
-        points = []
-        diagonal_distance = self.diagonal_distance(p0, p1)
-        for step in range(diagonal_distance):
-            points.append(self.lerp_point(p0, p1, step / diagonal_distance))
-        return points  # so now we have a set of points along a line.
-
-    def trim_localmap(self, origin_position, radius=10):
-        # origin_position = origin_position # store the player position for fov origin
-        # convert chunks to grid
-        level = defaultdict(dict)
-        for tile in self.localmap[:]:  # we only need the tiles around radius.
-            if (
-                int(tile["position"].x) < origin_position.x - radius
-                or int(tile["position"].x) > origin_position.x + radius + 1
-            ):
-                self.localmap.remove(tile)
-            elif (
-                int(tile["position"].y) < origin_position.y - radius
-                or int(tile["position"].y) > origin_position.y + radius + 1
-            ):
-                self.localmap.remove(tile)
-            else:
-                level[str(tile["position"].x)][str(tile["position"].y)] = tile[
-                    "terrain"
-                ].impassable  # so either remove a tile or figure out if it's impassable.
-
-        # draw a line to each edge of the viewport using grid_edges
-        # x's include top row and bottom rows, y's include min and max of viewport.
-        grid_edges = []
-        # now we have a level grid. let's get our edges so we can plot lines from origin to edge.
-        for x in range(origin_position.x - radius, origin_position.x + radius + 1):  # X
-            grid_edges.append((x, origin_position.y - radius))
-            grid_edges.append((x, origin_position.y + radius))
-        for y in range(origin_position.y - radius, origin_position.y + radius + 1):  # Y
-            grid_edges.append((origin_position.x - radius, y))
-            grid_edges.append((origin_position.x + radius, y))
-
-        tiles_to_keep = []
-        # now we need to remove tiles which are out of our field of view.
-        for destination in grid_edges:
-            for point in self.line((origin_position.x, origin_position.y), destination):
-                if level[str(point[0])][str(point[1])] is True:  # (impassable)
-                    tiles_to_keep.append(
-                        point
-                    )  # do this to keep the blocking wall visible.
-                    break  # hit a wall. move on to the next ray.
-                else:
-                    tiles_to_keep.append(point)
-
-        for tiles in self.localmap[:]:  # iterate a copy to remove correctly.
-            for point in tiles_to_keep:
-                if tiles["position"].x == point[0] and tiles["position"].y == point[1]:
-                    break
-            else:
-                self.localmap.remove(tiles)
-
     def update_map_for_position(self, position):
         if self.localmap is not None:
             # our map_grid is 13x13 but our localmap contains 13*3 x 13*3 tiles worth of chunks so we need
@@ -471,6 +412,38 @@ class MainWindow(glooey.containers.Stack):
         pass
 
 
+# how long each frame may spend handling messages from the server before leaving the rest for the next.
+MESSAGE_BUDGET = 0.005
+
+# seconds between pings, well inside the 300 seconds the server waits on a quiet client.
+KEEPALIVE_INTERVAL = 30.0
+
+
+def decode_message(message):
+    # does the slow part of handling a message on the network thread.
+    # localmaps and localmap updates come out with their chunks and tiles already decoded.
+    if isinstance(message, dict) and "request_id" in message:
+        message["reply"] = decode_message(message["reply"])
+        return message
+    if isinstance(message, dict) and "view" in message:
+        _chunks = dict()
+        for key, chunk in message["chunks"].items():
+            if isinstance(chunk, bytes):
+                # whole chunks come compressed when the connection can carry bytes.
+                chunk = zlib.decompress(chunk).decode("utf-8")
+            _chunks[key] = decode_packet(chunk)
+        message["chunks"] = _chunks
+        if len(message["tiles"]) > 0:
+            message["tiles"] = decode_packet(message["tiles"])
+        else:
+            message["tiles"] = dict()
+        return message
+    if isinstance(message, str) and message.startswith("["):
+        # all nine chunks. salts and the like are never json.
+        return decode_packet(message)
+    return message
+
+
 class Client(MastermindClientTCP):  # extends MastermindClientTCP
     def __init__(self):
         self.state = "login"  # character_select, character_gen, main
@@ -479,7 +452,18 @@ class Client(MastermindClientTCP):  # extends MastermindClientTCP
         self.window = pyglet.window.Window(896, 498)
         self.client_name = ""
         self.character_name = ""
-        self.last_request = time.time()
+        # the chunks we've been sent by key and which of them make up our localmap right now.
+        self.chunks = dict()
+        self.localmap_view = []
+        self.localmap_changed = False  # redraw the main window once the frame's messages are handled.
+
+        # messages read and decoded by the network thread, waiting for the pyglet loop.
+        self.messages = Queue()
+        self.network_thread = None
+
+        # request_id -> command for requests we haven't had a reply to yet.
+        self.pending_requests = dict()
+        self.next_request_id = 0
 
         pyglet.gl.glEnable(pyglet.gl.GL_BLEND)
         pyglet.gl.glBlendFunc(pyglet.gl.GL_SRC_ALPHA, pyglet.gl.GL_ONE_MINUS_SRC_ALPHA)
@@ -505,8 +489,48 @@ class Client(MastermindClientTCP):  # extends MastermindClientTCP
     # once the user selects a character ask the server to login into the world with it.
     # once we recieve a world state SWITCH to the MainWindow. MainWindow.localmap should be filled.
     def check_messages_from_server(self, dt):
+        # runs every frame. handle what the network thread has queued up until we're out of time.
+        _start = time.time()
+        while time.time() - _start < MESSAGE_BUDGET:
+            try:
+                next_update = self.messages.get_nowait()
+            except Empty:
+                break
+            self.handle_message(next_update)
+
+        if self.state == "main" and self.localmap_changed:
+            self.localmap_changed = False
+            self.gui.clear()
+            _raw_nine_chunks = [self.chunks[key] for key in self.localmap_view]
+            # we recieved a localmap from the server.
+            self.gui.add(self.main_window(_raw_nine_chunks, self.character_name))
+
+    def receive_messages(self):
+        # the network thread. reads and decodes messages so the pyglet loop never waits on either.
+        while self._mm_connected:
+            try:
+                next_update = self.receive(True)
+            except (MastermindError, OSError, ValueError) as e:
+                # disconnect() closes the socket under us, only complain if we didn't do that.
+                if self._mm_connected:
+                    print("lost connection to the server:", e)
+                return
+            try:
+                self.messages.put(decode_message(next_update))
+            except Exception:
+                # one message we can't make sense of shouldn't cost us the connection.
+                print("couldn't decode a message from the server:")
+                traceback.print_exc()
+
+    def handle_message(self, next_update):
+        if isinstance(next_update, dict) and "request_id" in next_update:
+            # a reply to something we asked for, we know what it is without guessing from its type.
+            self.pending_requests.pop(next_update["request_id"], None)
+            self.handle_reply(next_update["command"], next_update["reply"])
+            return
+
+        # untagged messages are localmap pushes, or replies from servers that don't tag them.
         # commands recieved while in the login window
-        next_update = client.receive(False)
         if self.state == "login":
             # we recieved a message from the server. let's process it.
             if next_update is not None:
@@ -515,14 +539,8 @@ class Client(MastermindClientTCP):  # extends MastermindClientTCP
                     # list of characters.
                     # print("list:", next_update)
                     # open the character select screen.
-                    self.gui.clear()
-                    self.gui.add(CustomBackground())
-                    self.CharacterSelectWindow = CharacterSelectWindow(next_update)
-                    self.CharacterSelectWindow.create_button.push_handlers(
-                        on_click=self.create_new_character
-                    )
-                    self.gui.add(self.CharacterSelectWindow)
-                    self.state = "character_select"
+                    self.show_character_select(next_update)
+                    return
 
                 if isinstance(next_update, str):
                     if next_update == "disconnect":
@@ -531,17 +549,7 @@ class Client(MastermindClientTCP):  # extends MastermindClientTCP
 
                 if isinstance(next_update, str):
                     # server sent salt
-                    _hashedPW = hashPassword(
-                        self.LoginWindow.password.text, next_update
-                    )
-                    command = Command(
-                        self.LoginWindow.username.text,
-                        "hashed_password",
-                        [str(_hashedPW)],
-                    )
-
-                    # send back hashed password.
-                    self.send(command)
+                    self.send_hashed_password(next_update)
 
         if self.state == "character_select":
             if next_update is not None:
@@ -549,43 +557,93 @@ class Client(MastermindClientTCP):  # extends MastermindClientTCP
                 if isinstance(next_update, list):
                     # list of characters.
                     # re-fresh the character select screen.
-                    self.gui.clear()
-
-                    self.gui.add(CustomBackground())
-                    self.CharacterSelectWindow = CharacterSelectWindow(next_update)
-                    self.CharacterSelectWindow.create_button.push_handlers(
-                        on_click=self.create_new_character
-                    )
-                    self.gui.add(self.CharacterSelectWindow)
-                    for button in self.CharacterSelectWindow.vbox_for_characterlist:
-                        if button.text != "Create a Character":
-                            button.push_handlers(
-                                on_click=lambda w: self.choose_character(w.text)
-                            )
+                    self.show_character_select(next_update)
 
         if self.state == "main":
             if next_update is not None:
-                self.gui.clear()
                 #print("next_update in main", type(next_update))
-                _raw_nine_chunks = decode_packet(next_update)
-                # we recieved a localmap from the server.
-                self.gui.add(self.main_window(_raw_nine_chunks, self.character_name))
-            elif time.time() - self.last_request > 1.0:
-                command = Command(
-                    self.client_name, "request_localmap_update", [self.character_name]
-                )
-                self.send(command)
-                self.last_request = time.time()
+                self.apply_localmap(next_update)
 
         if self.state == "character_gen":
             if next_update is not None:
                 print("--next_update in character_gen--")
                 # print(next_update)
 
+    def handle_reply(self, command, reply):
+        if command == "login":
+            # server sent salt
+            self.send_hashed_password(reply)
+        elif command in ("hashed_password", "completed_character"):
+            if reply == "disconnect":
+                self.disconnect()
+                return
+            self.show_character_select(reply)
+        elif command in ("choose_character", "request_localmap_update"):
+            self.apply_localmap(reply)
+
+    def request(self, command, args):
+        # sends a command tagged with a request_id so its reply can come back in any order.
+        self.next_request_id = self.next_request_id + 1
+        self.pending_requests[self.next_request_id] = command
+        self.send(Command(self.client_name, command, args, self.next_request_id))
+        return self.next_request_id
+
+    def send_hashed_password(self, salt):
+        _hashedPW = hashPassword(self.LoginWindow.password.text, salt)
+        # send back hashed password.
+        self.request("hashed_password", [str(_hashedPW)])
+
+    def show_character_select(self, list_of_characters):
+        self.gui.clear()
+
+        self.gui.add(CustomBackground())
+        self.CharacterSelectWindow = CharacterSelectWindow(list_of_characters)
+        self.CharacterSelectWindow.create_button.push_handlers(
+            on_click=self.create_new_character
+        )
+        self.gui.add(self.CharacterSelectWindow)
+        for button in self.CharacterSelectWindow.vbox_for_characterlist:
+            if button.text != "Create a Character":
+                button.push_handlers(
+                    on_click=lambda w: self.choose_character(w.text)
+                )
+        self.state = "character_select"
+
+    def apply_localmap(self, localmap):
+        if isinstance(localmap, dict):
+            # only the chunks and tiles that changed since the versions we sent.
+            self.apply_localmap_update(localmap)
+            self.localmap_changed = True
+        elif isinstance(localmap, list):
+            # all nine chunks.
+            self.chunks = dict()
+            self.localmap_view = []
+            for chunk in localmap:
+                self.chunks[chunk.get_key()] = chunk
+                self.localmap_view.append(chunk.get_key())
+            self.localmap_changed = True
+
+    def apply_localmap_update(self, update):
+        # update was already decoded by decode_message() on the network thread.
+        for key, chunk in update["chunks"].items():
+            self.chunks[key] = chunk
+        for key, (version, tiles) in update["tiles"].items():
+            for index, tile in tiles:
+                self.chunks[key].tiles[index] = tile
+        for key, version in update["versions"].items():
+            self.chunks[key].version = version
+        self.localmap_view = update["view"]
+        # forget chunks that went out of view, the server sends them whole if we come back.
+        for key in list(self.chunks.keys()):
+            if key not in self.localmap_view:
+                del self.chunks[key]
+
     def choose_character(self, name):
         self.state = "main"
         self.character_name = name
-        command = Command(self.client_name, "choose_character", [name])
+        self.request("choose_character", [name])
+        # the server pushes us localmap changes every turn from now on, no need to ask for them.
+        command = Command(self.client_name, "subscribe_localmap", [name])
         self.send(command)
 
     def create_new_character(self, dt):
@@ -618,8 +676,7 @@ class Client(MastermindClientTCP):  # extends MastermindClientTCP
         # set this before sending the command to keep things in order.
         self.state = "character_select"
 
-        command = Command(self.client_name, "completed_character", [_data])
-        self.send(command)
+        self.request("completed_character", [_data])
         # go back to the charcterSelectWindow and update it with the new character and let them select it.
 
     def login(self, dt):
@@ -631,16 +688,22 @@ class Client(MastermindClientTCP):  # extends MastermindClientTCP
         # set our client_name for future sending.
         self.client_name = self.LoginWindow.username.text
 
-        command = Command(self.LoginWindow.username.text, "login", ["noargs"])
-        self.send(command)
+        # read from the server on our own thread, the pyglet loop only picks up finished messages.
+        self.network_thread = threading.Thread(target=self.receive_messages, daemon=True)
+        self.network_thread.start()
+
+        self.request("login", ["noargs"])
         # -------------------------------------------------------
-        clock.schedule_interval(self.check_messages_from_server, 0.1)
+        clock.schedule(self.check_messages_from_server)
+        # our keep-alive event. the server pushes localmaps to us but only counts what we send it,
+        # so a player standing still would be disconnected without this.
+        clock.schedule_interval(self.ping, KEEPALIVE_INTERVAL)
 
-    # our keep-alive event. without this the server would disconnect if we don't send data within the timeout for the server. (usually 60 seconds)
-    # clock.schedule_interval(self.ping, 30.0)
     def ping(self, dt):
-        command = Command(self.username, "ping")
-        client.send(command)
+        if not self._mm_connected:
+            clock.unschedule(self.ping)
+            return
+        self.request("ping", [])
 
 
 if __name__ == "__main__":
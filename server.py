@@ -10,13 +10,22 @@ import pprint
 import configparser
 import logging.config
 import pickle
-from collections import defaultdict
+from collections import defaultdict, deque
 
+import Mastermind._mm_netutil as netutil
 from Mastermind._mm_server import MastermindServerTCP
+from Mastermind._mm_constants import MM_SEND_DROP, MM_SEND_DISCONNECT, MM_ENCODING_BINARY
+from Mastermind._mm_compression import train_dictionary
+from src.accountstore import make_account_store
 from src.action import Action
 from src.blueprint import Blueprint
 from src.calendar import Calendar
-from src.command import Command
+from src.characterstore import CharacterStore
+from src.chunkcache import ChunkCache
+from src.command import Command, Reply
+from src.commandscheduler import CommandScheduler
+from src.flowfield import FlowFields
+from src.fov import FieldsOfView
 from src.furniture import Furniture, FurnitureManager
 from src.item import Container, Item
 from src.options import Options
@@ -25,9 +34,12 @@ from src.position import Position
 from src.recipe import Recipe, RecipeManager
 from src.terrain import Terrain
 from src.profession import ProfessionManager, Profession
-from src.monster import MonsterManager
-from src.worldmap import Worldmap
+from src.monster import Monster, MonsterManager
+from src.worldmap import Worldmap, hidden_tile
 from src.passhash import makeSalt
+from src.pathcache import PathCache
+from src.pathfinding import HierarchicalPathfinder, Pathfinder
+from src.pathworkers import PathWorkers
 from src.serializer import encode_packet, decode_packet
 
 
@@ -42,7 +54,18 @@ class OverMap:  # when the character pulls up the OverMap. a OverMap for each ch
 
 class Server(MastermindServerTCP):
     def __init__(self, config, logger=None):
-        MastermindServerTCP.__init__(self, 0.5, 0.5, 300.0)
+        send_queue_policy = MM_SEND_DROP
+        if config.get("send_queue_policy", "drop") == "disconnect":
+            send_queue_policy = MM_SEND_DISCONNECT
+        MastermindServerTCP.__init__(
+            self,
+            0.5,
+            0.5,
+            300.0,
+            int(config.get("send_queue_size", 1048576)),
+            send_queue_policy,
+            int(config.get("max_message_size", 16777216)),
+        )
         self._config = config
         if logger == None:
             logging.basicConfig()
@@ -54,10 +77,38 @@ class Server(MastermindServerTCP):
         else:
             self._log = logger
 
-        # all the characters() that exist in the world whether connected or not.
-        self.characters = dict()
+        # accounts and character records, in ./accounts or a database depending on account_store.
+        self.account_store = make_account_store(config)
+        # characters are saved to their own records, a batch at a time, when they change.
+        self.character_store = CharacterStore(
+            self.account_store, int(config.get("character_save_batch", 32))
+        )
+        # all the characters() that have been loaded, whether connected or not.
+        self.characters = self.character_store.characters
 
         self.localmaps = dict()  # the localmaps for each character.
+        # the chunk versions each character's client last told us it has, by chunk key.
+        self.localmap_acks = dict()
+        # when each character's client was last sent whole chunks whether it needed them or not.
+        self.localmap_resync_times = dict()
+        self.localmap_resync_interval = float(
+            config.get("localmap_resync_interval", 30.0)
+        )
+        # the connection each subscribed character's localmap gets pushed to.
+        self.localmap_subscriptions = dict()
+        self.localmap_dropped_frames = dict()  # by character, to notice when a push was dropped.
+        # chunk key -> names of the subscribed characters that can see that chunk.
+        self.chunk_subscribers = defaultdict(set)
+        self.chunk_views = dict()  # character name -> the chunk keys it's subscribed to.
+        # character name -> {chunk key: (version, mask of the tiles the client was sent at it)},
+        # see fields_of_view.
+        self.localmap_seen = dict()
+        # connections that went away, handed from their own threads to the main loop to tidy up.
+        self.disconnected_clients = deque()
+        # chunks are encoded once per version no matter how many characters can see them.
+        self.chunk_cache = ChunkCache(int(config.get("chunk_cache_size", 16777216)))
+        # per client rate limits and fair ordering for incoming commands.
+        self.command_scheduler = CommandScheduler(int(config.get("command_queue_size", 64)))
         self.overmaps = dict()  # the dict of all overmaps by character.name
         # self.options = Options()
         self.calendar = Calendar(0, 0, 0, 0, 0, 0)  # all zeros is the epoch
@@ -69,46 +120,125 @@ class Server(MastermindServerTCP):
         self.MonsterManager = MonsterManager()
         self.ItemManager = self.worldmap.ItemManager
         self.FurnitureManager = self.worldmap.FurnitureManager
+        self.TileManager = self.worldmap.TileManager
+        self.pathfinder = Pathfinder(
+            self.worldmap,
+            self.TileManager.TILE_TYPES,
+            self.FurnitureManager.FURNITURE_TYPES,
+            max_nodes=int(config.get("pathfinding_max_nodes", 4000)),
+        )
+        # long routes go over chunk entrances first, short ones straight to pathfinder.
+        self.hierarchical_pathfinder = HierarchicalPathfinder(self.pathfinder)
+        # everything chasing the same target shares one flow field, see chase().
+        self.flow_fields = FlowFields(self.pathfinder)
+        # clients are only sent the tiles their character can see, the rest are blanks.
+        self.fields_of_view = FieldsOfView(self.worldmap, int(config.get("fov_radius", 13)))
+        self.path_cache = PathCache(self.pathfinder, int(config.get("path_cache_size", 1024)))
+        # calculated_move routes are found on these threads and queued at the start of a turn.
+        self.path_workers = PathWorkers(
+            self.hierarchical_pathfinder,
+            int(config.get("pathfinding_workers", 2)),
+            self.path_cache,
+        )
 
     def get_connections(self):
         return self._mm_connections
 
     # normally we will want to consider impassable terrain in movement calculations. Creatures that can walk or break through walls don't need to though.
     def calculate_route(self, pos0, pos1, consider_impassable=True):
-        reachable = [pos0]
-        explored = []
-
-        while len(reachable) > 0:
-            position = random.choice(
-                reachable
-            )  # get a random reachable position #TODO: be a little more intelligent about picking the best reachable position.
-
-            # If we just got to the goal node. return the path.
-            if position == pos1:
-                path = []
-                while position != pos0:
-                    path.append(position)
-                    position = position.previous
-                ret_path = []
-                for step in path:
-                    ret_path.insert(0, step)
-                return ret_path
-
-            # Don't repeat ourselves.
-            reachable.remove(position)
-            explored.append(position)
-
-            new_reachable = self.worldmap.get_adjacent_positions_non_impassable(
-                position
+        # returns the Positions from pos0 to pos1, not including pos0. None if there's no route.
+        _route = self.path_cache.get(pos0, pos1, consider_impassable)
+        if _route is None:
+            _route = self.hierarchical_pathfinder.find_path(pos0, pos1, consider_impassable)
+            if _route is not None:
+                self.path_cache.put(
+                    pos0,
+                    pos1,
+                    _route,
+                    self.path_cache.versions(self.pathfinder, pos0, _route),
+                    consider_impassable,
+                )
+        return _route
+
+    def queue_route(self, creature, route):
+        # fill creature's queue with the move actions that walk route.
+        _x = creature.position.x
+        _y = creature.position.y
+        _z = creature.position.z
+        for step in route:
+            if _x > step.x:
+                _direction = "west"
+            elif _x < step.x:
+                _direction = "east"
+            elif _y > step.y:
+                _direction = "north"
+            elif _y < step.y:
+                _direction = "south"
+            elif _z < step.z:
+                _direction = "up"
+            else:
+                _direction = "down"
+            creature.command_queue.append(Action(creature, "move", [_direction]))
+            # pretend as if we are in the next position.
+            _x = step.x
+            _y = step.y
+            _z = step.z
+
+    def queued_position(self, creature):
+        # where creature ends up once the moves already in its queue are done. routes are queued
+        # behind them so that's where they start.
+        _directions = {
+            "north": (0, -1, 0),
+            "south": (0, 1, 0),
+            "east": (1, 0, 0),
+            "west": (-1, 0, 0),
+            "up": (0, 0, 1),
+            "down": (0, 0, -1),
+        }
+        _x = creature.position.x
+        _y = creature.position.y
+        _z = creature.position.z
+        for action in creature.command_queue:
+            if action.action_type != "move":
+                continue
+            _dx, _dy, _dz = _directions.get(action.args[0], (0, 0, 0))
+            _x = _x + _dx
+            _y = _y + _dy
+            _z = _z + _dz
+        return Position(_x, _y, _z)
+
+    def deliver_routes(self):
+        # queue the routes the path workers finished since last turn.
+        for name, request in self.path_workers.completed():
+            _character = self.characters.get(name)
+            if _character is None:
+                continue
+            _start = self.queued_position(_character)
+            if _start != request.start:
+                # its queue changed while we were looking, e.g. a move failed, look again. walking
+                # the moves it already had doesn't change where the route starts.
+                self.path_workers.submit(name, _start, request.goal, request.consider_impassable)
+                continue
+            self._log.debug(
+                "Calculated route for Character {}: {}".format(_character, request.route)
             )
-            for adjacent in new_reachable:
-                if abs(adjacent.x - pos0.x) > 10 or abs(adjacent.y - pos0.y) > 10:
-                    continue
-                if adjacent not in reachable and adjacent not in explored:
-                    adjacent.previous = position  # Remember how we got there.
-                    reachable.append(adjacent)
-
-        return None
+            if request.route is None:
+                self._log.debug("No _route possible.")
+                continue
+            self.queue_route(_character, request.route)
+
+    def chase(self, creature, target):
+        # queue creature's next step towards target, a creature or a Position. False if there's
+        # nowhere better for it to be.
+        _step = self.flow_fields.next_step(target, creature.position)
+        if _step is None:
+            return False
+        if _step.x != creature.position.x:
+            _direction = "east" if _step.x > creature.position.x else "west"
+        else:
+            _direction = "south" if _step.y > creature.position.y else "north"
+        creature.command_queue.append(Action(creature, "move", [_direction]))
+        return True
 
     def find_spawn_point_for_new_character(self):
         _tiles = self.worldmap.get_all_tiles()
@@ -207,24 +337,31 @@ class Server(MastermindServerTCP):
                                         self.ItemManager.ITEM_TYPES[item_ident],
                                     )
                                 )
-        path = str(
-            "./accounts/"
-            + str(ident)
-            + "/"
-            + str("characters")
-            + "/"
-            + str(character.name)
-            + ".character"
-        )
-
-        with open(path, "w") as fp:
-            _encoded = encode_packet(character, unpicklable=False, warn=True)
-            json.dump(_encoded, fp)
+        # written to the account store with the next batch.
+        self.character_store.add(ident, self.characters[character.name])
 
         self._log.info(
             "New character added to world: {}".format(character.name)
         )
 
+    def get_character(self, name):
+        # a character already standing in the world is the one to use even if it has a record,
+        # otherwise choosing it puts a second copy down and leaves the first as a ghost. the
+        # record is for characters that aren't in the world, like after the chunks were reset.
+        if name in self.characters:
+            return self.characters[name]
+        if name not in self.character_store:
+            return None
+        _character = self.worldmap.get_character(name)
+        if _character is not None:
+            self.character_store.put(name, _character)
+            return _character
+        return self.character_store.get(name)
+
+    def character_list(self, account):
+        # what the client shows on character select, the name, profession and last position of each.
+        return self.character_store.summaries(account, self.get_character)
+
     def callback_client_handle(self, connection_object, data):
         self._log.debug(
             "Server: Recieved data {} from client {}.".format(
@@ -233,7 +370,9 @@ class Server(MastermindServerTCP):
         )
 
         try:
-            _command = Command(data["ident"], data["command"], data["args"])
+            _command = Command(
+                data["ident"], data["command"], data["args"], data.get("request_id")
+            )
         except:
             self._log.debug(
                 "Server: invalid data {} from client {}.".format(
@@ -242,83 +381,102 @@ class Server(MastermindServerTCP):
             )
             return
 
+        # commands are run on the main thread in process_commands() so no one client can hog it.
+        if not self.command_scheduler.submit(connection_object, _command):
+            self._log.debug(
+                "Server: command queue full for client {}, dropped {}.".format(
+                    connection_object.address, _command["command"]
+                )
+            )
+
+        return super(Server, self).callback_client_handle(connection_object, data)
+
+    def process_commands(self, budget=None):
+        # runs the commands clients have queued up, fairly and within their rate limits.
+        return self.command_scheduler.drain(self.process_command, budget)
+
+    def process_command(self, connection_object, data):
+        _command = data
         # we recieved a valid command. process it.
         if isinstance(_command, Command):
             if _command["command"] == "login":
                 # check whether this username has an account.
-                _path = "./accounts/" + _command["ident"] + "/"
-                # try:
-                if os.path.isdir("./accounts/" + _command["ident"]):
-                    with open(str(_path + "SALT")) as f:
-                        # send the user their salt.
-                        _salt = f.read()
-                        self.callback_client_send(connection_object, str(_salt))
-                else:
-                    try:
-                        os.mkdir(_path)
-                    except OSError:
-                        print("Creation of the directory %s failed" % _path)
-                    else:
-                        print("Successfully created the directory %s " % _path)
-
-                    # create salt file
+                _salt = self.account_store.get_salt(_command["ident"])
+                if _salt is None:
+                    # create the account with a new salt.
                     _salt = makeSalt()
-                    with open(str(_path + "SALT"), "w") as f:
-                        f.write(str(_salt))
-
-                    # send the user their salt.
-                    self.callback_client_send(connection_object, str(_salt))
+                    self.account_store.create(_command["ident"], _salt)
+                    print("Successfully created the account %s " % _command["ident"])
 
-                    _path = "./accounts/" + _command["ident"] + "/characters/"
-                    try:
-                        os.mkdir(_path)
-                    except OSError:
-                        print("Creation of the directory %s failed" % _path)
-                    else:
-                        print("Successfully created the directory %s " % _path)
+                # send the user their salt.
+                self.callback_client_send(connection_object, str(_salt), request=_command)
 
             if _command["command"] == "hashed_password":
-                _path = "./accounts/" + _command["ident"] + "/"
-                if not os.path.isfile(str(_path + "HASHED_PASSWORD")):
+                _checkPW = self.account_store.get_password(_command["ident"])
+                if _checkPW is None and self.account_store.exists(_command["ident"]):
                     # recieved hashedPW from user, save it and send them a list of characters. (presumaably zero if this is a new user. maybe give options to take over NPCs?)
-                    with open(str(_path + "HASHED_PASSWORD"), "w") as f:
-                        f.write(str(_command["args"][0]))
+                    self.account_store.set_password(_command["ident"], _command["args"][0])
+                    _checkPW = str(_command["args"][0])
                 else:
                     print("password exists")
 
-                with open(str(_path + "HASHED_PASSWORD")) as f:
-                    _checkPW = f.read()
-                    if _checkPW == _command["args"][0]:
-                        print("password accepted for " + str(_command["ident"]))
-                        # get a list of the Character(s) the username 'owns' and send it to them. it's okay to send an empty list.
-                        _tmp_list = list()
-                        # if there are no characters to add the list remains empty.
-                        for root, _, files in os.walk(
-                            "./accounts/" + _command["ident"] + "/characters/"
-                        ):
-                            for file_data in files:
-                                if file_data.endswith(".character"):
-                                    with open(root + file_data, 'r') as data_file:
-                                        _raw = json.load(data_file)
-                                        # client will need to decode these 
-                                        _tmp_list.append(_raw)
-
-                        self.callback_client_send(connection_object, _tmp_list)
-                    else:
-                        self.callback_client_send(connection_object, "disconnect")
-                        connection_object.terminate()
+                if _checkPW == _command["args"][0]:
+                    print("password accepted for " + str(_command["ident"]))
+                    # get a list of the Character(s) the username 'owns' and send it to them. it's okay to send an empty list.
+                    _tmp_list = self.character_list(_command["ident"])
+
+                    self.callback_client_send(connection_object, _tmp_list, request=_command)
+                else:
+                    self.callback_client_send(connection_object, "disconnect", request=_command)
+                    connection_object.terminate()
 
             if _command["command"] == "choose_character":
                 # send the current localmap to the player choosing the character
-                self.characters[data['args'][0]] = self.worldmap.get_character(data['args'][0])
+                _character = self.get_character(data['args'][0])
+                if _character is None:
+                    self._log.warning(
+                        "Server: no character {} for {}.".format(
+                            data['args'][0], connection_object.address
+                        )
+                    )
+                    return
+                # a character loaded from its record goes back where it was saved, unless someone
+                # else is standing there now.
+                _tile = self.worldmap.get_tile_by_position(_character.position)
+                if _tile["creature"] is not _character:
+                    if _tile["creature"] is not None:
+                        _character.position = self.find_spawn_point_for_new_character()
+                    self.worldmap.put_object_at_position(_character, _character.position)
                 self.localmaps[data['args'][0]] = self.worldmap.get_chunks_near_position(
                     self.characters[data['args'][0]].position
                 )
-                self.callback_client_send(connection_object, encode_packet(self.localmaps[data['args'][0]]))
+                self.localmap_acks[data['args'][0]] = dict()
+                for chunk in self.localmaps[data['args'][0]]:
+                    self.localmap_acks[data['args'][0]][chunk.get_key()] = chunk.version
+                self.localmap_resync_times[data['args'][0]] = time.time()
+                if _command.get("request_id") is not None:
+                    # clients that tag their requests take localmap updates, with chunks from the
+                    # chunk cache, the rest want the list of chunks visible_localmap() makes.
+                    self.localmap_acks[data['args'][0]] = (
+                        self.send_localmap_update(
+                            connection_object, data['args'][0], dict(), _command
+                        )
+                        or dict()
+                    )
+                else:
+                    self.callback_client_send(
+                        connection_object,
+                        encode_packet(self.visible_localmap(data['args'][0])),
+                        request=_command,
+                    )
 
             if _command["command"] == "completed_character":
-                if not data["ident"] in self.characters:
-                    _character = decode_packet(data["args"][0])
+                _character = decode_packet(data["args"][0])
+                # names are unique across every account, characters are looked up by name alone.
+                if (
+                    _character.name not in self.characters
+                    and _character.name not in self.character_store
+                ):
                     # this character doesn't exist in the world yet.
                     self.handle_new_character(data["ident"], _character)
                     self._log.debug(
@@ -329,33 +487,45 @@ class Server(MastermindServerTCP):
                 else:
                     self._log.debug(
                         "Server: character NOT created. Already Exists.: {} From client {}.".format(
-                            data["ident"], connection_object.address
+                            _character.name, connection_object.address
                         )
                     )
-                _tmp_list = list()
-                for root, _, files in os.walk(
-                        "./accounts/" + _command["ident"] + "/characters/"
-                    ):
-                        for file_data in files:
-                            if file_data.endswith(".character"):
-                                with open(root + file_data, 'r') as data_file:
-                                    _raw = json.load(data_file)
-                                    # client will need to decode these 
-                                    _tmp_list.append(_raw)
+                _tmp_list = self.character_list(_command["ident"])
 
-                self.callback_client_send(connection_object, _tmp_list)
+                self.callback_client_send(connection_object, _tmp_list, request=_command)
 
             if _command["command"] == "request_localmap_update":
-                self.localmaps[data["args"][0]] = self.worldmap.get_chunks_near_position(
-                    self.characters[data["args"][0]].position
-                )
-                self.callback_client_send(
-                    connection_object, encode_packet(self.localmaps[data["args"][0]])
-                )
+                if len(data["args"]) > 1 and not self.valid_acks(data["args"][1]):
+                    self._log.debug(
+                        "Server: invalid acks {} from client {}.".format(
+                            data["args"][1], connection_object.address
+                        )
+                    )
+                elif len(data["args"]) > 1:
+                    # args[1] is the chunk versions the client already has, only send what changed since.
+                    self.localmap_acks[data["args"][0]] = data["args"][1]
+                    self.send_localmap_update(
+                        connection_object, data["args"][0], data["args"][1], _command
+                    )
+                else:
+                    # older clients want all nine chunks every time.
+                    self.localmaps[data["args"][0]] = self.worldmap.get_chunks_near_position(
+                        self.characters[data["args"][0]].position
+                    )
+                    self.callback_client_send(
+                        connection_object,
+                        encode_packet(self.visible_localmap(data["args"][0])),
+                        request=_command,
+                    )
+
+            if _command["command"] == "subscribe_localmap":
+                # from now on push_localmap_updates() sends this character's localmap every turn it changes.
+                self.localmap_subscriptions[data["args"][0]] = connection_object
+                self.localmap_dropped_frames[data["args"][0]] = connection_object.outbound.dropped_frames
 
             # all the commands that are actions need to be put into the command_queue then we will loop through the queue each turn and process the actions.
             if _command["command"] == "ping":
-                self.callback_client_send(connection_object, "pong")
+                self.callback_client_send(connection_object, "pong", request=_command)
 
             if _command["command"] == "move":
                 self.characters[data["ident"]].command_queue.append(
@@ -425,58 +595,15 @@ class Server(MastermindServerTCP):
                     )
                 )
 
-                _position = Position(data.args[0], data.args[1], data.args[2])
-                _route = self.calculate_route(
-                    self.characters[data["ident"]].position, _position
-                )  # returns a route from point 0 to point 1 as a series of Position(s)
-                self._log.debug(
-                    "Calculated route for Character {}: {}".format(
-                        self.characters[data["ident"]], _route
-                    )
+                _position = Position(data["args"][0], data["args"][1], data["args"][2])
+                # the route is queued by deliver_routes() once a path worker has found it.
+                self.path_workers.submit(
+                    data["ident"], self.queued_position(self.characters[data["ident"]]), _position
                 )
 
-                # fill the queue with move commands to reach the tile.
-                _x = self.characters[data["ident"]].position.x
-                _y = self.characters[data["ident"]].position.y
-                _z = self.characters[data["ident"]].position.z
-                action = None
-                if _route is None:
-                    self._log.debug("No _route possible.")
-                    return
-                for step in _route:
-                    _next_x = step.x
-                    _next_y = step.y
-                    _next_z = step.z
-                    if _x > _next_x:
-                        action = Action(
-                            self.characters[data["ident"]], "move", ["west"]
-                        )
-                    elif _x < _next_x:
-                        action = Action(
-                            self.characters[data["ident"]], "move", ["east"]
-                        )
-                    elif _y > _next_y:
-                        action = Action(
-                            self.characters[data["ident"]], "move", ["north"]
-                        )
-                    elif _y < _next_y:
-                        action = Action(
-                            self.characters[data["ident"]], "move", ["south"]
-                        )
-                    elif _z < _next_z:
-                        action = Action(self.characters[data["ident"]], "move", ["up"])
-                    elif _z > _next_z:
-                        action = Action(
-                            self.characters[data["ident"]], "move", ["down"]
-                        )
-                    self.characters[data["ident"]].command_queue.append(action)
-                    # pretend as if we are in the next position.
-                    _x = _next_x
-                    _y = _next_y
-                    _z = _next_z
-
             if _command["command"] == "move_item_to_character_storage":
                 _character = self.characters[data["ident"]]
+                self.character_store.mark_dirty(_character.name)
                 _from_pos = Position(data.args[0], data.args[1], data.args[2])
                 _item_ident = data.args[3]
                 _from_item = None
@@ -524,6 +651,7 @@ class Server(MastermindServerTCP):
                                 self.worldmap.get_tile_by_position(_from_pos)[
                                     "items"
                                 ].remove(item)
+                                self.worldmap.mark_tile_changed(_from_pos)
                                 break
                         return
                     else:
@@ -533,6 +661,7 @@ class Server(MastermindServerTCP):
             if _command["command"] == "move_item":
                 # client sends 'hey server. can you move this item from this to that?'
                 _character_requesting = self.characters[data["ident"]]
+                self.character_store.mark_dirty(_character_requesting.name)
                 _item = data.args[0]  # the item we are moving.
                 _from_type = data.args[
                     1
@@ -577,6 +706,7 @@ class Server(MastermindServerTCP):
                     if _item in _from_list:
                         _from_list.remove(_item)
                         _to_list.append(_item)
+                        self.worldmap.mark_tile_changed(_position)
                         return
                 elif (
                     _from_type == "blueprint"
@@ -606,9 +736,10 @@ class Server(MastermindServerTCP):
                 # blueprint to position (empty blueprint on ground)
                 # blueprint to creature (grab from blueprint)
 
-        return super(Server, self).callback_client_handle(connection_object, data)
-
-    def callback_client_send(self, connection_object, data, compression=True):
+    def callback_client_send(self, connection_object, data, compression=True, request=None):
+        # replies to a command that came with a request_id are wrapped so the client can match them up.
+        if request is not None and request.get("request_id") is not None:
+            data = Reply(request["request_id"], request["command"], data)
         return super(Server, self).callback_client_send(
             connection_object, data, compression
         )
@@ -623,8 +754,208 @@ class Server(MastermindServerTCP):
         self._log.info(
             "Server: Client from {} disconnected.".format(connection_object.address)
         )
+        self._log.info(
+            "Server: Compression for {}: {}".format(
+                connection_object.address, connection_object.outbound.stats.report()
+            )
+        )
+        _stats = self.command_scheduler.remove(connection_object)
+        if _stats is not None:
+            self._log.info(
+                "Server: Commands from {}: {}".format(
+                    connection_object.address, _stats.report()
+                )
+            )
+        # the subscriptions are the main loop's, unsubscribe there. after remove() above so none
+        # of this connection's commands can be run once it has been dropped.
+        self.disconnected_clients.append(connection_object)
         return super(Server, self).callback_disconnect_client(connection_object)
 
+    def drop_disconnected_clients(self):
+        while self.disconnected_clients:
+            connection_object = self.disconnected_clients.popleft()
+            for name, subscribed in list(self.localmap_subscriptions.items()):
+                if subscribed is connection_object:
+                    self.unsubscribe_localmap(name)
+                    self.path_workers.cancel(name)
+
+    def visible_localmap(self, name):
+        # the chunks in name's localmap with what they can't see blanked out.
+        _masks = self.fields_of_view.masks(name, self.characters[name].position)
+        _seen = dict()
+        _chunks = []
+        for chunk in self.localmaps[name]:
+            _visible = _masks.get(chunk.get_key(), 0)
+            _seen[chunk.get_key()] = (chunk.version, _visible)
+            _chunks.append(chunk.masked(_visible))
+        self.localmap_seen[name] = _seen
+        return _chunks
+
+    def valid_acks(self, acks):
+        # acks come from the client and are compared against chunk versions every turn after.
+        return isinstance(acks, dict) and all(
+            isinstance(key, str) and type(version) is int for key, version in acks.items()
+        )
+
+    def build_localmap_update(self, name, acks, compressed=False):
+        # acks is {chunk key: version} for the chunks the client has. returns None if it's up to date.
+        # whole chunks come out of the chunk cache already encoded, compressed if the client takes bytes.
+        _chunks = self.worldmap.get_chunks_near_position(self.characters[name].position)
+        self.localmaps[name] = _chunks
+
+        _full = (
+            time.time() - self.localmap_resync_times.get(name, 0.0)
+            > self.localmap_resync_interval
+        )
+        if _full:
+            # every so often send everything in case something changed that we didn't track.
+            self.localmap_resync_times[name] = time.time()
+
+        # only tiles the character can see are sent. seen is which ones the client has been sent
+        # at the version it acked, a tile that comes into view is sent and one that goes out of
+        # view is sent blank.
+        _masks = self.fields_of_view.masks(name, self.characters[name].position)
+        _seen = self.localmap_seen.get(name, dict())
+
+        # versions are read before the tiles so a change made while we encode gets sent again next time.
+        _update = {"view": [], "versions": dict(), "chunks": dict(), "tiles": "", "seen": dict()}
+        _tiles = dict()
+        for chunk in _chunks:
+            _key = chunk.get_key()
+            _update["view"].append(_key)
+            if _key in _update["versions"]:
+                continue
+            _version = chunk.version
+            _update["versions"][_key] = _version
+            _visible = _masks.get(_key, 0)
+            _update["seen"][_key] = (_version, _visible)
+            _acked = acks.get(_key)
+            _seen_at = _seen.get(_key)
+            if (
+                _full
+                or not isinstance(_acked, int)
+                or _acked > _version
+                or _seen_at is None
+                or _seen_at[0] != _acked
+            ):
+                # new in view (or from before a server restart), send the whole chunk.
+                _update["chunks"][_key] = self.chunk_cache.get(chunk, compressed, _visible)
+                continue
+            _send = _visible ^ _seen_at[1]
+            if _acked < _version:
+                for index in chunk.get_tiles_changed_since(_acked):
+                    _send = _send | (_visible & 1 << index)
+            if _send == 0 and _acked == _version:
+                continue
+            _changed = []
+            index = 0
+            while _send:
+                if _send & 1:
+                    if _visible >> index & 1:
+                        _changed.append([index, chunk.tiles[index]])
+                    else:
+                        _changed.append([index, hidden_tile(chunk.tiles[index]["position"])])
+                _send = _send >> 1
+                index = index + 1
+            _tiles[_key] = [_version, _changed]
+
+        if len(_update["chunks"]) == 0 and len(_tiles) == 0:
+            if set(_update["view"]) == set(acks.keys()):
+                return None
+        if len(_tiles) > 0:
+            _update["tiles"] = encode_packet(_tiles)
+        return _update
+
+    def send_localmap_update(self, connection_object, name, acks, request=None):
+        # returns the chunk versions that were sent, None if there was nothing to send or it failed.
+        # request is the command being replied to, None when we're pushing.
+        _compressed = (
+            netutil.protocol_encoding(connection_object.protocol_version)
+            == MM_ENCODING_BINARY
+        )
+        _update = self.build_localmap_update(name, acks, _compressed)
+        if _update is None:
+            return None
+        _seen = _update.pop("seen")
+        # cached chunks are compressed already, compressing them again is wasted time.
+        if self.callback_client_send(
+            connection_object,
+            _update,
+            not (_compressed and len(_update["chunks"]) > 0),
+            request,
+        ):
+            self.localmap_seen[name] = _seen
+            return _update["versions"]
+        return None
+
+    def unsubscribe_localmap(self, name):
+        self.localmap_subscriptions.pop(name, None)
+        self.localmap_seen.pop(name, None)
+        self.fields_of_view.forget(name)
+        for key in self.chunk_views.pop(name, []):
+            self.chunk_subscribers[key].discard(name)
+
+    def push_localmap_updates(self):
+        # called at the end of every turn. sends subscribed characters whatever changed around them.
+        self.drop_disconnected_clients()
+        _to_update = set()
+        _chunks = dict()
+        for name, connection_object in list(self.localmap_subscriptions.items()):
+            if connection_object.outbound.dropped_frames != self.localmap_dropped_frames.get(name):
+                # the send queue threw away something we pushed so start over from whole chunks.
+                self.localmap_dropped_frames[name] = connection_object.outbound.dropped_frames
+                self.localmap_acks[name] = dict()
+                _to_update.add(name)
+
+            # move the subscription along with the character.
+            _view = set()
+            for chunk in self.worldmap.get_chunks_near_position(self.characters[name].position):
+                _view.add(chunk.get_key())
+                _chunks[chunk.get_key()] = chunk
+            if _view != self.chunk_views.get(name):
+                for key in self.chunk_views.get(name, set()) - _view:
+                    self.chunk_subscribers[key].discard(name)
+                for key in _view:
+                    self.chunk_subscribers[key].add(name)
+                self.chunk_views[name] = _view
+                _to_update.add(name)
+
+            if time.time() - self.localmap_resync_times.get(name, 0.0) > self.localmap_resync_interval:
+                _to_update.add(name)
+
+        # each chunk is checked once no matter how many characters can see it.
+        for key, chunk in _chunks.items():
+            for name in list(self.chunk_subscribers[key]):
+                if name not in _to_update and self.localmap_acks.get(name, dict()).get(key) != chunk.version:
+                    _to_update.add(name)
+
+        for name in _to_update:
+            if name not in self.localmap_subscriptions:
+                continue
+            _versions = self.send_localmap_update(
+                self.localmap_subscriptions[name], name, self.localmap_acks.get(name, dict())
+            )
+            # TCP gets it there in order, unless the send queue drops it which is checked for above.
+            if _versions is not None:
+                self.localmap_acks[name] = _versions
+
+    def train_compression_dictionary(self, sample_size=16):
+        # prime every client's zlib stream with what chunks usually look like.
+        _chunks = []
+        for i, dictionary_x in self.worldmap.WORLDMAP.items():
+            for j, dictionary_y in dictionary_x.items():
+                for k, chunk in dictionary_y.items():
+                    _chunks.append(chunk)
+        random.shuffle(_chunks)
+        _samples = [encode_packet(chunk) for chunk in _chunks[:sample_size]]
+        _dictionary = train_dictionary(_samples)
+        self.set_compression_dictionary(_dictionary)
+        self._log.info(
+            "Trained a {} byte compression dictionary from {} chunks.".format(
+                len(_dictionary), len(_samples)
+            )
+        )
+
     def process_creature_command_queue(self, creature):
         actions_to_take = creature.actions_per_turn
         for action in creature.command_queue[
@@ -644,108 +975,108 @@ class Server(MastermindServerTCP):
                 actions_to_take = actions_to_take - 1  # moving costs 1 ap.
                 if action.args[0] == "south":
                     if self.worldmap.move_object_from_position_to_position(
-                        self.characters[creature.name],
-                        self.characters[creature.name].position,
+                        creature,
+                        creature.position,
                         Position(
-                            self.characters[creature.name].position.x,
-                            self.characters[creature.name].position.y + 1,
-                            self.characters[creature.name].position.z,
+                            creature.position.x,
+                            creature.position.y + 1,
+                            creature.position.z,
                         ),
                     ):
-                        self.characters[creature.name].position = Position(
-                            self.characters[creature.name].position.x,
-                            self.characters[creature.name].position.y + 1,
-                            self.characters[creature.name].position.z,
+                        creature.position = Position(
+                            creature.position.x,
+                            creature.position.y + 1,
+                            creature.position.z,
                         )
                     creature.command_queue.remove(
                         action
                     )  # remove the action after we process it.
                 if action.args[0] == "north":
                     if self.worldmap.move_object_from_position_to_position(
-                        self.characters[creature.name],
-                        self.characters[creature.name].position,
+                        creature,
+                        creature.position,
                         Position(
-                            self.characters[creature.name].position.x,
-                            self.characters[creature.name].position.y - 1,
-                            self.characters[creature.name].position.z,
+                            creature.position.x,
+                            creature.position.y - 1,
+                            creature.position.z,
                         ),
                     ):
-                        self.characters[creature.name].position = Position(
-                            self.characters[creature.name].position.x,
-                            self.characters[creature.name].position.y - 1,
-                            self.characters[creature.name].position.z,
+                        creature.position = Position(
+                            creature.position.x,
+                            creature.position.y - 1,
+                            creature.position.z,
                         )
                     creature.command_queue.remove(
                         action
                     )  # remove the action after we process it.
                 if action.args[0] == "east":
                     if self.worldmap.move_object_from_position_to_position(
-                        self.characters[creature.name],
-                        self.characters[creature.name].position,
+                        creature,
+                        creature.position,
                         Position(
-                            self.characters[creature.name].position.x + 1,
-                            self.characters[creature.name].position.y,
-                            self.characters[creature.name].position.z,
+                            creature.position.x + 1,
+                            creature.position.y,
+                            creature.position.z,
                         ),
                     ):
-                        self.characters[creature.name].position = Position(
-                            self.characters[creature.name].position.x + 1,
-                            self.characters[creature.name].position.y,
-                            self.characters[creature.name].position.z,
+                        creature.position = Position(
+                            creature.position.x + 1,
+                            creature.position.y,
+                            creature.position.z,
                         )
                     creature.command_queue.remove(
                         action
                     )  # remove the action after we process it.
                 if action.args[0] == "west":
                     if self.worldmap.move_object_from_position_to_position(
-                        self.characters[creature.name],
-                        self.characters[creature.name].position,
+                        creature,
+                        creature.position,
                         Position(
-                            self.characters[creature.name].position.x - 1,
-                            self.characters[creature.name].position.y,
-                            self.characters[creature.name].position.z,
+                            creature.position.x - 1,
+                            creature.position.y,
+                            creature.position.z,
                         ),
                     ):
-                        self.characters[creature.name].position = Position(
-                            self.characters[creature.name].position.x - 1,
-                            self.characters[creature.name].position.y,
-                            self.characters[creature.name].position.z,
+                        creature.position = Position(
+                            creature.position.x - 1,
+                            creature.position.y,
+                            creature.position.z,
                         )
                     creature.command_queue.remove(
                         action
                     )  # remove the action after we process it.
                 if action.args[0] == "up":
                     if self.worldmap.move_object_from_position_to_position(
-                        self.characters[creature.name],
-                        self.characters[creature.name].position,
+                        creature,
+                        creature.position,
                         Position(
-                            self.characters[creature.name].position.x,
-                            self.characters[creature.name].position.y,
-                            self.characters[creature.name].position.z + 1,
+                            creature.position.x,
+                            creature.position.y,
+                            creature.position.z + 1,
                         ),
                     ):
-                        self.characters[creature.name].position = Position(
-                            self.characters[creature.name].position.x,
-                            self.characters[creature.name].position.y,
-                            self.characters[creature.name].position.z + 1,
+                        creature.position = Position(
+                            creature.position.x,
+                            creature.position.y,
+                            creature.position.z + 1,
                         )
                     creature.command_queue.remove(
                         action
                     )  # remove the action after we process it.
                 if action.args[0] == "down":
                     if self.worldmap.move_object_from_position_to_position(
-                        self.characters[creature.name],
-                        self.characters[creature.name].position,
+                        creature,
+                        creature.position,
                         Position(
-                            self.characters[creature.name].position.x,
-                            self.characters[creature.name].position.y,
-                            self.characters[creature.name].position.z - 1,
+                            creature.position.x,
+                            creature.position.y,
+                            creature.position.z - 1,
                         ),
                     ):
-                        self.characters[creature.name].position = Position(
-                            self.characters[creature.name].position.x,
-                            self.characters[creature.name].position.y,
-                            self.characters[creature.name].position.z - 1,
+                        creature.position = Position(
+                            creature.position.x,
+                            creature.position.y,
+                            creature.position.z - 1,
                         )
                     creature.command_queue.remove(
                         action
@@ -754,68 +1085,68 @@ class Server(MastermindServerTCP):
                 actions_to_take = actions_to_take - 1  # bashing costs 1 ap.
                 if action.args[0] == "south":
                     self.worldmap.bash(
-                        self.characters[creature.name],
+                        creature,
                         Position(
-                            self.characters[creature.name].position.x,
-                            self.characters[creature.name].position.y + 1,
-                            self.characters[creature.name].position.z,
+                            creature.position.x,
+                            creature.position.y + 1,
+                            creature.position.z,
                         ),
                     )
                     self.localmaps[
                         creature.name
                     ] = self.worldmap.get_chunks_near_position(
-                        self.characters[creature.name].position
+                        creature.position
                     )
                     creature.command_queue.remove(
                         action
                     )  # remove the action after we process it.
                 if action.args[0] == "north":
                     self.worldmap.bash(
-                        self.characters[creature.name],
+                        creature,
                         Position(
-                            self.characters[creature.name].position.x,
-                            self.characters[creature.name].position.y - 1,
-                            self.characters[creature.name].position.z,
+                            creature.position.x,
+                            creature.position.y - 1,
+                            creature.position.z,
                         ),
                     )
                     self.localmaps[
                         creature.name
                     ] = self.worldmap.get_chunks_near_position(
-                        self.characters[creature.name].position
+                        creature.position
                     )
                     creature.command_queue.remove(
                         action
                     )  # remove the action after we process it.
                 if action.args[0] == "east":
                     self.worldmap.bash(
-                        self.characters[creature.name],
+                        creature,
                         Position(
-                            self.characters[creature.name].position.x + 1,
-                            self.characters[creature.name].position.y,
-                            self.characters[creature.name].position.z,
+                            creature.position.x + 1,
+                            creature.position.y,
+                            creature.position.z,
                         ),
                     )
                     self.localmaps[
                         creature.name
                     ] = self.worldmap.get_chunks_near_position(
-                        self.characters[creature.name].position
+                        creature.position
                     )
                     creature.command_queue.remove(
                         action
                     )  # remove the action after we process it.
                 if action.args[0] == "west":
                     self.worldmap.bash(
-                        self.characters[creature.name],
+                        creature,
                         Position(
-                            self.characters[creature.name].position.x - 1,
-                            self.characters[creature.name].position.y,
-                            self.characters[creature.name].position.z,
+                            creature.position.x - 1,
+                            creature.position.y,
+                            creature.position.z,
                         ),
                     )
                     self.localmaps[
                         creature.name
                     ] = self.worldmap.get_chunks_near_position(
-                        self.characters[creature.name].position
+                        creature.position
                     )
                     creature.command_queue.remove(
                         action
@@ -823,6 +1154,12 @@ class Server(MastermindServerTCP):
 
     # this function handles overseeing all creature movement, attacks, and interactions
     def compute_turn(self):
+        self.deliver_routes()
+        # remember the light levels so we only mark the tiles whose light actually changed.
+        _previous_lumens = dict()
+        for _, chunks in self.localmaps.items():
+            for chunk in chunks:
+                _previous_lumens[chunk] = [tile["lumens"] for tile in chunk.tiles]
         # init a list for all our found lights around characters.
         for _, chunks in self.localmaps.items():
             for chunk in chunks:  # characters typically get 9 chunks
@@ -869,6 +1206,12 @@ class Server(MastermindServerTCP):
                                                 int(flag.split("_")[1]) - distance
                                             )
                                         break
+        for chunk, lumens in _previous_lumens.items():
+            for index, tile in enumerate(chunk.tiles):
+                if tile["lumens"] != lumens[index]:
+                    chunk.mark_tile_changed(index)
+        # catch the flow fields monsters are chasing up with wherever their targets went last turn.
+        self.flow_fields.update()
         # we want a list that contains all the non-duplicate creatures on all localmaps around characters.
         creatures_to_process = list()
         for _, chunks in self.localmaps.items():
@@ -881,10 +1224,20 @@ class Server(MastermindServerTCP):
                         creatures_to_process.append(tile["creature"])
 
         for creature in creatures_to_process:
+            # monsters with nothing else to do go after whatever they're hunting.
+            if (
+                isinstance(creature, Monster)
+                and creature.target is not None
+                and len(creature.command_queue) == 0
+            ):
+                self.chase(creature, creature.target)
             # as long as there at least one we'll pass it on and let the function handle how many actions they can take.
             if len(creature.command_queue) > 0:
                 self.process_creature_command_queue(creature)
-        
+                self.character_store.mark_dirty(creature.name)
+
+        # routes asked for from here on search the world as this turn left it.
+        self.path_workers.refresh()
         # now that we've processed what everything wants to do we can return.
 
     def generate_and_apply_city_layout(self, city_size):
@@ -1038,10 +1391,12 @@ if __name__ == "__main__":
     citySize = int(defaultConfig.get("city_size", 1))
     log.info("City size: {}".format(citySize))
     server.generate_and_apply_city_layout(citySize)
+    if defaultConfig.get("compression_dictionary", "no") == "yes":
+        server.train_compression_dictionary()
 
     time_per_turn = int(defaultConfig.get("time_per_turn", 1))
     log.info("time_per_turn: {}".format(time_per_turn))
-    spin_delay_ms = float(defaultConfig.get("time_per_turn", 0.001))
+    spin_delay_ms = float(defaultConfig.get("spin_delay_ms", 0.001))
     log.info("spin_delay_ms: {}".format(spin_delay_ms))
     log.info("Started up Cataclysm: Looming Darkness Server.")
     while dont_break:
@@ -1049,23 +1404,40 @@ if __name__ == "__main__":
             while (
                 time.time() - last_turn_time < time_offset
             ):  # try to keep up with the time offset but never go faster than it.
+                # client commands are run while we wait, what they queue up happens next turn.
+                server.process_commands(spin_delay_ms)
                 time.sleep(spin_delay_ms)
+            # a turn that ran over never gets into the loop above, clients still get a go.
+            server.process_commands(spin_delay_ms)
+            turn_start_time = time.time()
             server.calendar.advance_time_by_x_seconds(
                 time_per_turn
             )  # a turn is one second.
             # where all queued creature actions get taken care of, as well as physics engine stuff.
             server.compute_turn()
+            # push whatever changed this turn to the characters that can see it.
+            server.push_localmap_updates()
             # if the worldmap in memory changed update it on the hard drive.
             server.worldmap.update_chunks_on_disk()
+            # save a batch of the characters that changed.
+            server.character_store.flush()
             # TODO: unload from memory chunks that have no updates required. (such as no monsters, Characters, or fires)
             last_turn_time = time.time()  # based off of system clock.
+            # how much of the turn we spent working, lets the network layer compress less when we're busy.
+            server.set_load((last_turn_time - turn_start_time) / time_offset)
         except KeyboardInterrupt:
             log.info("cleaning up before exiting.")
+            log.info("chunk cache: {}".format(server.chunk_cache.report()))
+            log.info("path cache: {}".format(server.path_cache.report()))
+            log.info("commands: {}".format(server.command_scheduler.totals.report()))
             server.accepting_disallow()
             server.disconnect_clients()
             server.disconnect()
             # if the worldmap in memory changed update it on the hard drive.
             server.worldmap.update_chunks_on_disk()
+            server.character_store.flush(0)
+            server.account_store.close()
+            server.path_workers.stop()
             dont_break = False
             log.info("done cleaning up.")
         """except Exception as e:
@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+# Where accounts and their character records are kept.
+# import an ./accounts directory into a database: python -m src.accountstore ./accounts ./accounts/accounts.db
+
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from queue import Queue
+
+_log = logging.getLogger("root")
+
+
+class AccountStore(ABC):
+    """Accounts (salt and hashed password) and the records of the characters they own.
+
+    Character records are encode_packet() strings, summaries are what character select shows.
+    """
+
+    @abstractmethod
+    def exists(self, account):
+        pass
+
+    @abstractmethod
+    def create(self, account, salt):
+        pass
+
+    @abstractmethod
+    def get_salt(self, account):
+        pass
+
+    @abstractmethod
+    def get_password(self, account):
+        """The hashed password, None if the account hasn't set one yet."""
+
+    @abstractmethod
+    def set_password(self, account, hashed_password):
+        pass
+
+    @abstractmethod
+    def accounts(self):
+        """Every account name."""
+
+    @abstractmethod
+    def character_index(self):
+        """(account, character name) for every character record."""
+
+    @abstractmethod
+    def read_character(self, account, name):
+        """The character's record, None if there isn't one."""
+
+    @abstractmethod
+    def write_characters(self, records):
+        """Saves a batch of (account, name, record, summary) at once."""
+
+    @abstractmethod
+    def read_summaries(self, account):
+        """name -> summary for the account's characters that have one."""
+
+    def close(self):
+        pass
+
+
+class FileAccountStore(AccountStore):
+    # the original layout, a directory per account:
+    # <path>/<account>/SALT, HASHED_PASSWORD, characters.summary and characters/<name>.character
+    def __init__(self, path="./accounts"):
+        self.path = path
+
+    def _account_path(self, account, *names):
+        return os.path.join(self.path, account, *names)
+
+    def _read(self, path):
+        try:
+            with open(path) as fp:
+                return fp.read()
+        except OSError:
+            return None
+
+    def _write(self, path, data):
+        # write next to it and swap so a crash can't leave half a file behind.
+        with open(path + ".tmp", "w") as fp:
+            fp.write(data)
+        os.replace(path + ".tmp", path)
+
+    def exists(self, account):
+        return os.path.isdir(self._account_path(account))
+
+    def create(self, account, salt):
+        os.makedirs(self._account_path(account, "characters"), exist_ok=True)
+        self._write(self._account_path(account, "SALT"), str(salt))
+
+    def get_salt(self, account):
+        return self._read(self._account_path(account, "SALT"))
+
+    def get_password(self, account):
+        return self._read(self._account_path(account, "HASHED_PASSWORD"))
+
+    def set_password(self, account, hashed_password):
+        self._write(self._account_path(account, "HASHED_PASSWORD"), str(hashed_password))
+
+    def accounts(self):
+        if not os.path.isdir(self.path):
+            return []
+        return [
+            account
+            for account in os.listdir(self.path)
+            if os.path.isdir(self._account_path(account))
+        ]
+
+    def character_index(self):
+        # one directory listing per account, the records themselves are read when needed.
+        for account in self.accounts():
+            _characters = self._account_path(account, "characters")
+            if not os.path.isdir(_characters):
+                continue
+            for file_data in os.listdir(_characters):
+                if file_data.endswith(".character"):
+                    yield account, file_data[: -len(".character")]
+
+    def read_character(self, account, name):
+        return self._read(self._account_path(account, "characters", name + ".character"))
+
+    def write_characters(self, records):
+        _summaries = dict()
+        for account, name, record, summary in records:
+            os.makedirs(self._account_path(account, "characters"), exist_ok=True)
+            self._write(
+                self._account_path(account, "characters", name + ".character"), record
+            )
+            if account not in _summaries:
+                _summaries[account] = self.read_summaries(account)
+            _summaries[account][name] = summary
+        # once per account however many of its characters were saved.
+        for account, summaries in _summaries.items():
+            self._write(self._account_path(account, "characters.summary"), json.dumps(summaries))
+
+    def read_summaries(self, account):
+        _summaries = self._read(self._account_path(account, "characters.summary"))
+        if _summaries is None:
+            return dict()
+        try:
+            return json.loads(_summaries)
+        except ValueError:
+            return dict()
+
+
+class SQLiteAccountStore(AccountStore):
+    # everything in one database. WAL lets readers carry on while a batch of characters is written,
+    # and each thread doing account I/O takes its own connection from a small pool.
+    SCHEMA_VERSION = 2
+
+    def __init__(self, path="./accounts/accounts.db", pool_size=4):
+        self.path = path
+        self._pool = Queue()
+        self._connections = []
+        self._lock = threading.Lock()
+        self.pool_size = pool_size
+        with self._connection() as connection:
+            self._create_schema(connection)
+
+    def _connect(self):
+        _directory = os.path.dirname(self.path)
+        if _directory:
+            os.makedirs(_directory, exist_ok=True)
+        connection = sqlite3.connect(
+            self.path, timeout=30.0, check_same_thread=False, cached_statements=64
+        )
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("PRAGMA foreign_keys=ON")
+        return connection
+
+    @contextmanager
+    def _connection(self):
+        # statements are always the same strings with ? parameters, so sqlite3's per connection
+        # statement cache keeps them prepared.
+        with self._lock:
+            if self._pool.empty() and len(self._connections) < self.pool_size:
+                self._connections.append(self._connect())
+                self._pool.put(self._connections[-1])
+        connection = self._pool.get()
+        try:
+            yield connection
+        finally:
+            self._pool.put(connection)
+
+    def _create_schema(self, connection):
+        _version = connection.execute("PRAGMA user_version").fetchone()[0]
+        with connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS accounts ("
+                "name TEXT PRIMARY KEY, salt TEXT NOT NULL, hashed_password TEXT)"
+            )
+            if _version == 1:
+                # version 1 keyed characters by name alone, so saving a name under a second
+                # account took the record away from the first.
+                connection.execute("ALTER TABLE characters RENAME TO characters_v1")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS characters ("
+                "name TEXT NOT NULL, "
+                "account TEXT NOT NULL REFERENCES accounts(name), "
+                "record TEXT NOT NULL, summary TEXT NOT NULL, "
+                "PRIMARY KEY (account, name))"
+            )
+            if _version == 1:
+                connection.execute(
+                    "INSERT INTO characters (name, account, record, summary) "
+                    "SELECT name, account, record, summary FROM characters_v1"
+                )
+                # takes version 1's characters_by_account index with it, the key covers that now.
+                connection.execute("DROP TABLE characters_v1")
+            connection.execute("PRAGMA user_version={}".format(self.SCHEMA_VERSION))
+
+    def exists(self, account):
+        with self._connection() as connection:
+            return (
+                connection.execute(
+                    "SELECT 1 FROM accounts WHERE name = ?", (account,)
+                ).fetchone()
+                is not None
+            )
+
+    def create(self, account, salt):
+        with self._connection() as connection, connection:
+            connection.execute(
+                "INSERT OR IGNORE INTO accounts (name, salt) VALUES (?, ?)",
+                (account, str(salt)),
+            )
+
+    def _get(self, account, column):
+        with self._connection() as connection:
+            _row = connection.execute(
+                "SELECT salt, hashed_password FROM accounts WHERE name = ?", (account,)
+            ).fetchone()
+        if _row is None:
+            return None
+        return _row[column]
+
+    def get_salt(self, account):
+        return self._get(account, 0)
+
+    def get_password(self, account):
+        return self._get(account, 1)
+
+    def set_password(self, account, hashed_password):
+        with self._connection() as connection, connection:
+            connection.execute(
+                "UPDATE accounts SET hashed_password = ? WHERE name = ?",
+                (str(hashed_password), account),
+            )
+
+    def accounts(self):
+        with self._connection() as connection:
+            return [row[0] for row in connection.execute("SELECT name FROM accounts")]
+
+    def character_index(self):
+        with self._connection() as connection:
+            return connection.execute("SELECT account, name FROM characters").fetchall()
+
+    def read_character(self, account, name):
+        with self._connection() as connection:
+            _row = connection.execute(
+                "SELECT record FROM characters WHERE name = ? AND account = ?",
+                (name, account),
+            ).fetchone()
+        if _row is None:
+            return None
+        return _row[0]
+
+    def write_characters(self, records):
+        # the whole batch is one transaction.
+        with self._connection() as connection, connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO characters (name, account, record, summary) "
+                "VALUES (?, ?, ?, ?)",
+                [
+                    (name, account, record, json.dumps(summary))
+                    for account, name, record, summary in records
+                ],
+            )
+
+    def read_summaries(self, account):
+        with self._connection() as connection:
+            _rows = connection.execute(
+                "SELECT name, summary FROM characters WHERE account = ?", (account,)
+            ).fetchall()
+        return dict((name, json.loads(summary)) for name, summary in _rows)
+
+    def close(self):
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
+            self._pool = Queue()
+
+
+def migrate(source, destination):
+    """Copies every account and character record from source into destination.
+
+    Accounts already in destination are left alone. Returns (accounts, characters) copied.
+    """
+    _accounts = 0
+    _characters = 0
+    _index = dict()
+    for account, name in source.character_index():
+        _index.setdefault(account, []).append(name)
+    for account in source.accounts():
+        if destination.exists(account):
+            continue
+        _salt = source.get_salt(account)
+        if _salt is None:
+            _log.warning("migrate: {} has no salt, skipped.".format(account))
+            continue
+        destination.create(account, _salt)
+        _password = source.get_password(account)
+        if _password is not None:
+            destination.set_password(account, _password)
+        _summaries = source.read_summaries(account)
+        _records = []
+        for name in _index.get(account, []):
+            _record = source.read_character(account, name)
+            if _record is None:
+                continue
+            # characters from before summaries were kept get a bare one, the rest is filled
+            # in the next time the character is saved.
+            _summary = _summaries.get(
+                name, {"name": name, "profession": None, "position": None}
+            )
+            _records.append((account, name, _record, _summary))
+        destination.write_characters(_records)
+        _accounts = _accounts + 1
+        _characters = _characters + len(_records)
+    return _accounts, _characters
+
+
+def make_account_store(config):
+    # account_store = files (the default) or sqlite, from server.cfg. accounts_path is the
+    # directory the files are kept in, and what a new database imports.
+    _path = config.get("accounts_path", "./accounts")
+    if config.get("account_store", "files") == "sqlite":
+        _store = SQLiteAccountStore(
+            config.get("account_database", os.path.join(_path, "accounts.db")),
+            int(config.get("account_database_pool", 4)),
+        )
+        if len(_store.accounts()) == 0:
+            # first start with a database, bring the existing accounts along.
+            _accounts, _characters = migrate(FileAccountStore(_path), _store)
+            if _accounts > 0:
+                _log.info(
+                    "AccountStore: imported {} accounts and {} characters into {}.".format(
+                        _accounts, _characters, _store.path
+                    )
+                )
+        return _store
+    return FileAccountStore(_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import an accounts directory into a database")
+    parser.add_argument("accounts", help="the accounts directory, e.g. ./accounts")
+    parser.add_argument("database", help="the database to create or add to")
+    args = parser.parse_args()
+
+    accounts, characters = migrate(
+        FileAccountStore(args.accounts), SQLiteAccountStore(args.database)
+    )
+    print("imported {} accounts and {} characters.".format(accounts, characters))
@@ -0,0 +1,154 @@
+import logging
+from collections import deque
+
+from src.serializer import SCHEMA_MARKER, encode_packet, decode_packet
+
+_log = logging.getLogger("root")
+
+
+class CharacterStore:
+    # every character the server has loaded, by name, and which account owns which characters.
+    # characters that changed are marked dirty and written out a few at a time by flush().
+    # records are encode_packet() strings kept in the account store along with a summary of each
+    # character, what character select shows, so listing an account's characters is one small read.
+    # only used from the main thread.
+    def __init__(self, accounts, batch_size=32):
+        self.store = accounts  # an AccountStore
+        self.batch_size = batch_size  # most characters written by one flush().
+        self.characters = dict()  # name -> Character
+        self.accounts = dict()  # account -> set of character names
+        self.owners = dict()  # character name -> account
+        self._dirty = deque()  # names in the order they were first marked dirty.
+        self._dirty_set = set()
+        self._summaries = dict()  # account -> {name: summary}, loaded the first time it's asked for.
+        self.writes = 0
+        self.load_index()
+
+    def __contains__(self, name):
+        return name in self.owners
+
+    def load_index(self):
+        # read once at startup, the records themselves are read when needed.
+        self.accounts = dict()
+        self.owners = dict()
+        for account, name in self.store.character_index():
+            if name in self.owners:
+                # the store keeps both, but characters are looked up by name so only one can play.
+                _log.warning(
+                    "CharacterStore: {} is in accounts {} and {}, using {}.".format(
+                        name, self.owners[name], account, self.owners[name]
+                    )
+                )
+                continue
+            self.index(account, name)
+        _log.info(
+            "CharacterStore: indexed {} characters in {} accounts.".format(
+                len(self.owners), len(self.accounts)
+            )
+        )
+
+    def index(self, account, name):
+        self.accounts.setdefault(account, set()).add(name)
+        self.owners[name] = account
+
+    @staticmethod
+    def summary(character):
+        _position = getattr(character, "position", None)
+        return {
+            "name": character.name,
+            "profession": str(character.profession),
+            "position": None
+            if _position is None
+            else [_position.x, _position.y, _position.z],
+        }
+
+    def account_summaries(self, account, get=None):
+        # name -> summary for each of account's characters. get(name) is used to fill in
+        # characters the store has no summary for, self.get if None.
+        if account in self._summaries:
+            return self._summaries[account]
+        _summaries = self.store.read_summaries(account)
+        for name in self.names(account):
+            if name in _summaries:
+                continue
+            # characters from before summaries were kept, saved again so they have one next time.
+            _character = (get or self.get)(name)
+            if _character is not None:
+                _summaries[name] = self.summary(_character)
+                self.mark_dirty(name)
+        self._summaries[account] = _summaries
+        return _summaries
+
+    def summaries(self, account, get=None):
+        _summaries = self.account_summaries(account, get)
+        return [_summaries[name] for name in sorted(_summaries)]
+
+    def add(self, account, character):
+        # a new character, written out on the next flush().
+        self.index(account, character.name)
+        self.characters[character.name] = character
+        self.mark_dirty(character.name)
+        self.account_summaries(account)[character.name] = self.summary(character)
+
+    def get(self, name):
+        # the live character, loaded from its record if it isn't in memory yet. None if we can't.
+        if name in self.characters:
+            return self.characters[name]
+        _character = self.load(name)
+        if _character is not None:
+            self.characters[name] = _character
+        return _character
+
+    def put(self, name, character):
+        # adopt a character found some other way, like in the world, and save it as a record.
+        self.characters[name] = character
+        self.mark_dirty(name)
+
+    def load(self, name):
+        _account = self.owners.get(name)
+        if _account is None:
+            return None
+        _record = self.store.read_character(_account, name)
+        if _record is None or not _record.startswith('["' + SCHEMA_MARKER + '"'):
+            # records written by the old handle_new_character can't be turned back into a Character.
+            return None
+        return decode_packet(_record)
+
+    def names(self, account):
+        return sorted(self.accounts.get(account, ()))
+
+    def mark_dirty(self, name):
+        if name in self._dirty_set or name not in self.characters:
+            return
+        self._dirty_set.add(name)
+        self._dirty.append(name)
+
+    def dirty(self):
+        return len(self._dirty)
+
+    def flush(self, batch_size=None):
+        # writes out up to batch_size dirty characters, None for the store's batch size, 0 for all of them.
+        if batch_size is None:
+            batch_size = self.batch_size
+        _records = list()
+        while self._dirty and (batch_size == 0 or len(_records) < batch_size):
+            _name = self._dirty.popleft()
+            self._dirty_set.discard(_name)
+            _account = self.owners[_name]
+            _summary = self.summary(self.characters[_name])
+            _records.append(
+                (_account, _name, encode_packet(self.characters[_name]), _summary)
+            )
+        if not _records:
+            return 0
+        try:
+            self.store.write_characters(_records)
+        except Exception as e:
+            _log.error("CharacterStore: couldn't save {} characters: {}".format(len(_records), e))
+            for _, _name, _, _ in _records:  # try again next time.
+                self.mark_dirty(_name)
+            return 0
+        for _account, _name, _, _summary in _records:
+            self.account_summaries(_account)[_name] = _summary
+        self.writes = self.writes + len(_records)
+        return len(_records)
@@ -0,0 +1,67 @@
+import threading
+import zlib
+from collections import OrderedDict
+
+from src.serializer import encode_packet
+
+# encoded chunks compress very well and are sent as-is, so use a decent level once.
+CHUNK_COMPRESSION_LEVEL = 6
+
+
+def encode_chunk(chunk, compressed):
+    # compressed chunks are zlib'd encode_packet() bytes for clients that take binary payloads,
+    # otherwise the plain encoded string.
+    _payload = encode_packet(chunk)
+    if compressed:
+        _payload = zlib.compress(_payload.encode("utf-8"), CHUNK_COMPRESSION_LEVEL)
+    return _payload
+
+
+class ChunkCache:
+    # encoded chunks shared by every client that can see them.
+    # one entry per (chunk, encoding, visible tiles) holding the latest version, least recently
+    # used dropped first. characters standing together see the same tiles of a chunk so partly
+    # visible chunks are shared too.
+    def __init__(self, max_size=16777216):
+        self.max_size = max_size  # bytes of encoded chunks to hold on to.
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # (chunk key, compressed, visible) -> (version, payload)
+        self._lock = threading.Lock()  # pushes run on the main thread, requests on connection threads.
+
+    def get(self, chunk, compressed, visible=None):
+        # see encode_chunk(). visible is a mask of the tiles to send, see Chunk.masked(), None for
+        # all of them.
+        if visible == (1 << len(chunk.tiles)) - 1:
+            visible = None
+        _key = (chunk.get_key(), compressed, visible)
+        _version = chunk.version
+        with self._lock:
+            _entry = self._entries.get(_key)
+            if _entry is not None and _entry[0] == _version:
+                self._entries.move_to_end(_key)
+                self.hits = self.hits + 1
+                return _entry[1]
+            self.misses = self.misses + 1
+
+        # encode outside the lock, two threads encoding the same chunk at once is harmless.
+        _payload = encode_chunk(chunk if visible is None else chunk.masked(visible), compressed)
+
+        with self._lock:
+            _old = self._entries.pop(_key, None)
+            if _old is not None:
+                self.size = self.size - len(_old[1])
+            self._entries[_key] = (_version, _payload)
+            self.size = self.size + len(_payload)
+            while self.size > self.max_size and len(self._entries) > 1:
+                _, (_, _evicted) = self._entries.popitem(last=False)
+                self.size = self.size - len(_evicted)
+                self.evictions = self.evictions + 1
+        return _payload
+
+    def report(self):
+        return "{} chunks, {} bytes cached, {} hits, {} misses, {} evictions".format(
+            len(self._entries), self.size, self.hits, self.misses, self.evictions
+        )
@@ -1,10 +1,25 @@
 class Command(dict):
     """A client to server command"""
 
-    __slots__ = 'ident', 'command', 'args'
+    __slots__ = 'ident', 'command', 'args', 'request_id'
 
-    def __init__(self, ident, command, args):
+    def __init__(self, ident, command, args, request_id=None):
         super().__init__()
         self['ident'] = ident
         self['command'] = command
         self['args'] = args
+        # set by clients that want their replies tagged so they can have several requests in flight.
+        if request_id is not None:
+            self['request_id'] = request_id
+
+
+class Reply(dict):
+    """A server to client reply to a command that had a request_id"""
+
+    __slots__ = 'request_id', 'command', 'reply'
+
+    def __init__(self, request_id, command, reply):
+        super().__init__()
+        self['request_id'] = request_id
+        self['command'] = command
+        self['reply'] = reply
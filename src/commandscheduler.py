@@ -0,0 +1,209 @@
+import logging
+import threading
+import time
+from collections import deque
+
+_log = logging.getLogger("root")
+
+# what to do with a command whose class is out of tokens.
+COMMAND_DROP = 0  # throw it away, the client will ask again.
+COMMAND_DEFER = 1  # leave it queued until the bucket refills.
+
+# command -> class. commands that aren't listed share the "default" class.
+COMMAND_CLASSES = {
+    "login": "account",
+    "hashed_password": "account",
+    "choose_character": "account",
+    "completed_character": "account",
+    "request_localmap_update": "localmap",
+    "subscribe_localmap": "localmap",
+    "calculated_move": "pathfinding",
+    "move": "action",
+    "bash": "action",
+    "create_blueprint": "action",
+    "move_item": "action",
+    "move_item_to_character_storage": "action",
+    "ping": "ping",
+}
+
+# class -> (tokens per second, bucket size, policy) for each connection.
+COMMAND_LIMITS = {
+    "account": (1.0, 5, COMMAND_DROP),
+    "localmap": (2.0, 4, COMMAND_DROP),
+    "pathfinding": (1.0, 2, COMMAND_DEFER),
+    "action": (10.0, 20, COMMAND_DEFER),
+    "ping": (1.0, 2, COMMAND_DROP),
+    "default": (5.0, 10, COMMAND_DROP),
+}
+
+
+class TokenBucket:
+    def __init__(self, rate, size, now=None):
+        self.rate = rate
+        self.size = size
+        self.tokens = float(size)
+        self.last = time.time() if now is None else now
+
+    def refill(self, now):
+        self.tokens = min(self.size, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def take(self, now):
+        self.refill(now)
+        if self.tokens >= 1.0:
+            self.tokens = self.tokens - 1.0
+            return True
+        return False
+
+
+class CommandStats:
+    def __init__(self):
+        self.received = 0
+        self.executed = 0
+        self.dropped = 0  # over the rate limit.
+        self.deferred = 0  # commands that had to wait for tokens, counted once each.
+        self.overflowed = 0  # arrived while the connection's queue was full.
+        self.failed = 0  # raised in the handler, counted in executed as well.
+
+    def report(self):
+        return (
+            "{} received, {} executed, {} dropped, {} deferred, {} overflowed, "
+            "{} failed".format(
+                self.received,
+                self.executed,
+                self.dropped,
+                self.deferred,
+                self.overflowed,
+                self.failed,
+            )
+        )
+
+
+class _ConnectionQueue:
+    def __init__(self, limits, now):
+        self.commands = deque()
+        self.buckets = dict(
+            (name, TokenBucket(rate, size, now))
+            for name, (rate, size, _) in limits.items()
+        )
+        self.stats = CommandStats()
+        self.head_deferred = False  # the command at the front was already counted as deferred.
+
+
+class CommandScheduler:
+    # commands arrive on connection threads and are run on the main thread between turns.
+    # every connection gets its own queue and token bucket per command class, and the queues are
+    # drained round robin one command at a time so a flood from one client can't starve the rest.
+    def __init__(self, max_queued=64, classes=COMMAND_CLASSES, limits=COMMAND_LIMITS):
+        self.max_queued = max_queued  # per connection, anything past this is thrown away.
+        self.classes = classes
+        self.limits = limits
+        self.totals = CommandStats()
+        self._queues = dict()  # connection -> _ConnectionQueue
+        self._order = deque()  # connections in the order they get their next turn.
+        self._lock = threading.Lock()
+
+    def command_class(self, command):
+        _class = self.classes.get(command, "default")
+        if _class not in self.limits:
+            return "default"
+        return _class
+
+    def submit(self, connection, command):
+        # returns False if the command was thrown away because the connection's queue is full.
+        with self._lock:
+            _queue = self._queues.get(connection)
+            if _queue is None:
+                _queue = _ConnectionQueue(self.limits, time.time())
+                self._queues[connection] = _queue
+                self._order.append(connection)
+            _queue.stats.received = _queue.stats.received + 1
+            self.totals.received = self.totals.received + 1
+            if len(_queue.commands) >= self.max_queued:
+                _queue.stats.overflowed = _queue.stats.overflowed + 1
+                self.totals.overflowed = self.totals.overflowed + 1
+                return False
+            _queue.commands.append(command)
+            return True
+
+    def remove(self, connection):
+        # forget a connection, returns its stats or None if it never sent anything.
+        with self._lock:
+            _queue = self._queues.pop(connection, None)
+            if _queue is None:
+                return None
+            self._order.remove(connection)
+            return _queue.stats
+
+    def stats(self, connection):
+        _queue = self._queues.get(connection)
+        if _queue is None:
+            return None
+        return _queue.stats
+
+    def queued(self):
+        with self._lock:
+            return sum(len(_queue.commands) for _queue in self._queues.values())
+
+    def _next(self, connection, now):
+        # pops the command at the front of connection's queue if its bucket allows it.
+        _queue = self._queues[connection]
+        while _queue.commands:
+            _command = _queue.commands[0]
+            _class = self.command_class(_command["command"])
+            if _queue.buckets[_class].take(now):
+                _queue.commands.popleft()
+                _queue.head_deferred = False
+                _queue.stats.executed = _queue.stats.executed + 1
+                self.totals.executed = self.totals.executed + 1
+                return _command
+            if self.limits[_class][2] == COMMAND_DEFER:
+                # keep it, and everything behind it so the client's commands stay in order.
+                if not _queue.head_deferred:
+                    _queue.head_deferred = True
+                    _queue.stats.deferred = _queue.stats.deferred + 1
+                    self.totals.deferred = self.totals.deferred + 1
+                return None
+            _queue.commands.popleft()
+            _queue.stats.dropped = _queue.stats.dropped + 1
+            self.totals.dropped = self.totals.dropped + 1
+        return None
+
+    def _failed(self, connection):
+        with self._lock:
+            _queue = self._queues.get(connection)
+            if _queue is not None:
+                _queue.stats.failed = _queue.stats.failed + 1
+            self.totals.failed = self.totals.failed + 1
+
+    def drain(self, handler, budget=None):
+        # runs handler(connection, command) for queued commands, one per connection per round,
+        # until nothing is runnable or budget seconds have passed. returns how many were run.
+        _start = time.time()
+        _ran = 0
+        while True:
+            _batch = list()
+            with self._lock:
+                _now = time.time()
+                for _ in range(len(self._order)):
+                    _connection = self._order[0]
+                    self._order.rotate(-1)
+                    _command = self._next(_connection, _now)
+                    if _command is not None:
+                        _batch.append((_connection, _command))
+            if not _batch:
+                return _ran
+            for _connection, _command in _batch:
+                try:
+                    handler(_connection, _command)
+                except Exception:
+                    # this runs on the main loop, a bad command mustn't take the server down with it.
+                    _log.exception(
+                        "CommandScheduler: {} from {} failed, dropped it.".format(
+                            _command["command"], getattr(_connection, "address", _connection)
+                        )
+                    )
+                    self._failed(_connection)
+                _ran = _ran + 1
+            if budget is not None and time.time() - _start >= budget:
+                return _ran
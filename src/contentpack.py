@@ -0,0 +1,157 @@
+import hashlib
+import logging
+import os
+import pickle
+import sys
+
+_log = logging.getLogger("root")
+
+PACK_PATH = "./data/content.pack"
+_MAGIC = b"CLDPACK1"
+# part of the digest, bump it when what's pickled into the pack changes in a way the compilers'
+# source doesn't show, like a class their dicts hold being changed somewhere else.
+PACK_VERSION = 1
+
+# what each manager reads, by the name of the dict it fills. a directory is every .json under it.
+SOURCES = {
+    "FURNITURE_TYPES": "./data/json/furniture.json",
+    "ITEM_TYPES": "./data/json/items/",
+    "MONSTER_TYPES": "./data/json/monsters/",
+    "PROFESSIONS": "./data/json/professions/",
+    "RECIPE_TYPES": "./data/json/recipes/",
+    "TILE_TYPES": "./data/json/terrain.json",
+}
+
+_slices = None  # name -> pickled dict, once the pack has been read or built.
+
+
+def _compilers():
+    # the managers import this module, so theirs are imported when they're needed.
+    from src.furniture import compile_furniture_types
+    from src.item import compile_item_types
+    from src.monster import compile_monster_types
+    from src.profession import compile_professions
+    from src.recipe import compile_recipe_types
+    from src.tilemanager import compile_tile_types
+
+    return {
+        "FURNITURE_TYPES": compile_furniture_types,
+        "ITEM_TYPES": compile_item_types,
+        "MONSTER_TYPES": compile_monster_types,
+        "PROFESSIONS": compile_professions,
+        "RECIPE_TYPES": compile_recipe_types,
+        "TILE_TYPES": compile_tile_types,
+    }
+
+
+def json_files(path):
+    # the .json files under path in a fixed order, or path itself if it's a file.
+    if not os.path.isdir(path):
+        return [path]
+    _files = []
+    for root, _, files in os.walk(path):
+        for file_data in files:
+            if file_data.endswith(".json"):
+                _files.append(root + "/" + file_data)
+    return sorted(_files)
+
+
+def compiler_files():
+    # the modules that turn the json into the pack, this one included.
+    _files = set([os.path.abspath(__file__)])
+    for compile_types in _compilers().values():
+        _files.add(os.path.abspath(sys.modules[compile_types.__module__].__file__))
+    return sorted(_files)
+
+
+def _hash_file(_hash, name, path):
+    with open(path, "rb") as data_file:
+        _contents = data_file.read()
+    _hash.update(name.encode("utf-8"))
+    _hash.update(len(_contents).to_bytes(8, "little"))
+    _hash.update(_contents)
+
+
+def source_digest():
+    # sha256 over PACK_VERSION and the name and contents of every json file and compiler module,
+    # the pack is rebuilt when any of them moves.
+    _hash = hashlib.sha256()
+    _hash.update(PACK_VERSION.to_bytes(8, "little"))
+    for name in sorted(SOURCES):
+        for path in json_files(SOURCES[name]):
+            _hash_file(_hash, path, path)
+    for path in compiler_files():
+        # by file name, where the checkout is shouldn't matter.
+        _hash_file(_hash, os.path.basename(path), path)
+    return _hash.hexdigest()
+
+
+def compile_pack(path=PACK_PATH, digest=None):
+    # loads every manager's json the slow way and writes it to path. returns the slices.
+    if digest is None:
+        digest = source_digest()
+    _slices = dict()
+    for name, compile_types in sorted(_compilers().items()):
+        _types = compile_types(SOURCES[name])
+        if not isinstance(_types, dict) or not _types:
+            raise ValueError("content pack: nothing compiled for " + name)
+        for ident, value in _types.items():
+            if not isinstance(value, dict):
+                raise ValueError("content pack: {} {} isn't a dict.".format(name, ident))
+        _slices[name] = pickle.dumps(_types, pickle.HIGHEST_PROTOCOL)
+    _payload = pickle.dumps({"digest": digest, "slices": _slices}, pickle.HIGHEST_PROTOCOL)
+
+    # written next to where it goes and moved over, a process reading it never sees half a pack.
+    _temporary = path + ".tmp"
+    try:
+        with open(_temporary, "wb") as pack_file:
+            pack_file.write(_MAGIC + hashlib.sha256(_payload).digest() + _payload)
+        os.replace(_temporary, path)
+    except OSError:
+        _log.exception("content pack: couldn't write " + path + ", it'll be compiled again.")
+    return _slices
+
+
+def read_pack(path=PACK_PATH, digest=None):
+    # the slices in the pack at path, None if it's missing, damaged or from other json.
+    try:
+        with open(path, "rb") as pack_file:
+            _data = pack_file.read()
+    except OSError:
+        return None
+    _header = len(_MAGIC) + 32
+    if _data[: len(_MAGIC)] != _MAGIC or len(_data) < _header:
+        return None
+    _payload = _data[_header:]
+    if hashlib.sha256(_payload).digest() != _data[len(_MAGIC) : _header]:
+        _log.warning("content pack: " + path + " is damaged, compiling it again.")
+        return None
+    try:
+        _pack = pickle.loads(_payload)
+    except Exception:
+        return None
+    if digest is None:
+        digest = source_digest()
+    if _pack.get("digest") != digest or set(_pack.get("slices", ())) != set(SOURCES):
+        return None
+    return _pack["slices"]
+
+
+def load(name):
+    # the dict name fills from the pack, compiled first if the json has changed since. each call
+    # unpickles its own copy so managers can change theirs.
+    global _slices
+    if _slices is None:
+        _digest = source_digest()
+        _slices = read_pack(PACK_PATH, _digest)
+        if _slices is None:
+            _log.info("content pack: compiling " + PACK_PATH)
+            _slices = compile_pack(PACK_PATH, _digest)
+    return pickle.loads(_slices[name])
+
+
+if __name__ == "__main__":
+    # python -m src.contentpack builds the pack ahead of time.
+    _slices = compile_pack()
+    for name in sorted(_slices):
+        print("{}: {} entries".format(name, len(pickle.loads(_slices[name]))))
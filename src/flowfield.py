@@ -0,0 +1,183 @@
+import heapq
+
+from src.pathfinding import DIAGONAL
+from src.position import Position
+
+
+class FlowField:
+    # a dijkstra map, what it costs to get from each tile around target to target. anything
+    # chasing target steps to whichever neighbouring tile is cheapest, there's no search per chaser.
+    # covers radius tiles either way of where it was built. when target moves one tile it's
+    # updated in place, further than that, out towards the edge, or when terrain in it changes
+    # it's built again.
+    def __init__(self, pathfinder, target, radius=26):
+        self.pathfinder = pathfinder
+        self.radius = radius
+        self.target = None  # (x, y, z)
+        self.center = None
+        # (x, y) -> cost to target, less offset. moving target raises every cost by the same
+        # amount, see move_target().
+        self.distances = dict()
+        self.offset = 0
+        self._signature = None  # terrain_version of each chunk the field covers.
+        self.builds = 0
+        self.updates = 0
+        self.build(target)
+
+    def _inside(self, x, y):
+        return (
+            abs(x - self.center[0]) <= self.radius and abs(y - self.center[1]) <= self.radius
+        )
+
+    def _chunks_signature(self):
+        _size = self.pathfinder.worldmap.chunk_size
+        _worldmap = self.pathfinder.worldmap.WORLDMAP
+        _signature = []
+        for cx in range(
+            (self.center[0] - self.radius) // _size, (self.center[0] + self.radius) // _size + 1
+        ):
+            for cy in range(
+                (self.center[1] - self.radius) // _size,
+                (self.center[1] + self.radius) // _size + 1,
+            ):
+                _chunk = _worldmap.get(cx, {}).get(cy, {}).get(self.center[2])
+                _signature.append(None if _chunk is None else (_chunk, _chunk.terrain_version))
+        return tuple(_signature)
+
+    def build(self, target):
+        self.target = (target.x, target.y, target.z)
+        self.center = self.target
+        self.distances = {(target.x, target.y): 0}
+        self.offset = 0
+        self._signature = self._chunks_signature()
+        self._spread([(0, (target.x, target.y))])
+        self.builds = self.builds + 1
+
+    def _spread(self, _open):
+        # dijkstra outwards from whatever is in _open, only ever lowering distances. starting from
+        # a field whose distances are all too high or right that gives the right ones.
+        _z = self.target[2]
+        _distances = self.distances
+        while _open:
+            _distance, node = heapq.heappop(_open)
+            if _distance > _distances.get(node, _distance):
+                continue
+            _into = self.pathfinder.cost_at(node[0], node[1], _z, False)
+            if _into is None:
+                continue
+            for _next, _ in self.pathfinder.neighbours_of(node, _z):
+                if not self._inside(*_next):
+                    continue
+                _cost = _into
+                if _next[0] != node[0] and _next[1] != node[1]:
+                    _cost = _cost * DIAGONAL
+                _next_distance = _distance + _cost
+                if _next_distance < _distances.get(_next, _next_distance + 1):
+                    _distances[_next] = _next_distance
+                    heapq.heappush(_open, (_next_distance, _next))
+
+    def move_target(self, target):
+        # call with target's position each turn.
+        _target = (target.x, target.y, target.z)
+        if _target == self.target and self._signature == self._chunks_signature():
+            return
+        _dx = abs(_target[0] - self.target[0])
+        _dy = abs(_target[1] - self.target[1])
+        if (
+            _target[2] != self.target[2]
+            or max(_dx, _dy) != 1
+            or (_dx and _dy and not self.pathfinder.diagonal)
+            or (_target[0], _target[1]) not in self.distances
+            or abs(_target[0] - self.center[0]) > self.radius // 2
+            or abs(_target[1] - self.center[1]) > self.radius // 2
+            or self._signature != self._chunks_signature()
+        ):
+            self.build(target)
+            return
+        # anywhere can get to the new target through the old one, so adding the cost of that
+        # last step makes every distance too high or right. spreading from the new target
+        # then lowers only the ones that have a shorter way, mostly the side target moved to.
+        _step = self.pathfinder.cost_at(_target[0], _target[1], _target[2], False)
+        if _dx and _dy:
+            _step = _step * DIAGONAL
+        self.offset = self.offset + _step
+        self.target = _target
+        self.distances[(_target[0], _target[1])] = -self.offset
+        self._spread([(-self.offset, (_target[0], _target[1]))])
+        self.updates = self.updates + 1
+
+    def distance(self, position):
+        # cost to target from position, None if it's outside the field or can't get there.
+        if position.z != self.target[2]:
+            return None
+        _distance = self.distances.get((position.x, position.y))
+        if _distance is None:
+            return None
+        return _distance + self.offset
+
+    def next_step(self, position):
+        # the neighbouring Position that's closest to target, None if standing still is best.
+        if position.z != self.target[2]:
+            return None
+        _here = self.distances.get((position.x, position.y))
+        if _here is None:
+            return None
+        _best = None
+        for _next, _ in self.pathfinder.neighbours_of((position.x, position.y), position.z):
+            _distance = self.distances.get(_next)
+            if _distance is not None and _distance < _here:
+                _here = _distance
+                _best = _next
+        if _best is None:
+            return None
+        return Position(_best[0], _best[1], position.z)
+
+
+class FlowFields:
+    # one FlowField per thing being chased, shared by everything chasing it. targets are
+    # creatures, followed wherever they go, or Positions like the source of a noise.
+    # update() once a turn, fields nobody asked for in keep_turns turns are dropped.
+    def __init__(self, pathfinder, radius=26, keep_turns=10):
+        self.pathfinder = pathfinder
+        self.radius = radius
+        self.keep_turns = keep_turns
+        self.fields = dict()  # key -> [target, FlowField, turns since it was last asked for]
+
+    def _key(self, target):
+        if isinstance(target, Position):
+            return (target.x, target.y, target.z)
+        return id(target)
+
+    def _position(self, target):
+        if isinstance(target, Position):
+            return target
+        return getattr(target, "position", None)
+
+    def field(self, target):
+        _key = self._key(target)
+        _entry = self.fields.get(_key)
+        if _entry is None:
+            _position = self._position(target)
+            if _position is None:
+                return None
+            _entry = [target, FlowField(self.pathfinder, _position, self.radius), 0]
+            self.fields[_key] = _entry
+        _entry[2] = 0
+        return _entry[1]
+
+    def next_step(self, target, position):
+        # where something at position chasing target should step next, None to stay put.
+        _field = self.field(target)
+        if _field is None:
+            return None
+        return _field.next_step(position)
+
+    def update(self):
+        for _key, _entry in list(self.fields.items()):
+            _target, _field, _idle = _entry
+            _position = self._position(_target)
+            if _idle >= self.keep_turns or _position is None:
+                del self.fields[_key]
+                continue
+            _entry[2] = _idle + 1
+            _field.move_target(_position)
@@ -0,0 +1,117 @@
+# (xx, xy, yx, yy) for each of the eight octants, see shadowcast().
+OCTANTS = (
+    (1, 0, 0, 1),
+    (0, 1, 1, 0),
+    (0, -1, 1, 0),
+    (-1, 0, 0, 1),
+    (-1, 0, 0, -1),
+    (0, -1, -1, 0),
+    (0, 1, -1, 0),
+    (1, 0, 0, -1),
+)
+
+
+def shadowcast(opaque, x, y, radius):
+    # recursive shadowcasting. the set of (x, y) that can be seen from x, y out to radius,
+    # opaque(x, y) is True for anything that can't be seen through. opaque tiles that are seen
+    # are in the set, what's behind them isn't.
+    _visible = {(x, y)}
+    for xx, xy, yx, yy in OCTANTS:
+        _cast(opaque, _visible, x, y, radius, 1, 1.0, 0.0, xx, xy, yx, yy)
+    return _visible
+
+
+def _cast(opaque, visible, x, y, radius, row, start, end, xx, xy, yx, yy):
+    # scans one octant a row at a time from row out, between the slopes start and end. an opaque
+    # tile narrows what the next rows can see, a run of them starts a scan past its edge.
+    if start < end:
+        return
+    _radius_squared = radius * radius + radius
+    _new_start = start
+    for distance in range(row, radius + 1):
+        _blocked = False
+        dy = -distance
+        for dx in range(-distance, 1):
+            _left = (dx - 0.5) / (dy + 0.5)
+            _right = (dx + 0.5) / (dy - 0.5)
+            if start < _right:
+                continue
+            if end > _left:
+                break
+            _x = x + dx * xx + dy * xy
+            _y = y + dx * yx + dy * yy
+            if dx * dx + dy * dy <= _radius_squared:
+                visible.add((_x, _y))
+            if _blocked:
+                if opaque(_x, _y):
+                    _new_start = _right
+                    continue
+                _blocked = False
+                start = _new_start
+            elif opaque(_x, _y) and distance < radius:
+                _blocked = True
+                _cast(opaque, visible, x, y, radius, distance + 1, start, _left, xx, xy, yx, yy)
+                _new_start = _right
+        if _blocked:
+            return
+
+
+class FieldsOfView:
+    # what each character can see, by the chunks' opaque bitmaps. kept per character and only
+    # cast again when they move or the terrain_version of a chunk in range moves.
+    def __init__(self, worldmap, radius=13):
+        self.worldmap = worldmap
+        self.radius = radius
+        self._fields = dict()  # name -> (position, signature, {chunk key: visible mask})
+        self.casts = 0
+        self.reused = 0
+
+    def _chunks(self, position):
+        # {(cx, cy): chunk} for the chunks radius reaches from position.
+        _size = self.worldmap.chunk_size
+        _chunks = dict()
+        for cx in range(
+            (position.x - self.radius) // _size, (position.x + self.radius) // _size + 1
+        ):
+            for cy in range(
+                (position.y - self.radius) // _size, (position.y + self.radius) // _size + 1
+            ):
+                _chunk = self.worldmap.WORLDMAP.get(cx, {}).get(cy, {}).get(position.z)
+                if _chunk is not None:
+                    _chunks[(cx, cy)] = _chunk
+        return _chunks
+
+    def masks(self, name, position):
+        # {chunk key: mask} with a bit set for each tile name can see from position. chunks they
+        # can't see any of aren't in it.
+        _chunks = self._chunks(position)
+        _signature = tuple(
+            (key, chunk.terrain_version) for key, chunk in sorted(_chunks.items())
+        )
+        _field = self._fields.get(name)
+        if _field is not None and _field[0] == position and _field[1] == _signature:
+            self.reused = self.reused + 1
+            return _field[2]
+
+        _size = self.worldmap.chunk_size
+
+        def opaque(x, y):
+            # outside the world can't be seen through.
+            _chunk = _chunks.get((x // _size, y // _size))
+            if _chunk is None:
+                return True
+            return _chunk.opaque >> ((x % _size) * _size + y % _size) & 1 == 1
+
+        _masks = dict()
+        for x, y in shadowcast(opaque, position.x, position.y, self.radius):
+            _chunk = _chunks.get((x // _size, y // _size))
+            if _chunk is None:
+                continue
+            _key = _chunk.get_key()
+            _masks[_key] = _masks.get(_key, 0) | 1 << ((x % _size) * _size + y % _size)
+        self._fields[name] = (position, _signature, _masks)
+        self.casts = self.casts + 1
+        return _masks
+
+    def forget(self, name):
+        self._fields.pop(name, None)
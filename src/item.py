@@ -4,6 +4,9 @@ import pprint
 import os
 import sys
 
+from src import contentpack
+from src.contentpack import json_files
+
 class Item:
     def __init__(self, ident, reference):
         self.ident = ident
@@ -50,26 +53,29 @@ class Container(Item): # containers are types of Items and can do everything an
 
 
 
+def compile_item_types(path):
+    # the item json under path, every value as a string or a list of them.
+    ITEM_TYPES = defaultdict(dict)
+    for file_data in json_files(path):
+        with open(file_data, encoding='utf-8') as data_file:
+            data = json.load(data_file)
+        for item in data:
+            try:
+                for key, value in item.items():
+                    if(isinstance(value, list)):
+                        ITEM_TYPES[item['ident']][key] = []
+                        for add_value in value:
+                            ITEM_TYPES[item['ident']][key].append(str(add_value))
+                    else:
+                        ITEM_TYPES[item['ident']][key] = str(value)
+            except Exception:
+                print()
+                print('!! couldn\'t parse: ' + str(item) + ' -- likely missing ident.')
+                print()
+                sys.exit()
+    return ITEM_TYPES
+
 class ItemManager:
     def __init__(self):
-        self.ITEM_TYPES = defaultdict(dict)
-        for root, dirs, files in os.walk('./data/json/items/'):
-            for file_data in files:
-                if file_data.endswith('.json'):
-                    with open(root+'/'+file_data, encoding='utf-8') as data_file:
-                        data = json.load(data_file)
-                    for item in data:
-                        try:
-                            for key, value in item.items():
-                                if(isinstance(value, list)):
-                                    self.ITEM_TYPES[item['ident']][key] = []
-                                    for add_value in value:
-                                        self.ITEM_TYPES[item['ident']][key].append(str(add_value))
-                                else:
-                                    self.ITEM_TYPES[item['ident']][key] = str(value)
-                        except Exception:
-                            print()
-                            print('!! couldn\'t parse: ' + str(item) + ' -- likely missing ident.')
-                            print()
-                            sys.exit()
+        self.ITEM_TYPES = contentpack.load('ITEM_TYPES')
         print('total ITEM_TYPES loaded: ' + str(len(self.ITEM_TYPES)))
@@ -2,6 +2,8 @@ from collections import defaultdict
 import json
 import os
 import sys
+from . import contentpack
+from .contentpack import json_files
 from .creature import Creature
 
 class Monster(Creature):
@@ -24,27 +26,31 @@ class Monster(Creature):
         self.last_updated = 0
 
         self.speed = 1
+        self.target = None  # a creature or Position it's after, see Server.chase().
+
+def compile_monster_types(path):
+    # the monster json under path, every value as a string or a list of them.
+    MONSTER_TYPES = defaultdict(dict)
+    for file_data in json_files(path):
+        with open(file_data, encoding='utf-8') as data_file: # load tile config so we know what tile foes with what ident
+            data = json.load(data_file)
+        for item in data:
+            try:
+                for key, value in item.items():
+                    if(isinstance(value, list)):
+                        MONSTER_TYPES[item['ident']][key] = []
+                        for add_value in value:
+                            MONSTER_TYPES[item['ident']][key].append(str(add_value))
+                    else:
+                        MONSTER_TYPES[item['ident']][key] = str(value)
+            except Exception:
+                print()
+                print('!! couldn\'t parse: ' + str(item) + ' -- likely missing ident.')
+                print()
+                sys.exit()
+    return MONSTER_TYPES
 
 class MonsterManager:
     def __init__(self):
-        self.MONSTER_TYPES = defaultdict(dict)
-        for root, dirs, files in os.walk('./data/json/monsters/'):
-            for file_data in files:
-                if file_data.endswith('.json'):
-                    with open(root+'/'+file_data, encoding='utf-8') as data_file: # load tile config so we know what tile foes with what ident
-                        data = json.load(data_file)
-                    for item in data:
-                        try:
-                            for key, value in item.items():
-                                if(isinstance(value, list)):
-                                    self.MONSTER_TYPES[item['ident']][key] = []
-                                    for add_value in value:
-                                        self.MONSTER_TYPES[item['ident']][key].append(str(add_value))
-                                else:
-                                    self.MONSTER_TYPES[item['ident']][key] = str(value)
-                        except Exception:
-                            print()
-                            print('!! couldn\'t parse: ' + str(item) + ' -- likely missing ident.')
-                            print()
-                            sys.exit()
+        self.MONSTER_TYPES = contentpack.load('MONSTER_TYPES')
         print('total MONSTER_TYPES loaded: ' + str(len(self.MONSTER_TYPES)))
@@ -0,0 +1,75 @@
+from collections import OrderedDict
+
+
+class PathCache:
+    # routes already found, keyed by (start, goal, consider_impassable). consider_impassable is
+    # all the pathfinder knows about what's moving so it stands in for the kind of mover.
+    # each entry holds the terrain_version of every chunk the route goes through and is only
+    # handed out while they're all the same, least recently used dropped first.
+    # routes to the same doors and stairs get asked for over and over, see report() for how often.
+    def __init__(self, pathfinder, max_entries=1024):
+        self.pathfinder = pathfinder
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0  # entries thrown away because a chunk they go through changed.
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (route, {chunk key: terrain_version})
+
+    def _key(self, start, goal, consider_impassable):
+        return ((start.x, start.y, start.z), (goal.x, goal.y, goal.z), consider_impassable)
+
+    def versions(self, pathfinder, start, route):
+        # {(cx, cy, z): terrain_version} for each chunk route goes through as pathfinder sees
+        # them, pathfinder being the one (or the snapshot) that found it.
+        _size = self.pathfinder.size
+        _versions = dict()
+        for position in [start] + route:
+            _key = (position.x // _size, position.y // _size, position.z)
+            if _key not in _versions:
+                _versions[_key] = pathfinder.terrain_version(*_key)
+        return _versions
+
+    def get(self, start, goal, consider_impassable=True):
+        # a copy of the route from start to goal, None if we don't have one that's still good.
+        _key = self._key(start, goal, consider_impassable)
+        _entry = self._entries.get(_key)
+        if _entry is None:
+            self.misses = self.misses + 1
+            return None
+        _route, _versions = _entry
+        for chunk, version in _versions.items():
+            if self.pathfinder.terrain_version(*chunk) != version:
+                del self._entries[_key]
+                self.invalidations = self.invalidations + 1
+                self.misses = self.misses + 1
+                return None
+        self._entries.move_to_end(_key)
+        self.hits = self.hits + 1
+        return list(_route)
+
+    def put(self, start, goal, route, versions, consider_impassable=True):
+        # versions from versions(). there's nothing to check a missing route against so those
+        # aren't kept.
+        if route is None:
+            return
+        _key = self._key(start, goal, consider_impassable)
+        self._entries.pop(_key, None)
+        self._entries[_key] = (list(route), versions)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions = self.evictions + 1
+
+    def hit_rate(self):
+        _lookups = self.hits + self.misses
+        return self.hits / _lookups if _lookups else 0.0
+
+    def report(self):
+        return "{} routes, {} hits, {} misses ({:.1%} hit), {} invalidated, {} evictions".format(
+            len(self._entries),
+            self.hits,
+            self.misses,
+            self.hit_rate(),
+            self.invalidations,
+            self.evictions,
+        )
@@ -0,0 +1,674 @@
+import copy
+import heapq
+import logging
+import math
+
+from src.position import Position
+
+_log = logging.getLogger("root")
+
+# terrain.json's move_cost for plain ground. terrain without a cost (0) costs this much too,
+# whether a tile can be entered is up to Terrain.impassable like it is for movement.
+DEFAULT_MOVE_COST = 2
+
+# east, west, south, north. the same order as Chunk.neighbour_masks().
+NEIGHBOURS_4 = ((1, 0), (-1, 0), (0, 1), (0, -1))
+NEIGHBOURS_8 = NEIGHBOURS_4 + ((1, 1), (1, -1), (-1, 1), (-1, -1))
+# the chunks whose terrain decides what HierarchicalPathfinder knows about a chunk, (dx, dy, dz).
+NEIGHBOURS_4_AND_LEVELS = tuple((dx, dy, 0) for dx, dy in NEIGHBOURS_4) + ((0, 0, 1), (0, 0, -1))
+
+DIAGONAL = math.sqrt(2)  # what a diagonal step costs compared to a straight one.
+
+
+def manhattan(dx, dy):
+    return dx + dy
+
+
+def octile(dx, dy):
+    # straight steps until we're lined up, diagonal ones for the rest.
+    return max(dx, dy) + (DIAGONAL - 1) * min(dx, dy)
+
+
+HEURISTICS = {"manhattan": manhattan, "octile": octile}
+
+
+class Pathfinder:
+    # A* over the worldmap's tiles. routes between z levels go by the stairs and ladders in the
+    # worldmap's connector_chunks, see _find_path_between_levels().
+    # costs come from terrain.json's move_cost and furniture.json's move_cost_mod, furniture with a
+    # negative move_cost_mod can't be walked through. max_nodes is how many tiles one search may
+    # expand before it gives up.
+    def __init__(
+        self,
+        worldmap,
+        terrain_types=None,
+        furniture_types=None,
+        diagonal=False,
+        heuristic=None,
+        max_nodes=4000,
+    ):
+        self.worldmap = worldmap
+        self.terrain_costs = dict(
+            (ident, terrain.get("move_cost", 0))
+            for ident, terrain in (terrain_types or {}).items()
+        )
+        self.furniture_costs = dict(
+            (ident, furniture.get("move_cost_mod", 0))
+            for ident, furniture in (furniture_types or {}).items()
+        )
+        self.diagonal = diagonal
+        self.neighbours = NEIGHBOURS_8 if diagonal else NEIGHBOURS_4
+        self.heuristic = HEURISTICS[heuristic or ("octile" if diagonal else "manhattan")]
+        self.max_nodes = max_nodes
+        # the heuristic counts steps, times the cheapest step there is so it never overestimates.
+        self.min_cost = min(
+            [cost for cost in self.terrain_costs.values() if cost > 0]
+            + [DEFAULT_MOVE_COST]
+        )
+        self.expanded = 0  # tiles the last search expanded.
+        self.size = worldmap.chunk_size
+        # (x, y) offset and index offset of each of NEIGHBOURS_4 inside a chunk.
+        self._steps = tuple(
+            (dx, dy, dx * self.size + dy) for dx, dy in NEIGHBOURS_4
+        )
+        # (cx, cy, z) -> (chunk, terrain_version, exits, costs, step costs, connectors),
+        # see _layer().
+        self._layers = dict()
+        self.frozen = False  # a snapshot, see snapshot().
+        self._connectors = dict()  # z -> what _level_connectors() gave when we were snapshot.
+
+    def snapshot(self):
+        # a copy that only looks at the layers as they are now, for searching off the main
+        # thread while the worldmap changes. layers are never changed once built so they're shared.
+        for cx, column in list(self.worldmap.WORLDMAP.items()):
+            for cy, chunks in list(column.items()):
+                for z in list(chunks.keys()):
+                    self._layer(cx, cy, z)
+        _snapshot = copy.copy(self)
+        _snapshot._layers = dict(self._layers)
+        _snapshot._connectors = dict(
+            (z, self._level_connectors(z))
+            for z in list(self.worldmap.connector_chunks.keys())
+        )
+        _snapshot.frozen = True
+        return _snapshot
+
+    def terrain_version(self, cx, cy, z):
+        # the chunk's terrain_version as this pathfinder sees it, None if there's no chunk there.
+        if self.frozen:
+            _layer = self._layers.get((cx, cy, z))
+            return None if _layer is None else _layer[1]
+        _chunk = self.worldmap.WORLDMAP.get(cx, {}).get(cy, {}).get(z)
+        return None if _chunk is None else _chunk.terrain_version
+
+    def _layer(self, cx, cy, z):
+        # exits[i] has bit n set when tile i can step the nth way of NEIGHBOURS_4 without leaving
+        # the chunk, from the chunk's passability bitmaps. costs[i] is what stepping onto tile i
+        # costs, None if it's blocked, step costs[i] the same whether it's blocked or not.
+        # connectors is {i: (dz, ...)} for the tiles with stairs or ladders.
+        # rebuilt when the chunk's terrain_version moves.
+        if self.frozen:
+            return self._layers.get((cx, cy, z))
+        _chunk = self.worldmap.WORLDMAP.get(cx, {}).get(cy, {}).get(z)
+        if _chunk is None:
+            return None
+        _layer = self._layers.get((cx, cy, z))
+        if _layer is None or _layer[0] is not _chunk or _layer[1] != _chunk.terrain_version:
+            _open = _chunk.open_mask()
+            _masks = _chunk.neighbour_masks(_open)
+            _exits = [0] * len(_chunk.tiles)
+            for bit, mask in enumerate(_masks):
+                index = 0
+                while mask:
+                    if mask & 1:
+                        _exits[index] = _exits[index] | 1 << bit
+                    mask = mask >> 1
+                    index = index + 1
+            _step_costs = [self.step_cost(tile) for tile in _chunk.tiles]
+            _costs = [
+                cost if _open >> index & 1 else None
+                for index, cost in enumerate(_step_costs)
+            ]
+            _connectors = dict()
+            if _chunk.goes_up or _chunk.goes_down:
+                for index in range(len(_chunk.tiles)):
+                    _dzs = tuple(dz for dz in (1, -1) if _chunk.connects(index, dz))
+                    if _dzs:
+                        _connectors[index] = _dzs
+            _layer = (
+                _chunk,
+                _chunk.terrain_version,
+                _exits,
+                _costs,
+                _step_costs,
+                _connectors,
+            )
+            self._layers[(cx, cy, z)] = _layer
+        return _layer
+
+    def _level_connectors(self, z):
+        # ((x, y), dz) for every stair and ladder on level z.
+        if self.frozen:
+            return self._connectors.get(z, [])
+        _connectors = []
+        for cx, cy in list(self.worldmap.connector_chunks.get(z, ())):
+            _layer = self._layer(cx, cy, z)
+            if _layer is None:
+                continue
+            for index, dzs in _layer[5].items():
+                _x = cx * self.size + index // self.size
+                _y = cy * self.size + index % self.size
+                for dz in dzs:
+                    _connectors.append(((_x, _y), dz))
+        return _connectors
+
+    def cost_at(self, x, y, z, consider_impassable=True):
+        # what stepping onto (x, y) costs, None if it can't be stepped onto or isn't there.
+        if x < 0 or y < 0:
+            return None
+        _cx, _lx = divmod(x, self.size)
+        _cy, _ly = divmod(y, self.size)
+        _layer = self._layer(_cx, _cy, z)
+        if _layer is None:
+            return None
+        return _layer[3 if consider_impassable else 4][_lx * self.size + _ly]
+
+    def step_cost(self, tile):
+        # what stepping onto tile costs. whether it can be stepped onto is up to the chunk's
+        # passability bitmaps, see cost_at().
+        _cost = self.terrain_costs.get(tile["terrain"].ident, 0)
+        if _cost <= 0:
+            _cost = DEFAULT_MOVE_COST
+        if tile["furniture"] is not None:
+            _mod = self.furniture_costs.get(tile["furniture"].ident, 0)
+            if _mod > 0:
+                _cost = _cost + _mod
+        return _cost
+
+    def find_path(self, start, goal, consider_impassable=True, max_nodes=None):
+        # the Positions from the step after start to goal, [] if we're already there.
+        # None if there's no way there or we ran out of nodes looking for one.
+        self.expanded = 0
+        if start.z != goal.z:
+            return self._find_path_between_levels(start, goal, consider_impassable, max_nodes)
+        if start == goal:
+            return []
+        _z = start.z
+        if self.cost_at(goal.x, goal.y, _z, consider_impassable) is None:
+            return None
+        if max_nodes is None:
+            max_nodes = self.max_nodes
+
+        _goal = (goal.x, goal.y)
+        _start = (start.x, start.y)
+        _h = self.heuristic(abs(goal.x - start.x), abs(goal.y - start.y)) * self.min_cost
+        # (f, h, tile) so ties go to whichever is closer to the goal, then by position.
+        # the same tile can be in here more than once, anything already closed is skipped.
+        _open = [(_h, _h, _start)]
+        _g = {_start: 0}
+        _came_from = {_start: None}
+        _closed = set()
+        while _open:
+            _, _, node = heapq.heappop(_open)
+            if node == _goal:
+                return self._reconstruct(_came_from, node, _z)
+            if node in _closed:
+                continue
+            _closed.add(node)
+            self.expanded = self.expanded + 1
+            if self.expanded > max_nodes:
+                _log.debug(
+                    "Pathfinder: gave up on {} to {} after {} nodes.".format(
+                        start, goal, max_nodes
+                    )
+                )
+                return None
+            _node_g = _g[node]
+            for _next, _cost in self.neighbours_of(node, _z, consider_impassable):
+                if _next in _closed:
+                    continue
+                _next_g = _node_g + _cost
+                if _next_g < _g.get(_next, _next_g + 1):
+                    _g[_next] = _next_g
+                    _came_from[_next] = node
+                    _h = (
+                        self.heuristic(abs(_goal[0] - _next[0]), abs(_goal[1] - _next[1]))
+                        * self.min_cost
+                    )
+                    heapq.heappush(_open, (_next_g + _h, _h, _next))
+        return None
+
+    def level_heuristic(self, goal):
+        # a heuristic for (x, y, z) nodes. off goal's level it goes by way of the nearest stair
+        # or ladder that leads towards it, so searches head for the stairs.
+        _goal = (goal.x, goal.y, goal.z)
+        # z -> (what's left from there, x, y) of the connectors on z that lead towards goal.z,
+        # the nearest to goal first.
+        _towards = dict()
+        _known = dict()
+
+        def heuristic(node):
+            x, y, z = node
+            if z == _goal[2]:
+                return self.heuristic(abs(_goal[0] - x), abs(_goal[1] - y)) * self.min_cost
+            _h = _known.get(node)
+            if _h is not None:
+                return _h
+            if z not in _towards:
+                _dz = 1 if _goal[2] > z else -1
+                _towards[z] = sorted(
+                    set(
+                        (self.heuristic(abs(_goal[0] - cx), abs(_goal[1] - cy)), cx, cy)
+                        for (cx, cy), dz in self._level_connectors(z)
+                        if dz == _dz
+                    )
+                )
+            _best = None
+            for _rest, cx, cy in _towards[z]:
+                if _best is not None and _rest >= _best:
+                    break  # the rest are further from goal than that already is.
+                _via = self.heuristic(abs(cx - x), abs(cy - y)) + _rest
+                if _best is None or _via < _best:
+                    _best = _via
+            if _best is None:
+                _best = self.heuristic(abs(_goal[0] - x), abs(_goal[1] - y))
+            _best = _best + abs(_goal[2] - z)
+            _h = _best * self.min_cost
+            _known[node] = _h
+            return _h
+
+        return heuristic
+
+    def _find_path_between_levels(self, start, goal, consider_impassable, max_nodes):
+        # A* like find_path() with (x, y, z) nodes, stairs and ladders are the edges between
+        # levels.
+        if self.cost_at(goal.x, goal.y, goal.z, consider_impassable) is None:
+            return None
+        if max_nodes is None:
+            max_nodes = self.max_nodes
+        _goal = (goal.x, goal.y, goal.z)
+        heuristic = self.level_heuristic(goal)
+        _start = (start.x, start.y, start.z)
+        _h = heuristic(_start)
+        _open = [(_h, _h, _start)]
+        _g = {_start: 0}
+        _came_from = {_start: None}
+        _closed = set()
+        while _open:
+            _, _, node = heapq.heappop(_open)
+            if node == _goal:
+                _path = []
+                while _came_from[node] is not None:
+                    _path.append(Position(*node))
+                    node = _came_from[node]
+                _path.reverse()
+                return _path
+            if node in _closed:
+                continue
+            _closed.add(node)
+            self.expanded = self.expanded + 1
+            if self.expanded > max_nodes:
+                _log.debug(
+                    "Pathfinder: gave up on {} to {} after {} nodes.".format(
+                        start, goal, max_nodes
+                    )
+                )
+                return None
+            x, y, z = node
+            _steps = [
+                ((_next[0], _next[1], z), _cost)
+                for _next, _cost in self.neighbours_of((x, y), z, consider_impassable)
+            ]
+            for dz in self.connectors_at(x, y, z):
+                _cost = self.cost_at(x, y, z + dz, consider_impassable)
+                if _cost is not None:
+                    _steps.append(((x, y, z + dz), _cost))
+            _node_g = _g[node]
+            for _next, _cost in _steps:
+                if _next in _closed:
+                    continue
+                _next_g = _node_g + _cost
+                if _next_g < _g.get(_next, _next_g + 1):
+                    _g[_next] = _next_g
+                    _came_from[_next] = node
+                    _h = heuristic(_next)
+                    heapq.heappush(_open, (_next_g + _h, _h, _next))
+        return None
+
+    def connectors_at(self, x, y, z):
+        # the dz of each way we can climb from (x, y, z).
+        if x < 0 or y < 0:
+            return ()
+        _cx, _lx = divmod(x, self.size)
+        _cy, _ly = divmod(y, self.size)
+        _layer = self._layer(_cx, _cy, z)
+        if _layer is None:
+            return ()
+        return _layer[5].get(_lx * self.size + _ly, ())
+
+    def neighbours_of(self, node, z, consider_impassable=True):
+        # (x, y) of each tile we can step to from node and what the step costs.
+        x, y = node
+        if self.diagonal or not consider_impassable or x < 0 or y < 0:
+            for _next in self._neighbours_of(node, z, consider_impassable):
+                yield _next
+            return
+        # straight steps by the chunk's bitmaps, only steps into the next chunk look at it.
+        _cx, _lx = divmod(x, self.size)
+        _cy, _ly = divmod(y, self.size)
+        _layer = self._layer(_cx, _cy, z)
+        if _layer is None:
+            return
+        _index = _lx * self.size + _ly
+        _exits = _layer[2][_index]
+        _costs = _layer[3]
+        _last = self.size - 1
+        for bit, (dx, dy, offset) in enumerate(self._steps):
+            if _exits >> bit & 1:
+                yield (x + dx, y + dy), _costs[_index + offset]
+            elif (dx and _lx == (_last if dx > 0 else 0)) or (
+                dy and _ly == (_last if dy > 0 else 0)
+            ):
+                _cost = self.cost_at(x + dx, y + dy, z)
+                if _cost is not None:
+                    yield (x + dx, y + dy), _cost
+
+    def _neighbours_of(self, node, z, consider_impassable):
+        x, y = node
+        for dx, dy in self.neighbours:
+            _cost = self.cost_at(x + dx, y + dy, z, consider_impassable)
+            if _cost is None:
+                continue
+            if dx and dy:
+                # no cutting corners past something we couldn't step onto.
+                if self.cost_at(x + dx, y, z, consider_impassable) is None:
+                    continue
+                if self.cost_at(x, y + dy, z, consider_impassable) is None:
+                    continue
+                _cost = _cost * DIAGONAL
+            yield (x + dx, y + dy), _cost
+
+    def _reconstruct(self, came_from, node, z):
+        _path = []
+        while came_from[node] is not None:
+            _path.append(Position(node[0], node[1], z))
+            node = came_from[node]
+        _path.reverse()
+        return _path
+
+
+class HierarchicalPathfinder:
+    # HPA*, for routes across town. each chunk's borders have a few entrances, tiles we can cross
+    # into the next chunk from, and we keep what it costs to get between the entrances of a chunk.
+    # stairs and ladders, and the tiles they come out on, are entrances too so routes go between
+    # levels the same way. a route is found over entrances first and then filled in tile by tile,
+    # only in the chunks it goes through. what we know about a chunk is rebuilt when its, a
+    # neighbour's or the chunk above or below's terrain_version changes, which is only when
+    # terrain or furniture did.
+    # routes that fit in a couple of chunks, and ones that ignore impassable, are left to pathfinder.
+    def __init__(self, pathfinder, near=None):
+        self.pathfinder = pathfinder
+        self.size = pathfinder.worldmap.chunk_size
+        self.near = near if near is not None else self.size * 2
+        # (cx, cy, z) -> (signature, entrance -> [(entrance, cost)] inside the chunk,
+        #                 entrance -> [(entrance, cost)] into the next chunk,
+        #                 entrance -> how to get to each tile of the chunk from it,
+        #                 entrance -> [(dz, cost)] up or down a level)
+        # entrances are (x, y), the chunk says which level.
+        self._chunks = dict()
+        self.expanded = 0  # entrances the last search expanded.
+        self.rebuilds = 0
+
+    def using(self, pathfinder):
+        # the same entrances, searched with another pathfinder like a snapshot of this one's.
+        _copy = copy.copy(self)
+        _copy.pathfinder = pathfinder
+        return _copy
+
+    def _chunk(self, cx, cy, z):
+        _layer = self.pathfinder._layer(cx, cy, z)
+        if _layer is None:
+            return None
+        # the layers of the chunk and its neighbours, (chunk, terrain_version) of each.
+        _signature = [_layer[:2]]
+        for dx, dy, dz in NEIGHBOURS_4_AND_LEVELS:
+            _next = self.pathfinder._layer(cx + dx, cy + dy, z + dz)
+            _signature.append(None if _next is None else _next[:2])
+        _signature = tuple(_signature)
+        _data = self._chunks.get((cx, cy, z))
+        if _data is None or _data[0] != _signature:
+            _data = (_signature,) + self._build(cx, cy, z)
+            self._chunks[(cx, cy, z)] = _data
+            self.rebuilds = self.rebuilds + 1
+        return _data
+
+    def _passable(self, x, y, z):
+        return self.pathfinder.cost_at(x, y, z) is not None
+
+    def _entrances(self, cx, cy, z):
+        # entrance tile -> [(tile across the border, cost)]. the neighbour picks the same places
+        # along the border from its side so both ends of a crossing are entrances.
+        _x0 = cx * self.size
+        _y0 = cy * self.size
+        _last = self.size - 1
+        _inter = dict()
+        for dx, dy in NEIGHBOURS_4:
+            _border = []
+            for i in range(self.size):
+                if dx:
+                    _tile = (_x0 + (_last if dx > 0 else 0), _y0 + i)
+                else:
+                    _tile = (_x0 + i, _y0 + (_last if dy > 0 else 0))
+                _border.append((_tile, (_tile[0] + dx, _tile[1] + dy)))
+            _run = []
+            for tile, across in _border + [(None, None)]:
+                if tile is not None and self._passable(*tile, z) and self._passable(*across, z):
+                    _run.append((tile, across))
+                    continue
+                if not _run:
+                    continue
+                # one crossing in the middle of a short opening, one at each end of a long one.
+                if len(_run) < 6:
+                    _picked = [_run[len(_run) // 2]]
+                else:
+                    _picked = [_run[0], _run[-1]]
+                for _tile, _across in _picked:
+                    _cost = self.pathfinder.cost_at(_across[0], _across[1], z)
+                    _inter.setdefault(_tile, []).append((_across, _cost))
+                _run = []
+        return _inter
+
+    def _levels(self, cx, cy, z):
+        # (stair or ladder -> [(dz, cost)], the tiles stairs from the levels above and below
+        # come out on) for the chunk.
+        _x0 = cx * self.size
+        _y0 = cy * self.size
+        _vertical = dict()
+        _layer = self.pathfinder._layer(cx, cy, z)
+        for index, dzs in _layer[5].items():
+            _tile = (_x0 + index // self.size, _y0 + index % self.size)
+            if not self._passable(_tile[0], _tile[1], z):
+                continue
+            for dz in dzs:
+                _cost = self.pathfinder.cost_at(_tile[0], _tile[1], z + dz)
+                if _cost is not None:
+                    _vertical.setdefault(_tile, []).append((dz, _cost))
+        _landings = set()
+        for dz in (1, -1):
+            _other = self.pathfinder._layer(cx, cy, z + dz)
+            if _other is None:
+                continue
+            for index, dzs in _other[5].items():
+                _tile = (_x0 + index // self.size, _y0 + index % self.size)
+                if -dz in dzs and self._passable(_tile[0], _tile[1], z):
+                    _landings.add(_tile)
+        return _vertical, _landings
+
+    def _build(self, cx, cy, z):
+        _inter = self._entrances(cx, cy, z)
+        _vertical, _landings = self._levels(cx, cy, z)
+        _entrances = set(_inter) | set(_vertical) | _landings
+        _intra = dict()
+        _came_from = dict()  # kept so routes are filled in without searching again.
+        for entrance in _entrances:
+            _distances, _came_from[entrance] = self._search((cx, cy, z), entrance)
+            _intra[entrance] = [
+                (other, _distances[other])
+                for other in _entrances
+                if other != entrance and other in _distances
+            ]
+        return _intra, _inter, _came_from, _vertical
+
+    def _search(self, chunk, source, target=None, reverse=False):
+        # dijkstra from source over chunk's tiles only, stopping at target if there is one.
+        # with reverse the distances are of getting from each tile to source instead.
+        _x0 = chunk[0] * self.size
+        _y0 = chunk[1] * self.size
+        _z = chunk[2]
+        _distances = {source: 0}
+        _came_from = {source: None}
+        _open = [(0, source)]
+        _closed = set()
+        while _open:
+            _distance, node = heapq.heappop(_open)
+            if node in _closed:
+                continue
+            _closed.add(node)
+            if node == target:
+                break
+            if reverse:
+                _into = self.pathfinder.cost_at(node[0], node[1], _z)
+            for _next, _cost in self.pathfinder.neighbours_of(node, _z):
+                if not (
+                    _x0 <= _next[0] < _x0 + self.size and _y0 <= _next[1] < _y0 + self.size
+                ):
+                    continue
+                if reverse:
+                    _cost = _into
+                    if _next[0] != node[0] and _next[1] != node[1]:
+                        _cost = _cost * DIAGONAL
+                _next_distance = _distance + _cost
+                if _next_distance < _distances.get(_next, _next_distance + 1):
+                    _distances[_next] = _next_distance
+                    _came_from[_next] = node
+                    heapq.heappush(_open, (_next_distance, _next))
+        return _distances, _came_from
+
+    def _chunk_of(self, node):
+        # node is (x, y, z).
+        return (node[0] // self.size, node[1] // self.size, node[2])
+
+    def find_path(self, start, goal, consider_impassable=True, max_nodes=None):
+        # same as Pathfinder.find_path.
+        self.expanded = 0
+        if not consider_impassable or abs(start.x - goal.x) + abs(start.y - goal.y) <= self.near:
+            _path = self.pathfinder.find_path(start, goal, consider_impassable, max_nodes)
+            if _path is not None or not consider_impassable:
+                return _path
+            # nearby but the way there goes further than pathfinder would look.
+        if start == goal:
+            return []
+        _start = (start.x, start.y, start.z)
+        _goal = (goal.x, goal.y, goal.z)
+        if start.x < 0 or start.y < 0 or not self._passable(*_goal):
+            return None
+        _start_chunk = self._chunk_of(_start)
+        _goal_chunk = self._chunk_of(_goal)
+        if self._chunk(*_start_chunk) is None or self._chunk(*_goal_chunk) is None:
+            return None
+        if max_nodes is None:
+            max_nodes = self.pathfinder.max_nodes
+
+        # start and goal join the entrances of their chunks for this search.
+        _entrances = self._chunk(*_start_chunk)[1]
+        _distances, _from_start = self._search(_start_chunk, _start[:2])
+        _targets = list(_entrances)
+        if _goal_chunk == _start_chunk:
+            _targets.append(_goal[:2])
+        _start_edges = [
+            (node + (start.z,), _distances[node])
+            for node in _targets
+            if node != _start[:2] and node in _distances
+        ]
+        _entrances = self._chunk(*_goal_chunk)[1]
+        _distances, _to_goal_steps = self._search(_goal_chunk, _goal[:2], reverse=True)
+        _to_goal = dict(
+            (node + (goal.z,), _distances[node]) for node in _entrances if node in _distances
+        )
+
+        heuristic = self.pathfinder.level_heuristic(goal)
+        _chunks = dict()  # what _chunk() gave for each chunk this search has been in.
+        _h = heuristic(_start)
+        _open = [(_h, _h, _start)]
+        _g = {_start: 0}
+        _came_from = {_start: None}
+        _closed = set()
+        while _open:
+            _, _, node = heapq.heappop(_open)
+            if node == _goal:
+                return self._refine(_came_from, node, _from_start, _to_goal_steps)
+            if node in _closed:
+                continue
+            _closed.add(node)
+            self.expanded = self.expanded + 1
+            if self.expanded > max_nodes:
+                _log.debug(
+                    "HierarchicalPathfinder: gave up on {} to {} after {} entrances.".format(
+                        start, goal, max_nodes
+                    )
+                )
+                return None
+            x, y, z = node
+            _edges = []
+            if node == _start:
+                _edges.extend(_start_edges)
+            _chunk = self._chunk_of(node)
+            _data = _chunks.get(_chunk)
+            if _data is None:
+                _data = _chunks[_chunk] = self._chunk(*_chunk)
+            if node != _start:
+                _edges.extend(
+                    (other + (z,), cost) for other, cost in _data[1].get((x, y), ())
+                )
+            _edges.extend((across + (z,), cost) for across, cost in _data[2].get((x, y), ()))
+            _edges.extend(((x, y, z + dz), cost) for dz, cost in _data[4].get((x, y), ()))
+            if node in _to_goal and node != _start:
+                _edges.append((_goal, _to_goal[node]))
+            _node_g = _g[node]
+            for _next, _cost in _edges:
+                if _next in _closed:
+                    continue
+                _next_g = _node_g + _cost
+                if _next_g < _g.get(_next, _next_g + 1):
+                    _g[_next] = _next_g
+                    _came_from[_next] = node
+                    _h = heuristic(_next)
+                    heapq.heappush(_open, (_next_g + _h, _h, _next))
+        return None
+
+    def _refine(self, came_from, node, from_start, to_goal):
+        # the entrances the route goes through, filled in with the tiles between them.
+        _nodes = []
+        while node is not None:
+            _nodes.append(node)
+            node = came_from[node]
+        _nodes.reverse()
+        _goal = _nodes[-1]
+        _path = []
+        for _from, _to in zip(_nodes, _nodes[1:]):
+            _chunk = self._chunk_of(_from)
+            z = _from[2]
+            if _chunk != self._chunk_of(_to):  # across a border or up or down, one step.
+                _path.append(Position(*_to))
+            elif _from == _nodes[0]:
+                _path.extend(self.pathfinder._reconstruct(from_start, _to[:2], z))
+            elif _to == _goal:
+                # to_goal points each tile at the next one on the way to the goal.
+                _step = to_goal[_from[:2]]
+                while _step is not None:
+                    _path.append(Position(_step[0], _step[1], z))
+                    _step = to_goal[_step]
+            else:
+                _came_from = self._chunk(*_chunk)[3][_from[:2]]
+                _path.extend(self.pathfinder._reconstruct(_came_from, _to[:2], z))
+        return _path
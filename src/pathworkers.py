@@ -0,0 +1,153 @@
+import logging
+import threading
+from queue import Empty, Queue
+
+_log = logging.getLogger("root")
+
+
+class PathRequest:
+    # a route being found for owners. owners is every name waiting on the same start and goal.
+    def __init__(self, owner, start, goal, consider_impassable=True):
+        self.owners = [owner]
+        self.start = start
+        self.goal = goal
+        self.consider_impassable = consider_impassable
+        self.snapshot = None  # the Pathfinder snapshot the search runs on.
+        self.cancelled = False
+        self.route = None
+        self.versions = None  # the chunks route goes through, see PathCache.versions().
+
+    def key(self):
+        return (self.start, self.goal, self.consider_impassable)
+
+
+class PathWorkers:
+    # finds routes on worker threads so a long search doesn't hold up the main loop.
+    # requests search a snapshot of the pathfinder's passability, the worldmap itself is only
+    # touched on the main thread. one snapshot is shared by everything submitted until
+    # refresh(), which the server calls once a turn after the world has changed.
+    # submit() and completed() are only called from the main thread. a new request from an owner
+    # cancels the one it had, identical requests in flight are shared. routes in cache, a
+    # PathCache, are handed back without a search and the ones found are added to it.
+    def __init__(self, hierarchical_pathfinder, workers=2, cache=None):
+        self.hierarchical_pathfinder = hierarchical_pathfinder
+        self.cache = cache
+        self._jobs = Queue()
+        self._results = Queue()
+        self._pending = dict()  # owner -> PathRequest
+        self._in_flight = dict()  # PathRequest.key() -> PathRequest
+        self._snapshot = None
+        self.snapshots = 0
+        self.submitted = 0
+        self.deduplicated = 0
+        self.cancelled = 0
+        self._threads = []
+        for number in range(workers):
+            _thread = threading.Thread(
+                target=self._work, name="PathWorker-{}".format(number), daemon=True
+            )
+            _thread.start()
+            self._threads.append(_thread)
+
+    def submit(self, owner, start, goal, consider_impassable=True):
+        _request = self._in_flight.get((start, goal, consider_impassable))
+        if _request is not None and owner in _request.owners:
+            self.deduplicated = self.deduplicated + 1
+            return _request
+        self.cancel(owner)
+        self.submitted = self.submitted + 1
+        if _request is not None:
+            _request.owners.append(owner)
+            self._pending[owner] = _request
+            self.deduplicated = self.deduplicated + 1
+            return _request
+        _request = PathRequest(owner, start, goal, consider_impassable)
+        if self.cache is not None:
+            _request.route = self.cache.get(start, goal, consider_impassable)
+            if _request.route is not None:
+                # still delivered by completed() like any other.
+                self._pending[owner] = _request
+                self._results.put(_request)
+                return _request
+        if self._snapshot is None:
+            self._snapshot = self.hierarchical_pathfinder.pathfinder.snapshot()
+            self.snapshots = self.snapshots + 1
+        _request.snapshot = self._snapshot
+        self._pending[owner] = _request
+        self._in_flight[_request.key()] = _request
+        self._jobs.put(_request)
+        return _request
+
+    def refresh(self):
+        # the next submit() takes a new snapshot.
+        self._snapshot = None
+
+    def cancel(self, owner):
+        _request = self._pending.pop(owner, None)
+        if _request is None:
+            return
+        _request.owners.remove(owner)
+        if not _request.owners:
+            _request.cancelled = True
+            self.cancelled = self.cancelled + 1
+            if self._in_flight.get(_request.key()) is _request:
+                del self._in_flight[_request.key()]
+
+    def _work(self):
+        while True:
+            _request = self._jobs.get()
+            if _request is None:
+                return
+            if _request.cancelled:
+                continue
+            try:
+                _request.route = self.hierarchical_pathfinder.using(
+                    _request.snapshot
+                ).find_path(_request.start, _request.goal, _request.consider_impassable)
+                if self.cache is not None and _request.route is not None:
+                    _request.versions = self.cache.versions(
+                        _request.snapshot, _request.start, _request.route
+                    )
+            except Exception:
+                _log.exception(
+                    "PathWorkers: couldn't find a route from {} to {}.".format(
+                        _request.start, _request.goal
+                    )
+                )
+            _request.snapshot = None
+            self._results.put(_request)
+
+    def completed(self):
+        # (owner, PathRequest) for every finished request that hasn't been cancelled.
+        _completed = []
+        while True:
+            try:
+                _request = self._results.get_nowait()
+            except Empty:
+                break
+            if self._in_flight.get(_request.key()) is _request:
+                del self._in_flight[_request.key()]
+            if _request.versions is not None:
+                self.cache.put(
+                    _request.start,
+                    _request.goal,
+                    _request.route,
+                    _request.versions,
+                    _request.consider_impassable,
+                )
+            if _request.cancelled:
+                continue
+            for owner in _request.owners:
+                if self._pending.get(owner) is _request:
+                    del self._pending[owner]
+                    _completed.append((owner, _request))
+        return _completed
+
+    def pending(self):
+        return len(self._pending)
+
+    def stop(self):
+        for _ in self._threads:
+            self._jobs.put(None)
+        for _thread in self._threads:
+            _thread.join(1.0)
@@ -4,6 +4,9 @@ import pprint
 import os
 import sys
 
+from src import contentpack
+from src.contentpack import json_files
+
 class Profession:
     def __init__(self, ident='generic'):
         self.ident = ident
@@ -12,34 +15,35 @@ class Profession:
         return self.ident
 
 
+def compile_professions(path):
+    # the profession json under path. lists are of strings, dicts are kept as they are.
+    PROFESSIONS = defaultdict(dict)
+    for file_data in json_files(path):
+        with open(file_data, encoding='utf-8') as data_file: 
+            data = json.load(data_file)
+        for item in data:
+            try:
+                for key, value in item.items():
+                    if(isinstance(value, list)):
+                        PROFESSIONS[item['ident']][key] = []
+                        for add_value in value:
+                            PROFESSIONS[item['ident']][key].append(str(add_value))
+                    elif(isinstance(value, dict)):
+                        PROFESSIONS[item['ident']][key] = {}
+                        for add_key, add_value in value.items():
+                            PROFESSIONS[item['ident']][key][add_key] = add_value
+                    else:
+                        PROFESSIONS[item['ident']][key] = str(value)
+            except Exception:
+                print()
+                print('!! couldn\'t parse: ' + str(item) + ' -- likely missing ident.')
+                print()
+                sys.exit()
+    return PROFESSIONS
+
+
 class ProfessionManager:
     def __init__(self):
-        # load professions from file and save references to them.
-        self.PROFESSIONS = defaultdict(dict)
-        for root, _, files in os.walk('./data/json/professions/'):
-            for file_data in files:
-                if file_data.endswith('.json'):
-                    with open(root+'/'+file_data, encoding='utf-8') as data_file: 
-                        data = json.load(data_file)
-                    for item in data:
-                        try:
-                            for key, value in item.items():
-                                print(key, value)
-                                if(isinstance(value, list)):
-                                    self.PROFESSIONS[item['ident']][key] = []
-                                    for add_value in value:
-                                        self.PROFESSIONS[item['ident']][key].append(str(add_value))
-                                elif(isinstance(value, dict)):
-                                    self.PROFESSIONS[item['ident']][key] = {}
-                                    for add_key, add_value in value.items():
-                                        self.PROFESSIONS[item['ident']][key][add_key] = add_value
-                                else:
-                                    self.PROFESSIONS[item['ident']][key] = str(value)
-                            print(self.PROFESSIONS[item['ident']])
-                        except Exception:
-                            print()
-                            print('!! couldn\'t parse: ' + str(item) + ' -- likely missing ident.')
-                            print()
-                            sys.exit()
-
-        print('total PROFESSIONS loaded: ' + str(len(self.PROFESSIONS)))
\ No newline at end of file
+        # load professions from the content pack and save references to them.
+        self.PROFESSIONS = contentpack.load('PROFESSIONS')
+        print('total PROFESSIONS loaded: ' + str(len(self.PROFESSIONS)))
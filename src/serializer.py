@@ -1,23 +1,225 @@
 import json
 import jsonpickle
 
+from src.bodypart import Bodypart
+from src.character import Character
+from src.furniture import Furniture
+from src.item import Container, Item
+from src.position import Position
+from src.profession import Profession
+from src.terrain import Terrain
+from src.worldmap import Chunk
 
-class ChunkEncoder(json.JSONEncoder):
-    """Custom simplified class encoder."""
-    def default(self, obj):
-        return obj.__class__.__name__, obj.__dict__
+# packets start with this so decode_packet() can tell them from plain jsonpickle.
+SCHEMA_MARKER = "~s1"
 
+# a tile is a plain dict with exactly these keys, see Chunk.__init__.
+TILE_FIELDS = (
+    "position",
+    "terrain",
+    "creature",
+    "items",
+    "furniture",
+    "vehicle",
+    "trap",
+    "bullet",
+    "lumens",
+)
+_TILE_TAG = "~tile"
+_TILE_KEYS = frozenset(TILE_FIELDS)
+_FALLBACK_TAG = "~"  # anything without a schema, flattened by jsonpickle.
+_DICT_TAG = "~dict"  # a dict whose only key looks like a tag, as [key, value] pairs.
+_MISSING = object()
 
-class ChunkDecoder(json.JSONDecoder):
-    def decode(self, s, _w=json.decoder.WHITESPACE.match):
-        pass
+_SCHEMAS_BY_TYPE = dict()  # class -> (tag, fields, ref fields)
+_SCHEMAS_BY_TAG = dict()  # tag -> (class, fields, ref fields, defaults)
+
+
+def register(cls, fields, ref_fields=(), defaults=None, tag=None):
+    """Encode instances of cls (not subclasses) as their fields' values in order.
+
+    Trailing fields an object doesn't have are left off and stay unset when it's decoded.
+    ref_fields are shared dicts like Item.reference, written once per packet in a refs table.
+    defaults are attributes that aren't sent but are set on the decoded object.
+    """
+    tag = tag or "~" + cls.__name__
+    _SCHEMAS_BY_TYPE[cls] = (tag, tuple(fields), frozenset(ref_fields))
+    _SCHEMAS_BY_TAG[tag] = (cls, tuple(fields), frozenset(ref_fields), defaults or {})
+
+
+_CREATURE_FIELDS = (
+    "stats",
+    "known_recipes",
+    "command_queue",
+    "gender",
+    "radiation",
+    "name",
+    "in_vehicle",
+    "controlling_vehicle",
+    "possible_actions",
+    "actions_per_turn",
+    "next_action_available",
+    "hallucination",
+    "tile_ident",
+    "dodges_per_turn",
+    "blocks_per_turn",
+    "move_mode",
+    "body_parts",
+    "grabbed",
+)
+
+register(Position, ("x", "y", "z"), defaults={"previous": None})
+register(Terrain, ("ident", "impassable"))
+register(Furniture, ("ident",))
+register(Item, ("ident", "reference"), ref_fields=("reference",))
+register(
+    Container,
+    (
+        "ident",
+        "reference",
+        "contained_items",
+        "opened",
+        "base_weight",
+        "max_volume",
+        "contained_weight",
+        "contained_volume",
+    ),
+    ref_fields=("reference",),
+)
+register(
+    Bodypart, ("ident", "vital_organ", "slot0", "slot1", "armor", "slot_equipped")
+)
+register(Profession, ("ident",))
+register(Character, _CREATURE_FIELDS + ("style_selected", "profession", "position"))
+register(
+    Chunk,
+    (
+        "tiles",
+        "weather",
+        "overmap_tile",
+        "is_dirty",
+        "was_loaded",
+        "x",
+        "y",
+        "z",
+        "chunk_size",
+        "version",
+        "tile_versions",
+        "terrain_version",
+        "terrain_blocked",
+        "furniture_blocked",
+        "occupied",
+        "opaque",
+        "goes_up",
+        "goes_down",
+    ),
+)
+
+
+class SchemaEncoder:
+    """Turns registered objects into plain lists and dicts for json.dumps."""
+
+    def __init__(self):
+        self.refs = []
+        self._ref_index = dict()  # id(shared dict) -> index in refs
+
+    def ref(self, value):
+        if not isinstance(value, dict):
+            return self.flatten(value)
+        _index = self._ref_index.get(id(value))
+        if _index is None:
+            _index = len(self.refs)
+            self._ref_index[id(value)] = _index
+            self.refs.append(self.flatten(value))
+        return _index
+
+    def flatten(self, obj):
+        _type = type(obj)
+        if obj is None or _type is str or _type is int or _type is float or _type is bool:
+            return obj
+        if _type is list or _type is tuple:
+            return [self.flatten(value) for value in obj]
+        if _type is dict:
+            if obj.keys() == _TILE_KEYS:
+                return {_TILE_TAG: [self.flatten(obj[field]) for field in TILE_FIELDS]}
+            if all(type(key) is str for key in obj):
+                if len(obj) == 1 and next(iter(obj)).startswith("~"):
+                    return {_DICT_TAG: [[key, self.flatten(value)] for key, value in obj.items()]}
+                return dict((key, self.flatten(value)) for key, value in obj.items())
+        _schema = _SCHEMAS_BY_TYPE.get(_type)
+        if _schema is not None:
+            _tag, _fields, _ref_fields = _schema
+            _values = []
+            for field in _fields:
+                _value = getattr(obj, field, _MISSING)
+                if _value is _MISSING:
+                    _values.append(_MISSING)
+                elif field in _ref_fields:
+                    _values.append(self.ref(_value))
+                else:
+                    _values.append(self.flatten(_value))
+            while _values and _values[-1] is _MISSING:
+                _values.pop()
+            return {_tag: [None if value is _MISSING else value for value in _values]}
+        return {_FALLBACK_TAG: jsonpickle.Pickler(keys=True).flatten(obj)}
+
+    def encode(self, obj):
+        _data = self.flatten(obj)
+        return json.dumps([SCHEMA_MARKER, self.refs, _data], separators=(",", ":"))
+
+
+class SchemaDecoder:
+    """Rebuilds what SchemaEncoder wrote. Registered objects are made without calling __init__."""
+
+    def __init__(self):
+        self._unresolved = []  # (object, field) whose value is still an index into refs.
+
+    def object_hook(self, obj):
+        if len(obj) != 1:
+            return obj
+        for _tag in obj:
+            pass
+        if not _tag.startswith("~"):
+            return obj
+        _values = obj[_tag]
+        if _tag == _TILE_TAG:
+            return dict(zip(TILE_FIELDS, _values))
+        if _tag == _DICT_TAG:
+            return dict(_values)
+        if _tag == _FALLBACK_TAG:
+            return jsonpickle.Unpickler(keys=True).restore(_values)
+        _schema = _SCHEMAS_BY_TAG.get(_tag)
+        if _schema is None:
+            return obj
+        _cls, _fields, _ref_fields, _defaults = _schema
+        _decoded = _cls.__new__(_cls)
+        for field, value in zip(_fields, _values):
+            setattr(_decoded, field, value)
+            if field in _ref_fields and type(value) is int:
+                self._unresolved.append((_decoded, field))
+        for field, value in _defaults.items():
+            setattr(_decoded, field, value)
+        return _decoded
+
+    def decode(self, s):
+        _marker, _refs, _data = json.loads(s, object_hook=self.object_hook)
+        for _decoded, field in self._unresolved:
+            setattr(_decoded, field, _refs[getattr(_decoded, field)])
+        return _data
 
 
 def encode_packet(*args, **kwargs):
-    """Stub for jsonpickle"""
-    return jsonpickle.encode(*args, **kwargs)
+    """Encodes one object with the schema encoder, jsonpickle if any jsonpickle options are given."""
+    if len(args) != 1 or kwargs:
+        return jsonpickle.encode(*args, **kwargs)
+    return SchemaEncoder().encode(args[0])
 
 
 def decode_packet(*args, **kwargs):
-    """Stub for jsonpickle"""
+    """Decodes what encode_packet() made, or anything jsonpickle made."""
+    _s = args[0]
+    if isinstance(_s, bytes):
+        _s = _s.decode("utf-8")
+    if isinstance(_s, str) and _s.startswith('["' + SCHEMA_MARKER + '"'):
+        return SchemaDecoder().decode(_s)
     return jsonpickle.decode(*args, **kwargs)
@@ -1,3 +1,4 @@
+import copy
 import json
 import os
 import pickle
@@ -16,6 +17,22 @@ from src.monster import Monster
 from src.character import Character
 from src.position import Position
 from src.terrain import Terrain
+from src.tilemanager import TileManager
+
+def hidden_tile(position):
+    # what a client is sent for a tile it can't see.
+    return {
+        "position": position,
+        "terrain": None,
+        "creature": None,
+        "items": [],
+        "furniture": None,
+        "vehicle": None,
+        "trap": None,
+        "bullet": None,
+        "lumens": 0,
+    }
+
 
 # weather = [WEATHER_CLEAR, WEATHER_RAIN, WEATHER_FOG, WEATHER_STORM, WEATHER_TORNADO]
 
@@ -31,6 +48,26 @@ class Chunk:
             True
         )  # set this to true to have the changes updated on the disk, default is True so worldgen writes it to disk
         self.was_loaded = "no"
+        self.x = int(x)
+        self.y = int(y)
+        self.z = int(z)
+        self.chunk_size = chunk_size
+        # bumped on every change. tile_versions holds the version each tile last changed at
+        # so we can tell a client which tiles changed since the version it has.
+        self.version = 0
+        self.tile_versions = [0] * (chunk_size * chunk_size)
+        # the version terrain or furniture last changed at, pathfinding rebuilds what it knows
+        # about the chunk when this moves.
+        self.terrain_version = 0
+        # passability, a bit per tile (tile index i is bit i) kept up to date by
+        # Worldmap.update_passability() whenever the tile is marked changed.
+        self.terrain_blocked = 0
+        self.furniture_blocked = 0
+        self.occupied = 0  # there's a creature on it.
+        self.opaque = 0  # can't be seen through, see src/fov.py.
+        # stairs and ladders, a bit per tile that can be climbed up or down from.
+        self.goes_up = 0
+        self.goes_down = 0
         # start = time.time()
         for i in range(chunk_size):  # 0-13
             for j in range(chunk_size):  # 0-13
@@ -60,6 +97,140 @@ class Chunk:
         # duration = end - start
         # print('chunk generation took: ' + str(duration) + ' seconds.')
 
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if "tile_versions" not in state:  # chunks saved before tiles were versioned.
+            self.chunk_size = int(len(self.tiles) ** 0.5)
+            self.x = self.tiles[0]["position"].x // self.chunk_size
+            self.y = self.tiles[0]["position"].y // self.chunk_size
+            self.z = self.tiles[0]["position"].z
+            self.version = 0
+            self.tile_versions = [0] * len(self.tiles)
+        if "terrain_version" not in state:
+            self.terrain_version = 0
+        if "occupied" not in state:  # Worldmap fills these in when it loads the chunk.
+            self.terrain_blocked = 0
+            self.furniture_blocked = 0
+            self.occupied = 0
+        if "opaque" not in state:
+            self.opaque = 0
+        if "goes_up" not in state:
+            self.goes_up = 0
+            self.goes_down = 0
+
+    def get_key(self):
+        return "{}_{}_{}".format(self.x, self.y, self.z)
+
+    def get_tile_index(self, position):
+        # tiles are laid out x major, see __init__.
+        index = (position.x - self.x * self.chunk_size) * self.chunk_size + (
+            position.y - self.y * self.chunk_size
+        )
+        if 0 <= index < len(self.tiles) and self.tiles[index]["position"] == position:
+            return index
+        for index, tile in enumerate(self.tiles):
+            if tile["position"] == position:
+                return index
+        return None
+
+    def mark_tile_changed(self, index, terrain=False):
+        self.version = self.version + 1
+        self.tile_versions[index] = self.version
+        if terrain:
+            self.terrain_version = self.version
+
+    def set_passability(self, index, terrain_blocked, furniture_blocked, occupied):
+        _bit = 1 << index
+        self.terrain_blocked = (
+            self.terrain_blocked | _bit if terrain_blocked else self.terrain_blocked & ~_bit
+        )
+        self.furniture_blocked = (
+            self.furniture_blocked | _bit
+            if furniture_blocked
+            else self.furniture_blocked & ~_bit
+        )
+        self.occupied = self.occupied | _bit if occupied else self.occupied & ~_bit
+
+    def set_opaque(self, index, opaque):
+        _bit = 1 << index
+        self.opaque = self.opaque | _bit if opaque else self.opaque & ~_bit
+
+    def is_opaque(self, index):
+        return self.opaque >> index & 1 == 1
+
+    def set_connector(self, index, up, down):
+        _bit = 1 << index
+        self.goes_up = self.goes_up | _bit if up else self.goes_up & ~_bit
+        self.goes_down = self.goes_down | _bit if down else self.goes_down & ~_bit
+
+    def connects(self, index, dz):
+        # True if tile index can be climbed dz levels from, up for 1 and down for -1.
+        if dz == 1:
+            return self.goes_up >> index & 1 == 1
+        if dz == -1:
+            return self.goes_down >> index & 1 == 1
+        return False
+
+    def is_blocked(self, index, furniture=True, creatures=True):
+        _blocked = self.terrain_blocked
+        if furniture:
+            _blocked = _blocked | self.furniture_blocked
+        if creatures:
+            _blocked = _blocked | self.occupied
+        return _blocked >> index & 1 == 1
+
+    def open_mask(self, furniture=True, creatures=False):
+        # a bit set for every tile that can be stepped onto.
+        _blocked = self.terrain_blocked
+        if furniture:
+            _blocked = _blocked | self.furniture_blocked
+        if creatures:
+            _blocked = _blocked | self.occupied
+        return ~_blocked & ((1 << len(self.tiles)) - 1)
+
+    def neighbour_masks(self, open_mask):
+        # (east, west, south, north) for the whole chunk at once. bit i of each is set when the
+        # tile next to tile i that way is in this chunk and set in open_mask.
+        # tiles are x major, so x + 1 is index + chunk_size and y + 1 is index + 1.
+        _size = self.chunk_size
+        _all = (1 << len(self.tiles)) - 1
+        _column = (1 << (_size - 1)) - 1  # every y but the last in one column.
+        _not_last_y = 0
+        for x in range(_size):
+            _not_last_y = _not_last_y | _column << (x * _size)
+        return (
+            open_mask >> _size,
+            (open_mask << _size) & _all,
+            (open_mask >> 1) & _not_last_y,
+            (open_mask << 1) & (_not_last_y << 1),
+        )
+
+    def masked(self, visible):
+        # a copy holding only the tiles with their bit set in visible, the rest are blanks that
+        # only say where they are. the same chunk if every tile is visible.
+        if visible == (1 << len(self.tiles)) - 1:
+            return self
+        _chunk = copy.copy(self)
+        _chunk.tiles = [
+            tile if visible >> index & 1 else hidden_tile(tile["position"])
+            for index, tile in enumerate(self.tiles)
+        ]
+        # the bitmaps say no more about the blanks than the blanks do.
+        _chunk.terrain_blocked = self.terrain_blocked & visible
+        _chunk.furniture_blocked = self.furniture_blocked & visible
+        _chunk.occupied = self.occupied & visible
+        _chunk.opaque = self.opaque & visible
+        _chunk.goes_up = self.goes_up & visible
+        _chunk.goes_down = self.goes_down & visible
+        return _chunk
+
+    def get_tiles_changed_since(self, version):
+        return [
+            index
+            for index, tile_version in enumerate(self.tile_versions)
+            if tile_version > version
+        ]
+
 
 class Worldmap:
     # let's make the world map and fill it with chunks!
@@ -71,6 +242,9 @@ class Worldmap:
         self.chunk_size = 13  # size of the chunk, leave it hardcoded here. (0-12)
         self.FurnitureManager = FurnitureManager()
         self.ItemManager = ItemManager()
+        self.TileManager = TileManager()  # terrain flags, for what can be seen through.
+        # z -> (cx, cy) of the chunks on that level with stairs or ladders in them.
+        self.connector_chunks = defaultdict(set)
         start = time.time()
         # TODO: only need to load the chunks where there are actual Characters present in memory after generation.
         self._log.debug("creating/loading world chunks")
@@ -95,6 +269,7 @@ class Worldmap:
                         with open(path, "rb") as fp:
                             self.WORLDMAP[i][j][k] = pickle.load(fp)
                             self.WORLDMAP[i][j][k].was_loaded = "yes"
+                        self.update_chunk_passability(self.WORLDMAP[i][j][k])
                         if count < self.WORLD_SIZE - 1:
                             count = count + 1
                         else:
@@ -157,6 +332,63 @@ class Worldmap:
         # self._log.debug('getting chunk {} {}'.format(x_count, y_count))
         return self.WORLDMAP[x_count][y_count][z]
 
+    def mark_tile_changed(self, position, terrain=False):
+        # anything that changes a tile in place needs to call this so clients get sent the change.
+        # terrain is True when the tile's terrain or furniture changed.
+        chunk = self.get_chunk_by_position(position)
+        index = chunk.get_tile_index(position)
+        if index is not None:
+            chunk.mark_tile_changed(index, terrain)
+            self.update_passability(chunk, index)
+
+    def update_passability(self, chunk, index):
+        # terrain flagged impassable and furniture with a negative move_cost_mod block a tile.
+        tile = chunk.tiles[index]
+        _furniture = tile["furniture"]
+        _furniture_blocked = False
+        if _furniture is not None:
+            _furniture_type = self.FurnitureManager.FURNITURE_TYPES.get(
+                getattr(_furniture, "ident", None), {}
+            )
+            _furniture_blocked = _furniture_type.get("move_cost_mod", 0) < 0
+        chunk.set_passability(
+            index,
+            getattr(tile["terrain"], "impassable", False),  # blueprints aren't.
+            _furniture_blocked,
+            tile["creature"] is not None,
+        )
+        chunk.set_opaque(index, self.is_opaque(tile))
+        _flags = ()
+        if tile["terrain"] is not None:
+            _terrain_type = self.TileManager.TILE_TYPES.get(
+                getattr(tile["terrain"], "ident", None)
+            )
+            if _terrain_type is not None:
+                _flags = _terrain_type.get("flags") or ()
+        chunk.set_connector(index, "GOES_UP" in _flags, "GOES_DOWN" in _flags)
+        if chunk.goes_up or chunk.goes_down:
+            self.connector_chunks[chunk.z].add((chunk.x, chunk.y))
+        else:
+            self.connector_chunks[chunk.z].discard((chunk.x, chunk.y))
+
+    def is_opaque(self, tile):
+        # terrain and furniture are opaque unless they're flagged TRANSPARENT. anything we don't
+        # have a type for, like a blueprint, is seen through.
+        for _obj, _types in (
+            (tile["terrain"], self.TileManager.TILE_TYPES),
+            (tile["furniture"], self.FurnitureManager.FURNITURE_TYPES),
+        ):
+            if _obj is None:
+                continue
+            _type = _types.get(getattr(_obj, "ident", None))
+            if _type is not None and "TRANSPARENT" not in (_type.get("flags") or ()):
+                return True
+        return False
+
+    def update_chunk_passability(self, chunk):
+        for index in range(len(chunk.tiles)):
+            self.update_passability(chunk, index)
+
     def get_all_tiles(self):
         ret = []
         self._log.debug("getting all tiles")
@@ -272,33 +504,26 @@ class Worldmap:
         self.get_chunk_by_position(position).is_dirty = True
         if isinstance(obj, (Creature, Character, Monster)):
             tile["creature"] = obj
-            return
         elif isinstance(obj, Terrain):
             tile["terrain"] = obj
-            return
         elif isinstance(obj, Item):
             items = tile["items"]  # which is []
             items.append(obj)
-            return
         elif isinstance(obj, Furniture):
             tile["furniture"] = obj
-            return
         elif isinstance(
             obj, Blueprint
         ):  # a blueprint takes up the slot that the final object is. e.g Terrain blueprint takes up the Terrain slot in the world map.
             if obj.type_of == "Terrain":
                 tile["terrain"] = obj
-                return
             elif obj.type_of == "Item":
                 items = tile["items"]  # which is []
                 items.append(obj)
                 self._log.debug("added blueprint for an Item.")
-                return
             elif obj.type_of == "Furniture":
                 tile["furniture"] = obj
-                return
-
         # TODO: the rest of the types.
+        self.mark_tile_changed(position, isinstance(obj, (Terrain, Furniture, Blueprint)))
 
     def build_json_building_at_position(
         self, filename, position
@@ -353,33 +578,36 @@ class Worldmap:
             )
             return False
         if from_position.z != to_position.z:  # check for stairs.
-            if from_position.z < to_position.z:
-                if from_tile["terrain"].ident != "t_stairs_up":
-                    print("no up stairs there")
-                    return False
-            elif from_position.z > to_position.z:
-                if from_tile["terrain"].ident != "t_stairs_down":
-                    print("no down stairs there")
-                    return False
+            from_chunk = self.get_chunk_by_position(from_position)
+            if not from_chunk.connects(
+                from_chunk.get_tile_index(from_position), to_position.z - from_position.z
+            ):
+                self._log.debug("no stairs there")
+                return False
         self.get_chunk_by_position(from_position).is_dirty = True
         self.get_chunk_by_position(to_position).is_dirty = True
         if isinstance(obj, (Creature, Character, Monster)):
             self._log.debug(
                 "moving {} from {} to {}.".format(obj, from_position, to_position)
             )
-            if to_tile["terrain"].impassable:
+            to_chunk = self.get_chunk_by_position(to_position)
+            to_index = to_chunk.get_tile_index(to_position)
+            if to_chunk.is_blocked(to_index, furniture=False, creatures=False):
                 self._log.debug("tile is impassable")
                 return False
-            if (
-                to_tile["creature"] is not None
+            if to_chunk.is_blocked(
+                to_index, furniture=False
             ):  # don't replace creatures in the tile if we move over them.
                 self._log.debug("creature is impassable")
                 return False
             to_tile["creature"] = obj
             from_tile["creature"] = None
+            self.mark_tile_changed(from_position)
+            self.mark_tile_changed(to_position)
             return True
         if isinstance(obj, Terrain):
             to_tile["terrain"] = obj
+            self.mark_tile_changed(to_position, True)
             return True
         if obj is Item:
             print(
@@ -394,6 +622,8 @@ class Worldmap:
                 # items = tile['item'] # which is []
                 from_tile["items"].remove(obj)
                 to_tile["items"].append(obj)
+                self.mark_tile_changed(from_position)
+                self.mark_tile_changed(to_position)
             else:
                 pass
             return True
@@ -403,6 +633,8 @@ class Worldmap:
                 return False
             to_tile["furniture"] = obj
             from_tile["furniture"] = None
+            self.mark_tile_changed(from_position, True)
+            self.mark_tile_changed(to_position, True)
             return True
         # TODO: the rest of the types.
 
@@ -427,6 +659,7 @@ class Worldmap:
                     position,
                 )  # need to pass the reference to load the item with data.
             tile["furniture"] = None
+            self.mark_tile_changed(position, True)
             # get the 'bash' dict for this object from furniture.json
             # get 'str_min'
             # if player can break it then delete the furniture and add the bash items from it to the tile.
@@ -0,0 +1,127 @@
+# run from the repository root: python -m pytest unittest
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from src.accountstore import FileAccountStore, SQLiteAccountStore, migrate
+
+
+class AccountStoreContract:
+    # what every AccountStore has to do, run against each backend below.
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.store = self.make_store(self.path)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.path)
+
+    def test_accounts(self):
+        self.assertFalse(self.store.exists("anna"))
+        self.store.create("anna", "salt")
+        self.assertTrue(self.store.exists("anna"))
+        self.assertEqual(self.store.get_salt("anna"), "salt")
+        self.assertIsNone(self.store.get_password("anna"))
+        self.store.set_password("anna", "hashed")
+        self.assertEqual(self.store.get_password("anna"), "hashed")
+        self.assertIsNone(self.store.get_salt("nobody"))
+        self.assertEqual(list(self.store.accounts()), ["anna"])
+
+    def test_characters(self):
+        self.store.create("anna", "salt")
+        self.assertIsNone(self.store.read_character("anna", "bob"))
+        self.store.write_characters(
+            [("anna", "bob", "record 1", {"name": "bob"}), ("anna", "cat", "record 2", {})]
+        )
+        self.store.write_characters([("anna", "bob", "record 3", {"name": "bob", "x": 1})])
+        self.assertEqual(sorted(self.store.character_index()), [("anna", "bob"), ("anna", "cat")])
+        self.assertEqual(self.store.read_character("anna", "bob"), "record 3")
+        self.assertEqual(
+            self.store.read_summaries("anna"), {"bob": {"name": "bob", "x": 1}, "cat": {}}
+        )
+        self.assertEqual(self.store.read_summaries("nobody"), {})
+
+    def test_the_same_name_in_two_accounts_is_two_characters(self):
+        self.store.create("anna", "salt")
+        self.store.create("carl", "salt")
+        self.store.write_characters([("anna", "bob", "anna's", {})])
+        self.store.write_characters([("carl", "bob", "carl's", {})])
+        self.assertEqual(sorted(self.store.character_index()), [("anna", "bob"), ("carl", "bob")])
+        self.assertEqual(self.store.read_character("anna", "bob"), "anna's")
+        self.assertEqual(self.store.read_character("carl", "bob"), "carl's")
+
+
+class FileAccountStoreTest(AccountStoreContract, unittest.TestCase):
+    def make_store(self, path):
+        return FileAccountStore(path)
+
+
+class SQLiteAccountStoreTest(AccountStoreContract, unittest.TestCase):
+    def make_store(self, path):
+        return SQLiteAccountStore(os.path.join(path, "accounts.db"))
+
+    def test_version_1_databases_are_upgraded(self):
+        self.store.close()
+        _path = os.path.join(self.path, "old.db")
+        connection = sqlite3.connect(_path)
+        connection.executescript(
+            "CREATE TABLE accounts ("
+            "name TEXT PRIMARY KEY, salt TEXT NOT NULL, hashed_password TEXT);"
+            "CREATE TABLE characters (name TEXT PRIMARY KEY, account TEXT NOT NULL, "
+            "record TEXT NOT NULL, summary TEXT NOT NULL);"
+            "CREATE INDEX characters_by_account ON characters(account);"
+            "INSERT INTO accounts VALUES ('anna', 'salt', NULL), ('carl', 'salt', NULL);"
+            "INSERT INTO characters VALUES ('bob', 'anna', 'anna''s', '{}');"
+            "PRAGMA user_version=1;"
+        )
+        connection.close()
+        self.store = SQLiteAccountStore(_path)
+        self.store.write_characters([("carl", "bob", "carl's", {})])
+        self.assertEqual(sorted(self.store.character_index()), [("anna", "bob"), ("carl", "bob")])
+        self.assertEqual(self.store.read_character("anna", "bob"), "anna's")
+
+
+class MigrateTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.files = FileAccountStore(os.path.join(self.path, "accounts"))
+        self.database = SQLiteAccountStore(os.path.join(self.path, "accounts.db"))
+
+    def tearDown(self):
+        self.database.close()
+        shutil.rmtree(self.path)
+
+    def test_everything_is_copied(self):
+        self.files.create("anna", "salt a")
+        self.files.set_password("anna", "hashed")
+        self.files.create("carl", "salt c")
+        self.files.write_characters([("anna", "bob", "anna's", {"name": "bob"})])
+        self.files.write_characters([("carl", "bob", "carl's", {"name": "bob"})])
+        # from before summaries were kept.
+        os.remove(self.files._account_path("carl", "characters.summary"))
+
+        self.assertEqual(migrate(self.files, self.database), (2, 2))
+        self.assertEqual(self.database.get_password("anna"), "hashed")
+        self.assertIsNone(self.database.get_password("carl"))
+        self.assertEqual(self.database.get_salt("carl"), "salt c")
+        self.assertEqual(self.database.read_character("anna", "bob"), "anna's")
+        self.assertEqual(self.database.read_character("carl", "bob"), "carl's")
+        self.assertEqual(
+            self.database.read_summaries("carl"),
+            {"bob": {"name": "bob", "profession": None, "position": None}},
+        )
+
+    def test_accounts_already_there_are_left_alone(self):
+        self.files.create("anna", "salt a")
+        self.files.write_characters([("anna", "bob", "from files", {})])
+        self.database.create("anna", "salt b")
+        self.assertEqual(migrate(self.files, self.database), (0, 0))
+        self.assertEqual(self.database.get_salt("anna"), "salt b")
+        self.assertIsNone(self.database.read_character("anna", "bob"))
+
+
+if __name__ == "__main__":
+    unittest.main()
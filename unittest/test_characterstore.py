@@ -0,0 +1,116 @@
+# run from the repository root: python -m pytest unittest
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from src.accountstore import FileAccountStore
+from src.character import Character
+from src.characterstore import CharacterStore
+from src.position import Position
+
+
+class FlakyAccountStore(FileAccountStore):
+    # fails every write while failing is set, counts the batches it was given.
+    def __init__(self, path):
+        FileAccountStore.__init__(self, path)
+        self.failing = False
+        self.batches = []
+
+    def write_characters(self, records):
+        self.batches.append([name for _, name, _, _ in records])
+        if self.failing:
+            raise OSError("disk full")
+        FileAccountStore.write_characters(self, records)
+
+
+def make_character(name, x=0):
+    _character = Character(name)
+    _character.position = Position(x, 0, 0)
+    return _character
+
+
+class CharacterStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.accounts = FlakyAccountStore(self.path)
+        self.accounts.create("anna", "salt")
+        self.store = CharacterStore(self.accounts, batch_size=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_flush_writes_dirty_characters_in_batches(self):
+        for number in range(5):
+            self.store.add("anna", make_character("c{}".format(number)))
+        self.store.mark_dirty("c0")  # already waiting, not queued twice.
+        self.assertEqual(self.store.dirty(), 5)
+        self.assertEqual(self.store.flush(), 2)
+        self.assertEqual(self.store.flush(), 2)
+        self.assertEqual(self.store.flush(), 1)
+        self.assertEqual(self.store.flush(), 0)
+        self.assertEqual(self.accounts.batches, [["c0", "c1"], ["c2", "c3"], ["c4"]])
+        self.assertEqual(self.store.writes, 5)
+
+    def test_failed_flush_is_retried(self):
+        self.store.add("anna", make_character("bob"))
+        self.accounts.failing = True
+        self.assertEqual(self.store.flush(), 0)
+        self.assertEqual(self.store.dirty(), 1)
+        self.accounts.failing = False
+        self.assertEqual(self.store.flush(), 1)
+        self.assertEqual(self.store.dirty(), 0)
+        self.assertIsNotNone(self.accounts.read_character("anna", "bob"))
+
+    def test_saved_characters_load_after_a_restart(self):
+        self.store.add("anna", make_character("bob", x=7))
+        self.store.flush(0)
+        _store = CharacterStore(self.accounts)
+        self.assertIn("bob", _store)
+        self.assertEqual(_store.names("anna"), ["bob"])
+        _bob = _store.get("bob")
+        self.assertEqual((_bob.name, _bob.position.x), ("bob", 7))
+        self.assertIs(_store.get("bob"), _bob)
+        self.assertIsNone(_store.get("nobody"))
+
+    def test_records_that_are_not_packets_are_not_loaded(self):
+        self.accounts.write_characters([("anna", "old", "{}", {"name": "old"})])
+        _store = CharacterStore(self.accounts)
+        self.assertIn("old", _store)
+        self.assertIsNone(_store.get("old"))
+
+    def test_summaries_come_from_the_store_without_loading_records(self):
+        self.store.add("anna", make_character("bob", x=3))
+        self.store.add("anna", make_character("alice", x=4))
+        self.store.flush(0)
+        _store = CharacterStore(self.accounts)
+        _summaries = _store.summaries("anna")
+        self.assertEqual([summary["name"] for summary in _summaries], ["alice", "bob"])
+        self.assertEqual(_summaries[1]["position"], [3, 0, 0])
+        self.assertEqual(_store.characters, dict())
+
+    def test_summaries_follow_saved_changes(self):
+        _bob = make_character("bob", x=3)
+        self.store.add("anna", _bob)
+        self.store.flush(0)
+        _bob.position = Position(9, 9, 0)
+        self.store.mark_dirty("bob")
+        self.store.flush(0)
+        self.assertEqual(self.store.summaries("anna")[0]["position"], [9, 9, 0])
+        self.assertEqual(CharacterStore(self.accounts).summaries("anna")[0]["position"], [9, 9, 0])
+
+    def test_characters_without_a_summary_get_one(self):
+        self.store.add("anna", make_character("bob", x=5))
+        self.store.flush(0)
+        # saved before summaries were kept.
+        os.remove(self.accounts._account_path("anna", "characters.summary"))
+        _store = CharacterStore(self.accounts)
+        self.assertEqual(_store.summaries("anna")[0]["position"], [5, 0, 0])
+        # and saved again so the next start has it.
+        self.assertEqual(_store.flush(0), 1)
+        self.assertIn("bob", self.accounts.read_summaries("anna"))
+
+
+if __name__ == "__main__":
+    unittest.main()
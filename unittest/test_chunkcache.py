@@ -0,0 +1,52 @@
+# run from the repository root: python -m pytest unittest
+
+import unittest
+
+from src.chunkcache import ChunkCache, encode_chunk
+from src.position import Position
+from src.serializer import decode_packet
+from testworld import SmallWorldmap
+
+
+class ChunkCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.worldmap = SmallWorldmap(3, walls=0.2)
+        self.chunk = self.worldmap.get_chunk_by_position(Position(15, 15, 0))
+        self.cache = ChunkCache()
+        self.all = (1 << len(self.chunk.tiles)) - 1
+
+    def test_whole_chunks(self):
+        _payload = self.cache.get(self.chunk, False)
+        self.assertEqual(_payload, encode_chunk(self.chunk, False))
+        self.assertIs(self.cache.get(self.chunk, False, self.all), _payload)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+        self.assertEqual(self.cache.get(self.chunk, True), encode_chunk(self.chunk, True))
+        self.assertEqual(self.cache.misses, 2)
+
+    def test_partly_visible_chunks_are_cached_by_what_is_visible(self):
+        _half = self.all >> 80
+        _payload = self.cache.get(self.chunk, False, _half)
+        self.assertEqual(_payload, encode_chunk(self.chunk.masked(_half), False))
+        self.assertIs(self.cache.get(self.chunk, False, _half), _payload)
+        self.assertNotEqual(self.cache.get(self.chunk, False, _half >> 1), _payload)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 2))
+        _decoded = decode_packet(_payload)
+        self.assertIsNone(_decoded.tiles[-1]["terrain"])
+        self.assertIsNotNone(_decoded.tiles[0]["terrain"])
+
+    def test_a_new_version_is_encoded_again(self):
+        _payload = self.cache.get(self.chunk, False, self.all >> 80)
+        self.worldmap.set_wall(Position(13, 13, 0))
+        self.assertNotEqual(self.cache.get(self.chunk, False, self.all >> 80), _payload)
+        self.assertEqual(self.cache.misses, 2)
+
+    def test_least_recently_used_is_evicted(self):
+        self.cache.max_size = len(self.cache.get(self.chunk, False)) + 1
+        self.cache.get(self.chunk, False, self.all >> 1)
+        self.assertEqual(self.cache.evictions, 1)
+        self.cache.get(self.chunk, False)
+        self.assertEqual(self.cache.misses, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,30 @@
+# run from the repository root: python -m pytest unittest
+
+import unittest
+
+from src.command import Command
+from src.commandscheduler import CommandScheduler
+
+
+class CommandSchedulerTest(unittest.TestCase):
+    def test_a_failing_command_is_dropped(self):
+        scheduler = CommandScheduler()
+        for number in range(3):
+            scheduler.submit("a", Command("a", "move", [number]))
+            scheduler.submit("b", Command("b", "move", [number]))
+        _ran = []
+
+        def handler(connection, command):
+            if connection == "a" and command["args"] == [1]:
+                raise KeyError(command["ident"])
+            _ran.append((connection, command["args"][0]))
+
+        self.assertEqual(scheduler.drain(handler), 6)
+        self.assertEqual(_ran, [("a", 0), ("b", 0), ("b", 1), ("a", 2), ("b", 2)])
+        self.assertEqual(scheduler.totals.failed, 1)
+        self.assertEqual(scheduler.stats("a").failed, 1)
+        self.assertEqual(scheduler.queued(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+# run from the repository root: python -m pytest unittest
+
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from src import contentpack
+
+
+class ContentPackTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.pack = os.path.join(self.path, "content.pack")
+        self.digest = contentpack.source_digest()
+        contentpack.compile_pack(self.pack, self.digest)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_a_pack_is_read_back(self):
+        _slices = contentpack.read_pack(self.pack, self.digest)
+        self.assertEqual(set(_slices), set(contentpack.SOURCES))
+        self.assertIn("t_wall", pickle.loads(_slices["TILE_TYPES"]))
+
+    def test_a_new_pack_version_rebuilds(self):
+        with mock.patch.object(contentpack, "PACK_VERSION", contentpack.PACK_VERSION + 1):
+            _digest = contentpack.source_digest()
+        self.assertNotEqual(_digest, self.digest)
+        self.assertIsNone(contentpack.read_pack(self.pack, _digest))
+
+    def test_editing_a_compiler_rebuilds(self):
+        _files = contentpack.compiler_files()
+        self.assertIn(os.path.abspath(contentpack.__file__), _files)
+        self.assertIn("item.py", [os.path.basename(path) for path in _files])
+        # a stand-in for item.py with something changed in it.
+        _item = os.path.join(self.path, "item.py")
+        shutil.copy(next(path for path in _files if path.endswith("item.py")), _item)
+        with open(_item, "a") as item_file:
+            item_file.write("# changed\n")
+        _edited = sorted(_item if path.endswith("item.py") else path for path in _files)
+        with mock.patch.object(contentpack, "compiler_files", lambda: _edited):
+            self.assertNotEqual(contentpack.source_digest(), self.digest)
+
+    def test_a_damaged_pack_is_not_read(self):
+        with open(self.pack, "r+b") as pack_file:
+            pack_file.seek(-1, os.SEEK_END)
+            pack_file.write(b"?")
+        self.assertIsNone(contentpack.read_pack(self.pack, self.digest))
+
+
+if __name__ == "__main__":
+    unittest.main()
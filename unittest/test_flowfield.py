@@ -0,0 +1,102 @@
+# run from the repository root: python -m pytest unittest
+
+import heapq
+import random
+import unittest
+
+from src.flowfield import FlowField, FlowFields
+from src.position import Position
+from testworld import SmallWorldmap
+
+
+def reference_distances(pathfinder, target, center, radius):
+    # a plain dijkstra from target over the square radius either way of center, what a field
+    # built there from scratch has to come up with.
+    _distances = {(target.x, target.y): 0}
+    _open = [(0, (target.x, target.y))]
+    while _open:
+        _distance, node = heapq.heappop(_open)
+        if _distance > _distances[node]:
+            continue
+        _into = pathfinder.cost_at(node[0], node[1], target.z, False)
+        if _into is None:
+            continue
+        for _next, _ in pathfinder.neighbours_of(node, target.z):
+            if abs(_next[0] - center[0]) > radius or abs(_next[1] - center[1]) > radius:
+                continue
+            if _distance + _into < _distances.get(_next, _distance + _into + 1):
+                _distances[_next] = _distance + _into
+                heapq.heappush(_open, (_distance + _into, _next))
+    return _distances
+
+
+class FlowFieldTest(unittest.TestCase):
+    def setUp(self):
+        self.worldmap = SmallWorldmap(3, walls=0.15)
+        self.pathfinder = self.worldmap.pathfinder()
+        self.open = [
+            Position(x, y, 0)
+            for x in range(39)
+            for y in range(39)
+            if self.pathfinder.cost_at(x, y, 0) is not None
+        ]
+        random.seed(1)
+
+    def assert_matches_rebuild(self, field):
+        _target = Position(*field.target)
+        _expected = reference_distances(self.pathfinder, _target, field.center, field.radius)
+        self.assertEqual(set(field.distances), set(_expected))
+        for (x, y), distance in _expected.items():
+            self.assertAlmostEqual(field.distance(Position(x, y, 0)), distance)
+
+    def test_moving_the_target_matches_a_rebuild(self):
+        _target = Position(19, 19, 0)
+        self.worldmap.set_wall(_target, False)
+        field = FlowField(self.pathfinder, _target)
+        for _ in range(30):
+            _steps = [
+                _next
+                for _next, _ in self.pathfinder.neighbours_of((_target.x, _target.y), 0)
+                if self.pathfinder.cost_at(_next[0], _next[1], 0) is not None
+            ]
+            _target = Position(*random.choice(_steps), 0)
+            field.move_target(_target)
+            self.assert_matches_rebuild(field)
+        # most of those were updates in place, not rebuilds.
+        self.assertGreater(field.updates, field.builds)
+
+    def test_terrain_changes_rebuild(self):
+        _target = Position(19, 19, 0)
+        self.worldmap.set_wall(_target, False)
+        field = FlowField(self.pathfinder, _target)
+        self.worldmap.set_wall(Position(21, 19, 0))
+        field.move_target(_target)
+        self.assertEqual(field.builds, 2)
+        self.assert_matches_rebuild(field)
+
+    def test_next_step_goes_downhill_to_the_target(self):
+        _target = Position(19, 19, 0)
+        self.worldmap.set_wall(_target, False)
+        field = FlowField(self.pathfinder, _target)
+        for start in random.sample([p for p in self.open if field.distance(p) is not None], 20):
+            _position = start
+            for _ in range(200):
+                if (_position.x, _position.y) == (_target.x, _target.y):
+                    break
+                _next = field.next_step(_position)
+                self.assertIsNotNone(_next)
+                self.assertLess(field.distance(_next), field.distance(_position))
+                _position = _next
+            self.assertEqual((_position.x, _position.y), (_target.x, _target.y))
+
+    def test_fields_are_shared_and_dropped_when_idle(self):
+        fields = FlowFields(self.pathfinder, keep_turns=2)
+        _target = Position(19, 19, 0)
+        self.assertIs(fields.field(_target), fields.field(Position(19, 19, 0)))
+        for _ in range(3):
+            fields.update()
+        self.assertEqual(len(fields.fields), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+# run from the repository root: python -m pytest unittest
+
+import unittest
+
+from src.fov import FieldsOfView, shadowcast
+from src.position import Position
+from testworld import SmallWorldmap
+
+
+def in_radius(dx, dy, radius):
+    return dx * dx + dy * dy <= radius * radius + radius
+
+
+class ShadowcastTest(unittest.TestCase):
+    def test_open_ground_sees_the_whole_circle(self):
+        _visible = shadowcast(lambda x, y: False, 0, 0, 8)
+        _circle = set(
+            (dx, dy) for dx in range(-8, 9) for dy in range(-8, 9) if in_radius(dx, dy, 8)
+        )
+        self.assertEqual(_visible, _circle)
+
+    def test_walls_are_seen_but_not_what_is_behind_them(self):
+        # a pillar two tiles away in each of the eight directions.
+        _pillars = set()
+        for dx in (-2, 0, 2):
+            for dy in (-2, 0, 2):
+                if (dx, dy) != (0, 0):
+                    _pillars.add((dx, dy))
+        _visible = shadowcast(lambda x, y: (x, y) in _pillars, 0, 0, 8)
+        for dx, dy in _pillars:
+            self.assertIn((dx, dy), _visible)
+            for distance in range(2, 4):
+                self.assertNotIn((dx * distance, dy * distance), _visible)
+
+    def test_a_closed_room_hides_everything_outside(self):
+        def wall(x, y):
+            return max(abs(x), abs(y)) == 3
+
+        _visible = shadowcast(wall, 0, 0, 10)
+        _room = set((dx, dy) for dx in range(-3, 4) for dy in range(-3, 4))
+        self.assertEqual(_visible, _room)
+
+    def test_a_doorway_lets_some_light_out(self):
+        def wall(x, y):
+            return max(abs(x), abs(y)) == 3 and (x, y) != (3, 0)
+
+        _visible = shadowcast(wall, 0, 0, 10)
+        self.assertIn((10, 0), _visible)
+        self.assertNotIn((-5, 0), _visible)
+        self.assertNotIn((5, 5), _visible)
+
+
+class FieldsOfViewTest(unittest.TestCase):
+    def setUp(self):
+        self.worldmap = SmallWorldmap(3, walls=0.1)
+        self.fields = FieldsOfView(self.worldmap, radius=8)
+        self.position = Position(19, 19, 0)
+        self.worldmap.set_wall(self.position, False)
+
+    def visible(self, masks):
+        # the masks, keyed by chunk.get_key(), as (x, y) tiles.
+        _size = self.worldmap.chunk_size
+        _tiles = set()
+        for key, mask in masks.items():
+            cx, cy, _ = (int(part) for part in key.split("_"))
+            for index in range(_size * _size):
+                if mask >> index & 1:
+                    _tiles.add((cx * _size + index // _size, cy * _size + index % _size))
+        return _tiles
+
+    def opaque(self, x, y):
+        return self.worldmap.is_opaque(self.worldmap.get_tile_by_position(Position(x, y, 0)))
+
+    def test_masks_are_what_shadowcast_sees(self):
+        _masks = self.fields.masks("bob", self.position)
+        self.assertEqual(
+            self.visible(_masks), shadowcast(self.opaque, self.position.x, self.position.y, 8)
+        )
+
+    def test_cast_again_only_when_something_changed(self):
+        _masks = self.fields.masks("bob", self.position)
+        self.assertIs(self.fields.masks("bob", Position(19, 19, 0)), _masks)
+        self.assertEqual((self.fields.casts, self.fields.reused), (1, 1))
+
+        self.worldmap.set_wall(Position(21, 19, 0))
+        _walled = self.fields.masks("bob", self.position)
+        self.assertEqual(self.fields.casts, 2)
+        self.assertNotIn((25, 19), self.visible(_walled))
+
+        self.fields.masks("bob", Position(20, 20, 0))
+        self.assertEqual(self.fields.casts, 3)
+        self.fields.forget("bob")
+        self.fields.masks("bob", Position(20, 20, 0))
+        self.assertEqual(self.fields.casts, 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+# run from the repository root: python -m pytest unittest
+
+import unittest
+
+from src.pathcache import PathCache
+from src.position import Position
+from testworld import SmallWorldmap
+
+
+class PathCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.worldmap = SmallWorldmap(3, walls=0)
+        self.pathfinder = self.worldmap.pathfinder()
+        self.cache = PathCache(self.pathfinder, max_entries=2)
+        # across the top row of chunks, never going near the bottom row.
+        self.start = Position(2, 2, 0)
+        self.goal = Position(36, 2, 0)
+        self.route = self.pathfinder.find_path(self.start, self.goal)
+        self.cache.put(
+            self.start,
+            self.goal,
+            self.route,
+            self.cache.versions(self.pathfinder, self.start, self.route),
+        )
+
+    def test_hit_while_nothing_changed(self):
+        self.assertEqual(self.cache.get(self.start, self.goal), self.route)
+        self.assertIsNot(self.cache.get(self.start, self.goal), self.route)
+        self.assertIsNone(self.cache.get(self.start, self.goal, False))
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 1))
+
+    def test_terrain_change_on_the_route_invalidates(self):
+        self.worldmap.set_wall(Position(20, 10, 0))
+        self.assertIsNone(self.cache.get(self.start, self.goal))
+        self.assertEqual(self.cache.invalidations, 1)
+        # and it's gone, not checked again.
+        self.assertIsNone(self.cache.get(self.start, self.goal))
+        self.assertEqual(self.cache.invalidations, 1)
+
+    def test_terrain_change_elsewhere_keeps_the_route(self):
+        self.worldmap.set_wall(Position(20, 30, 0))
+        self.assertEqual(self.cache.get(self.start, self.goal), self.route)
+        self.assertEqual(self.cache.invalidations, 0)
+
+    def test_snapshot_versions_go_stale_when_the_world_moves_on(self):
+        # a route found on a snapshot is checked against the live world when it's handed out.
+        _snapshot = self.pathfinder.snapshot()
+        self.worldmap.set_wall(Position(5, 5, 0))
+        _route = self.pathfinder.find_path(self.start, self.goal)
+        self.cache.put(
+            self.start, self.goal, _route, self.cache.versions(_snapshot, self.start, _route)
+        )
+        self.assertIsNone(self.cache.get(self.start, self.goal))
+
+    def test_least_recently_used_is_evicted(self):
+        for y in (3, 4):
+            _start = Position(2, y, 0)
+            _route = self.pathfinder.find_path(_start, self.goal)
+            self.cache.put(
+                _start, self.goal, _route, self.cache.versions(self.pathfinder, _start, _route)
+            )
+        self.assertEqual(self.cache.evictions, 1)
+        self.assertIsNone(self.cache.get(self.start, self.goal))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,219 @@
+# run from the repository root: python -m pytest unittest
+
+import heapq
+import random
+import unittest
+
+from src.pathfinding import HierarchicalPathfinder
+from src.position import Position
+from testworld import SmallWorldmap
+
+
+def cheapest(pathfinder, start, z):
+    # what the cheapest route from start to every tile it can reach costs, a plain dijkstra over
+    # cost_at() so it doesn't share the bitmaps the pathfinders step by.
+    _costs = {start: 0}
+    _open = [(0, start)]
+    while _open:
+        _cost, (x, y) = heapq.heappop(_open)
+        if _cost > _costs[(x, y)]:
+            continue
+        for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1)):
+            _step = pathfinder.cost_at(x + dx, y + dy, z)
+            if _step is None:
+                continue
+            if _cost + _step < _costs.get((x + dx, y + dy), _cost + _step + 1):
+                _costs[(x + dx, y + dy)] = _cost + _step
+                heapq.heappush(_open, (_cost + _step, (x + dx, y + dy)))
+    return _costs
+
+
+class RouteChecks:
+    def open_tiles(self, z=0):
+        _size = self.worldmap.WORLD_SIZE * self.worldmap.chunk_size
+        return [
+            Position(x, y, z)
+            for x in range(_size)
+            for y in range(_size)
+            if self.pathfinder.cost_at(x, y, z) is not None
+        ]
+
+    def route_cost(self, start, route):
+        # checks every step is one tile onto somewhere that can be stepped on, or up or down
+        # stairs, and adds them up.
+        _cost = 0
+        _at = start
+        for position in route:
+            if position.z != _at.z:
+                self.assertEqual((position.x, position.y), (_at.x, _at.y))
+                _climbs = self.pathfinder.connectors_at(_at.x, _at.y, _at.z)
+                self.assertIn(position.z - _at.z, _climbs)
+            else:
+                self.assertEqual(abs(position.x - _at.x) + abs(position.y - _at.y), 1)
+            _step = self.pathfinder.cost_at(position.x, position.y, position.z)
+            self.assertIsNotNone(_step)
+            _cost = _cost + _step
+            _at = position
+        return _cost
+
+
+class PathfinderTest(RouteChecks, unittest.TestCase):
+    def setUp(self):
+        self.worldmap = SmallWorldmap(3, walls=0.25)
+        self.pathfinder = self.worldmap.pathfinder()
+        random.seed(2)
+
+    def test_routes_are_the_cheapest_there_is(self):
+        _open = self.open_tiles()
+        for start in random.sample(_open, 10):
+            _costs = cheapest(self.pathfinder, (start.x, start.y), 0)
+            for goal in random.sample(_open, 10):
+                _route = self.pathfinder.find_path(start, goal, max_nodes=100000)
+                if (goal.x, goal.y) not in _costs:
+                    self.assertIsNone(_route)
+                    continue
+                self.assertEqual(_route[-1] if _route else start, goal)
+                self.assertEqual(self.route_cost(start, _route), _costs[(goal.x, goal.y)])
+
+    def test_no_route(self):
+        _start = Position(19, 19, 0)
+        self.worldmap.set_wall(_start, False)
+        self.assertEqual(self.pathfinder.find_path(_start, Position(19, 19, 0)), [])
+        # into a wall, off the map, and somewhere walled in.
+        self.worldmap.set_wall(Position(25, 25, 0))
+        self.assertIsNone(self.pathfinder.find_path(_start, Position(25, 25, 0)))
+        self.assertIsNone(self.pathfinder.find_path(_start, Position(-1, 3, 0)))
+        _goal = Position(30, 30, 0)
+        self.worldmap.set_wall(_goal, False)
+        for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1)):
+            self.worldmap.set_wall(Position(30 + dx, 30 + dy, 0))
+        self.assertIsNone(self.pathfinder.find_path(_start, _goal, max_nodes=100000))
+
+    def test_walls_are_walked_through_when_not_considered(self):
+        _start = Position(5, 5, 0)
+        _goal = Position(5, 10, 0)
+        for y in range(5, 11):
+            self.worldmap.set_wall(Position(5, y, 0), y in (7, 8))
+        _route = self.pathfinder.find_path(_start, _goal, consider_impassable=False)
+        self.assertEqual(len(_route), 5)
+        self.assertIn(Position(5, 7, 0), _route)
+
+    def test_gives_up_after_max_nodes(self):
+        _open = self.open_tiles()
+        _start, _goal = _open[0], _open[-1]
+        self.assertIsNone(self.pathfinder.find_path(_start, _goal, max_nodes=5))
+        self.assertEqual(self.pathfinder.expanded, 6)
+
+
+class HierarchicalPathfinderTest(RouteChecks, unittest.TestCase):
+    def setUp(self):
+        self.worldmap = SmallWorldmap(5, walls=0.25)
+        self.pathfinder = self.worldmap.pathfinder()
+        # near=0 so even short routes go over entrances.
+        self.hierarchical = HierarchicalPathfinder(self.pathfinder, near=0)
+        random.seed(3)
+
+    def test_routes_go_where_a_star_does_and_cost_about_the_same(self):
+        _open = self.open_tiles()
+        _ratios = []
+        for start in random.sample(_open, 8):
+            for goal in random.sample(_open, 8):
+                _best = self.pathfinder.find_path(start, goal, max_nodes=100000)
+                _route = self.hierarchical.find_path(start, goal, max_nodes=100000)
+                if _best is None:
+                    self.assertIsNone(_route)
+                    continue
+                self.assertIsNotNone(_route)
+                self.assertEqual(_route[-1] if _route else start, goal)
+                _cost = self.route_cost(start, _route)
+                _best_cost = self.route_cost(start, _best)
+                self.assertGreaterEqual(_cost, _best_cost)
+                if _best_cost > 0:
+                    _ratios.append(_cost / _best_cost)
+        self.assertGreater(len(_ratios), 20)
+        # near optimal, not optimal, the route has to go through the chunks' entrances.
+        self.assertLess(max(_ratios), 1.5)
+        self.assertLess(sum(_ratios) / len(_ratios), 1.1)
+
+    def test_terrain_changes_are_routed_around(self):
+        _start = Position(2, 2, 0)
+        _goal = Position(60, 60, 0)
+        for position in (_start, _goal):
+            self.worldmap.set_wall(position, False)
+        _route = self.hierarchical.find_path(_start, _goal, max_nodes=100000)
+        self.assertIsNotNone(_route)
+        _rebuilds = self.hierarchical.rebuilds
+        _blocked = _route[len(_route) // 2]
+        self.worldmap.set_wall(_blocked)
+        _route = self.hierarchical.find_path(_start, _goal, max_nodes=100000)
+        self.assertNotIn(_blocked, _route)
+        self.route_cost(_start, _route)
+        self.assertGreater(self.hierarchical.rebuilds, _rebuilds)
+
+
+class LevelsTest(RouteChecks, unittest.TestCase):
+    def setUp(self):
+        self.worldmap = SmallWorldmap(3, walls=0.1)
+        self.worldmap.add_level(1)
+        self.pathfinder = self.worldmap.pathfinder()
+        self.start = Position(2, 2, 0)
+        self.goal = Position(30, 30, 1)
+        self.worldmap.set_wall(self.start, False)
+
+    def climbs(self, route):
+        # where route changes level, as (x, y, from z, to z).
+        _climbs = []
+        for _from, _to in zip(route, route[1:]):
+            if _from.z != _to.z:
+                _climbs.append((_from.x, _from.y, _from.z, _to.z))
+        return _climbs
+
+    def test_no_way_up(self):
+        self.assertIsNone(self.pathfinder.find_path(self.start, self.goal))
+
+    def test_up_the_stairs(self):
+        self.worldmap.set_terrain(Position(8, 8, 0), "t_stairs_up")
+        _route = self.pathfinder.find_path(self.start, self.goal, max_nodes=100000)
+        self.assertEqual(_route[-1], self.goal)
+        self.route_cost(self.start, _route)
+        self.assertEqual(self.climbs([self.start] + _route), [(8, 8, 0, 1)])
+
+    def test_the_stairs_nearest_the_way(self):
+        self.worldmap.set_terrain(Position(36, 2, 0), "t_stairs_up")
+        self.worldmap.set_terrain(Position(20, 20, 0), "t_stairs_up")
+        _route = self.pathfinder.find_path(self.start, self.goal, max_nodes=100000)
+        self.route_cost(self.start, _route)
+        self.assertEqual(self.climbs([self.start] + _route), [(20, 20, 0, 1)])
+
+    def test_down_a_ladder(self):
+        self.worldmap.set_terrain(Position(10, 25, 1), "t_ladder_down")
+        _route = self.pathfinder.find_path(self.goal, self.start, max_nodes=100000)
+        self.assertEqual(_route[-1], self.start)
+        self.route_cost(self.goal, _route)
+        self.assertEqual(self.climbs([self.goal] + _route), [(10, 25, 1, 0)])
+        # a ladder down doesn't go up.
+        self.assertIsNone(self.pathfinder.find_path(self.start, self.goal))
+
+    def test_stairs_taken_away(self):
+        _stairs = Position(8, 8, 0)
+        self.worldmap.set_terrain(_stairs, "t_stairs_up")
+        self.assertIsNotNone(self.pathfinder.find_path(self.start, self.goal, max_nodes=100000))
+        self.worldmap.set_wall(_stairs, False)
+        self.assertEqual(self.worldmap.connector_chunks[0], set())
+        self.assertIsNone(self.pathfinder.find_path(self.start, self.goal))
+
+    def test_hierarchical_routes_climb_too(self):
+        self.worldmap.set_terrain(Position(20, 20, 0), "t_stairs_up")
+        _hierarchical = HierarchicalPathfinder(self.pathfinder, near=0)
+        _route = _hierarchical.find_path(self.start, self.goal, max_nodes=100000)
+        self.assertEqual(_route[-1], self.goal)
+        self.route_cost(self.start, _route)
+        self.assertEqual(self.climbs([self.start] + _route), [(20, 20, 0, 1)])
+        _best = self.pathfinder.find_path(self.start, self.goal, max_nodes=100000)
+        self.assertLess(
+            self.route_cost(self.start, _route), self.route_cost(self.start, _best) * 1.5
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
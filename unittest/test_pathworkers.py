@@ -0,0 +1,45 @@
+# run from the repository root: python -m pytest unittest
+
+import time
+import unittest
+
+from src.pathfinding import HierarchicalPathfinder
+from src.pathworkers import PathWorkers
+from src.position import Position
+from testworld import SmallWorldmap
+
+
+class PathWorkersTest(unittest.TestCase):
+    def setUp(self):
+        self.worldmap = SmallWorldmap(3, walls=0)
+        self.workers = PathWorkers(HierarchicalPathfinder(self.worldmap.pathfinder()))
+
+    def tearDown(self):
+        self.workers.stop()
+
+    def wait(self, count):
+        _completed = []
+        _deadline = time.time() + 5.0
+        while len(_completed) < count and time.time() < _deadline:
+            _completed.extend(self.workers.completed())
+            time.sleep(0.01)
+        return _completed
+
+    def test_one_snapshot_until_refresh(self):
+        _goal = Position(30, 30, 0)
+        self.workers.submit("a", Position(1, 1, 0), _goal)
+        self.workers.submit("b", Position(2, 1, 0), _goal, False)
+        self.assertEqual(self.workers.snapshots, 1)
+        _completed = dict(self.wait(2))
+        self.assertEqual(_completed["a"].route[-1], _goal)
+        self.assertFalse(_completed["b"].consider_impassable)
+
+        self.workers.refresh()
+        self.worldmap.set_wall(Position(30, 30, 0))
+        self.workers.submit("a", Position(1, 1, 0), _goal)
+        self.assertEqual(self.workers.snapshots, 2)
+        self.assertIsNone(dict(self.wait(1))["a"].route)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+# run from the repository root: python -m pytest unittest
+
+import random
+import socket
+import unittest
+
+from Mastermind import _mm_netutil as netutil
+from Mastermind._mm_constants import MM_ENCODING_JSON, MM_SEND_DISCONNECT
+
+
+def make_payload(number):
+    # random hex so the stream can't squeeze it down to nothing and the socket fills up.
+    _data = "%x" % random.getrandbits(8 * 4096)
+    return netutil.packet_payload({"number": number, "data": _data}, MM_ENCODING_JSON)
+
+
+class SendQueueTest(unittest.TestCase):
+    def setUp(self):
+        random.seed(1)
+        self.sender, self.receiver = socket.socketpair()
+        self.sender.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+        self.receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        self.sender.setblocking(False)
+        self.receiver.setblocking(False)
+
+    def tearDown(self):
+        self.sender.close()
+        self.receiver.close()
+
+    def drain(self, queue):
+        # flushes and reads until everything queued has arrived, returns what was decoded.
+        _buffer = netutil.PacketReceiveBuffer()
+        _received = []
+        while queue.pending() > 0 or _buffer.pending() > 0:
+            queue.flush(self.sender)
+            _messages, _connected = netutil.packet_recv_tcp(self.receiver, _buffer)
+            self.assertTrue(_connected, "the receiver couldn't decode the stream.")
+            _received.extend(_messages)
+            if not _messages and queue.pending() == 0:
+                break
+        return _received
+
+    def test_streamed_frames_survive_drops(self):
+        queue = netutil.PacketSendQueue(max_size=65536)
+        for number in range(8):
+            queue.put_streamed(*make_payload(number), 6)
+        # compresses the first frames into the stream, then the socket fills part way through.
+        queue.flush(self.sender)
+        self.assertGreater(queue.pending(), 0)
+        for number in range(8, 40):
+            queue.put_streamed(*make_payload(number), 6)
+        self.assertGreater(queue.dropped_frames, 0)
+
+        _received = self.drain(queue)
+        self.assertEqual(len(_received), 40 - queue.dropped_frames)
+        _numbers = [message["number"] for message in _received]
+        self.assertEqual(_numbers, sorted(_numbers))
+        self.assertEqual(_numbers[-1], 39)
+
+    def test_plain_frames_are_dropped_oldest_first(self):
+        queue = netutil.PacketSendQueue(max_size=65536)
+        for number in range(40):
+            flags, payload = make_payload(number)
+            queue.put(netutil.packet_frame(flags, payload, 6))
+        self.assertGreater(queue.dropped_frames, 0)
+        _numbers = [message["number"] for message in self.drain(queue)]
+        self.assertEqual(_numbers, list(range(queue.dropped_frames, 40)))
+
+    def test_disconnect_policy_refuses(self):
+        queue = netutil.PacketSendQueue(max_size=65536, policy=MM_SEND_DISCONNECT)
+        _results = [queue.put_streamed(*make_payload(number), 6) for number in range(40)]
+        self.assertIn(False, _results)
+        self.assertEqual(queue.dropped_frames, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+# run from the repository root: python -m pytest unittest
+
+import unittest
+
+from benchmarks.serializer import make_localmap
+from src.bodypart import Bodypart
+from src.calendar import Calendar
+from src.character import Character
+from src.furniture import Furniture
+from src.item import Container, Item, ItemManager
+from src.position import Position
+from src.profession import Profession
+from src.serializer import SCHEMA_MARKER, decode_packet, encode_packet
+from src.terrain import Terrain
+from src.worldmap import Chunk
+
+
+def round_trip(obj):
+    return decode_packet(encode_packet(obj))
+
+
+class SerializerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.item_manager = ItemManager()
+
+    def assert_round_trips(self, obj):
+        # what comes back encodes to exactly what went in.
+        _encoded = encode_packet(obj)
+        self.assertTrue(_encoded.startswith('["' + SCHEMA_MARKER + '"'))
+        _decoded = decode_packet(_encoded)
+        self.assertIs(type(_decoded), type(obj))
+        self.assertEqual(encode_packet(_decoded), _encoded)
+        return _decoded
+
+    def test_position(self):
+        _position = self.assert_round_trips(Position(1, -2, 3))
+        self.assertEqual((_position.x, _position.y, _position.z), (1, -2, 3))
+        self.assertIsNone(_position.previous)
+
+    def test_terrain_and_furniture(self):
+        _terrain = self.assert_round_trips(Terrain("t_wall", True))
+        self.assertEqual((_terrain.ident, _terrain.impassable), ("t_wall", True))
+        self.assertEqual(self.assert_round_trips(Furniture("f_chair")).ident, "f_chair")
+
+    def test_items_share_their_reference(self):
+        _ident = sorted(self.item_manager.ITEM_TYPES)[0]
+        _reference = self.item_manager.ITEM_TYPES[_ident]
+        _items = self.assert_round_trips([Item(_ident, _reference), Item(_ident, _reference)])
+        self.assertEqual(_items[0].reference, _reference)
+        self.assertIs(_items[0].reference, _items[1].reference)
+
+    def test_container(self):
+        _ident = next(
+            ident
+            for ident, reference in sorted(self.item_manager.ITEM_TYPES.items())
+            if "volume" in reference and "weight" in reference
+        )
+        _reference = self.item_manager.ITEM_TYPES[_ident]
+        _container = Container(_ident, _reference)
+        _container.contained_items.append(Item(_ident, _reference))
+        _decoded = self.assert_round_trips(_container)
+        self.assertEqual(len(_decoded.contained_items), 1)
+        self.assertIs(_decoded.contained_items[0].reference, _decoded.reference)
+
+    def test_bodyparts_with_and_without_a_grip(self):
+        self.assertFalse(hasattr(self.assert_round_trips(Bodypart("HEAD", True)), "slot_equipped"))
+        self.assertIsNone(self.assert_round_trips(Bodypart("HAND_LEFT")).slot_equipped)
+
+    def test_character(self):
+        _character = Character("Tester")
+        _character.position = Position(4, 5, 0)
+        _character.profession = Profession()
+        _decoded = self.assert_round_trips(_character)
+        self.assertEqual(_decoded.name, "Tester")
+        self.assertEqual(_decoded.profession.ident, "generic")
+        self.assertEqual(len(_decoded.body_parts), len(_character.body_parts))
+
+    def test_chunk(self):
+        _chunk = Chunk(1, 2, 0, 13)
+        _chunk.tiles[5]["terrain"] = Terrain("t_wall", True)
+        _decoded = self.assert_round_trips(_chunk)
+        self.assertEqual(len(_decoded.tiles), 13 * 13)
+        self.assertEqual(_decoded.tiles[5]["terrain"].ident, "t_wall")
+
+    def test_localmap(self):
+        self.assert_round_trips(make_localmap(self.item_manager))
+
+    def test_unregistered_objects_fall_back_to_jsonpickle(self):
+        _decoded = self.assert_round_trips({"calendar": Calendar(1, 2, 3, 4, 5, 6)})
+        self.assertIsInstance(_decoded["calendar"], Calendar)
+        self.assertEqual(vars(_decoded["calendar"]), vars(Calendar(1, 2, 3, 4, 5, 6)))
+        # dicts json can't carry as they are go the same way.
+        self.assertEqual(round_trip({1: "a", (2, 3): "b"}), {1: "a", (2, 3): "b"})
+        self.assertEqual(round_trip({"~Position": "not a schema"}), {"~Position": "not a schema"})
+
+    def test_plain_jsonpickle_still_decodes(self):
+        _position = decode_packet(encode_packet(Position(7, 8, 9), keys=True), keys=True)
+        self.assertEqual((_position.x, _position.y, _position.z), (7, 8, 9))
+
+
+if __name__ == "__main__":
+    unittest.main()
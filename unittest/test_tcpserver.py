@@ -0,0 +1,44 @@
+# run from the repository root: python -m pytest unittest
+
+import unittest
+
+from Mastermind._mm_client import MastermindClientTCP
+from Mastermind._mm_server import MastermindServerTCP
+
+
+class RefusingServer(MastermindServerTCP):
+    # answers "quit" the way the game server turns away a bad password: a reply, then terminate().
+    def callback_client_handle(self, connection_object, data):
+        if data.get("kind") == "quit":
+            for number in range(50):
+                self.callback_client_send(
+                    connection_object, {"kind": "bye", "number": number, "pad": "x" * 4096}
+                )
+            connection_object.terminate()
+            return
+        self.callback_client_send(connection_object, data)
+
+
+class TCPServerTest(unittest.TestCase):
+    def setUp(self):
+        self.server = RefusingServer(0.1, 0.1, 5.0)
+        self.server.connect("127.0.0.1", 0)
+        self.server.accepting_allow()
+        self.port = self.server._mm_unconnected_socket.getsockname()[1]
+        self.client = MastermindClientTCP(5.0, 5.0)
+        self.client.connect("127.0.0.1", self.port)
+
+    def tearDown(self):
+        self.client.disconnect()
+        self.server.accepting_disallow()
+        self.server.disconnect_clients()
+        self.server.disconnect()
+
+    def test_frames_queued_before_terminate_are_sent(self):
+        self.client.send({"kind": "quit"})
+        for number in range(50):
+            self.assertEqual(self.client.receive(True)["number"], number)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+# run from the repository root: python -m pytest unittest
+
+import unittest
+
+from Mastermind import _mm_netutil as netutil
+from Mastermind._mm_client import MastermindClientUDP
+from Mastermind._mm_constants import MM_FLAG_BINARY, MM_UDP_MAX_PAYLOAD_SIZE
+from Mastermind._mm_server import MastermindServerUDP
+
+
+class EchoServer(MastermindServerUDP):
+    # echoes everything back, except "raise" which raises and "big" which replies with too much.
+    def callback_client_handle(self, connection_object, data):
+        if data.get("kind") == "raise":
+            raise RuntimeError("handler failed")
+        if data.get("kind") == "big":
+            _sent = connection_object.send({"data": "x" * (MM_UDP_MAX_PAYLOAD_SIZE * 2)})
+            connection_object.send({"big_sent": _sent})
+            return
+        connection_object.send(data)
+
+
+class RecordingSocket:
+    # the client's socket, keeping every datagram it receives.
+    def __init__(self, sock):
+        self.sock = sock
+        self.received = []
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def send(self, data):
+        return self.sock.send(data)
+
+    def recv(self, size):
+        _datagram = self.sock.recv(size)
+        self.received.append(_datagram)
+        return _datagram
+
+    def close(self):
+        self.sock.close()
+
+
+class UDPServerTest(unittest.TestCase):
+    def setUp(self):
+        self.server = EchoServer(0.1, 0.1, 5.0)
+        self.server.connect("127.0.0.1", 0)
+        self.server.accepting_allow()
+        self.port = self.server._mm_unconnected_socket.getsockname()[1]
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.disconnect()
+        self.server.accepting_disallow()
+        self.server.disconnect_clients()
+        self.server.disconnect()
+
+    def client(self):
+        _client = MastermindClientUDP(None, 5.0)
+        _client.connect("127.0.0.1", self.port)
+        self.clients.append(_client)
+        return _client
+
+    def test_handler_errors_only_lose_that_message(self):
+        _client = self.client()
+        _client.send({"kind": "raise"})
+        _client.send({"kind": "echo", "number": 1})
+        self.assertEqual(_client.receive(True), {"kind": "echo", "number": 1})
+        # and the server thread is still there for everyone else.
+        _other = self.client()
+        _other.send({"kind": "echo", "number": 2})
+        self.assertEqual(_other.receive(True), {"kind": "echo", "number": 2})
+
+    def test_oversized_reply_is_refused(self):
+        _client = self.client()
+        _client.send({"kind": "big"})
+        self.assertEqual(_client.receive(True), {"big_sent": False})
+        _other = self.client()
+        _other.send({"kind": "echo", "number": 3})
+        self.assertEqual(_other.receive(True), {"kind": "echo", "number": 3})
+
+    def test_hello_reply_is_json(self):
+        _client = MastermindClientUDP(None, 5.0)
+        _make_connection = _client._mm_make_connection
+
+        def make_connection(ip, port):
+            _make_connection(ip, port)
+            _client._mm_socket = RecordingSocket(_client._mm_socket)
+
+        _client._mm_make_connection = make_connection
+        _client.connect("127.0.0.1", self.port)
+        self.clients.append(_client)
+        _client.send({"kind": "echo", "number": 4})
+        self.assertEqual(_client.receive(True), {"kind": "echo", "number": 4})
+
+        _hellos = []
+        _session = netutil.PacketUDPSession()
+        for datagram in _client._mm_socket.received:
+            _payloads, _, _ = _session.receive(datagram)
+            for payload in _payloads:
+                if netutil.is_hello(netutil.decode_payload(payload)):
+                    _hellos.append(payload[0])
+        self.assertEqual(len(_hellos), 1)
+        self.assertFalse(_hellos[0] & MM_FLAG_BINARY)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+# run from the repository root: python -m pytest unittest
+
+import unittest
+
+from src.character import Character
+from src.furniture import Furniture
+from src.position import Position
+from src.serializer import decode_packet, encode_packet
+from src.terrain import Terrain
+from testworld import SmallWorldmap
+
+BITMAPS = ("terrain_blocked", "furniture_blocked", "occupied", "opaque", "goes_up", "goes_down")
+
+
+class PassabilityTest(unittest.TestCase):
+    def setUp(self):
+        self.worldmap = SmallWorldmap(3, walls=0.2)
+        self.position = Position(15, 17, 0)
+        self.chunk = self.worldmap.get_chunk_by_position(self.position)
+        self.index = self.chunk.get_tile_index(self.position)
+        self.tile = self.chunk.tiles[self.index]
+
+    def bits(self, index=None):
+        _index = self.index if index is None else index
+        return dict((name, getattr(self.chunk, name) >> _index & 1) for name in BITMAPS)
+
+    def test_bitmaps_match_the_tiles(self):
+        for chunk in (self.worldmap.get_chunk_by_position(Position(x, 0, 0)) for x in (0, 20)):
+            for index, tile in enumerate(chunk.tiles):
+                _wall = tile["terrain"].ident == "t_wall"
+                self.assertEqual(chunk.is_blocked(index), _wall)
+                self.assertEqual(chunk.is_opaque(index), _wall)
+                self.assertEqual(chunk.open_mask() >> index & 1, 0 if _wall else 1)
+
+    def test_bitmaps_follow_changes(self):
+        self.worldmap.set_wall(self.position, False)
+        self.assertEqual(set(self.bits().values()), {0})
+        _version = self.chunk.terrain_version
+
+        self.worldmap.set_wall(self.position)
+        self.assertEqual(self.bits()["terrain_blocked"], 1)
+        self.assertEqual(self.bits()["opaque"], 1)
+        self.assertGreater(self.chunk.terrain_version, _version)
+        self.worldmap.set_wall(self.position, False)
+
+        # furniture with a negative move_cost_mod blocks, not furniture in general.
+        self.tile["furniture"] = Furniture("f_fridge")
+        self.worldmap.mark_tile_changed(self.position, terrain=True)
+        self.assertEqual(self.bits()["furniture_blocked"], 1)
+        self.assertTrue(self.chunk.is_blocked(self.index))
+        self.assertFalse(self.chunk.is_blocked(self.index, furniture=False))
+        self.tile["furniture"] = None
+        self.worldmap.mark_tile_changed(self.position, terrain=True)
+
+        # creatures only block when asked about.
+        _version = self.chunk.terrain_version
+        self.worldmap.put_object_at_position(Character("Tester"), self.position)
+        self.assertEqual(self.bits()["occupied"], 1)
+        self.assertFalse(self.chunk.is_blocked(self.index, creatures=False))
+        self.assertEqual(self.chunk.open_mask() >> self.index & 1, 1)
+        self.assertEqual(self.chunk.open_mask(creatures=True) >> self.index & 1, 0)
+        self.assertEqual(self.chunk.terrain_version, _version)
+
+    def test_stairs(self):
+        self.tile["terrain"] = Terrain("t_stairs_up")
+        self.worldmap.mark_tile_changed(self.position, terrain=True)
+        self.assertEqual(self.bits()["goes_up"], 1)
+        self.assertTrue(self.chunk.connects(self.index, 1))
+        self.assertFalse(self.chunk.connects(self.index, -1))
+        self.assertIn((self.chunk.x, self.chunk.y), self.worldmap.connector_chunks[0])
+        self.worldmap.set_wall(self.position, False)
+        self.assertNotIn((self.chunk.x, self.chunk.y), self.worldmap.connector_chunks[0])
+
+    def test_neighbour_masks(self):
+        _size = self.chunk.chunk_size
+        _open = self.chunk.open_mask()
+        _masks = self.chunk.neighbour_masks(_open)
+        for bit, (dx, dy) in enumerate(((1, 0), (-1, 0), (0, 1), (0, -1))):
+            for index in range(_size * _size):
+                x, y = divmod(index, _size)
+                _inside = 0 <= x + dx < _size and 0 <= y + dy < _size
+                _expected = _inside and _open >> ((x + dx) * _size + y + dy) & 1 == 1
+                self.assertEqual(_masks[bit] >> index & 1 == 1, _expected)
+
+    def test_bitmaps_survive_the_serializer(self):
+        self.tile["terrain"] = Terrain("t_stairs_up")
+        self.worldmap.put_object_at_position(Character("Tester"), self.position)
+        _decoded = decode_packet(encode_packet(self.chunk))
+        for name in BITMAPS:
+            self.assertEqual(getattr(_decoded, name), getattr(self.chunk, name), name)
+
+    def test_masked_chunks_only_tell_about_what_is_visible(self):
+        self.tile["terrain"] = Terrain("t_stairs_up")
+        self.worldmap.put_object_at_position(Character("Tester"), self.position)
+        _visible = self.chunk.open_mask() & ~(1 << self.index)
+        _masked = self.chunk.masked(_visible)
+        for name in BITMAPS:
+            self.assertEqual(getattr(_masked, name), getattr(self.chunk, name) & _visible, name)
+        self.assertEqual(self.bits()["goes_up"], 1)
+        self.assertIs(self.chunk.masked((1 << len(self.chunk.tiles)) - 1), self.chunk)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+import logging
+import random
+from collections import defaultdict
+
+from src.furniture import FurnitureManager
+from src.pathfinding import Pathfinder
+from src.terrain import Terrain
+from src.tilemanager import TileManager
+from src.worldmap import Chunk, Worldmap
+
+
+class SmallWorldmap(Worldmap):
+    # size by size chunks of dirt with walls scattered over them, only in memory so tests don't
+    # touch ./worlds.
+    def __init__(self, size=3, walls=0.2, seed=1):
+        self._log = logging.getLogger("worldmap")
+        self.WORLD_SIZE = size
+        self.chunk_size = 13
+        self.FurnitureManager = FurnitureManager()
+        self.TileManager = TileManager()
+        self.connector_chunks = defaultdict(set)
+        self.WORLDMAP = defaultdict(dict)
+        _random = random.Random(seed)
+        for i in range(size):
+            for j in range(size):
+                _chunk = Chunk(i, j, 0, self.chunk_size)
+                for tile in _chunk.tiles:
+                    if _random.random() < walls:
+                        tile["terrain"] = Terrain("t_wall", True)
+                self.WORLDMAP[i][j] = {0: _chunk}
+                self.update_chunk_passability(_chunk)
+
+    def add_level(self, z, terrain="t_floor"):
+        # another level of the same size, all terrain.
+        for i in range(self.WORLD_SIZE):
+            for j in range(self.WORLD_SIZE):
+                _chunk = Chunk(i, j, z, self.chunk_size)
+                for tile in _chunk.tiles:
+                    tile["terrain"] = Terrain(terrain)
+                self.WORLDMAP[i][j][z] = _chunk
+                self.update_chunk_passability(_chunk)
+
+    def set_terrain(self, position, ident, impassable=False):
+        # changes the terrain the way the server does, bumping the chunk's terrain_version.
+        tile = self.get_tile_by_position(position)
+        tile["terrain"] = Terrain(ident, impassable)
+        self.mark_tile_changed(position, terrain=True)
+
+    def set_wall(self, position, wall=True):
+        if wall:
+            self.set_terrain(position, "t_wall", True)
+        else:
+            self.set_terrain(position, "t_dirt")
+
+    def pathfinder(self):
+        return Pathfinder(
+            self, self.TileManager.TILE_TYPES, self.FurnitureManager.FURNITURE_TYPES
+        )